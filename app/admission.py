@@ -0,0 +1,175 @@
+import os
+import logging
+from typing import List, Optional
+
+from app.downloader import VideoProcessingError, MAX_FILE_SIZE_MB, STREAM_UPLOADS, VIDEO_FORMAT
+from app.profiles import OutputProfile, DEFAULT_PROFILE
+from app.metrics import ADMISSION_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+MAX_DURATION_SECONDS = int(os.getenv("MAX_DURATION_SECONDS", "0"))  # 0 disables
+
+
+class AdmissionError(VideoProcessingError):
+    """Raised when a video is rejected before downloading"""
+    pass
+
+
+def estimate_size(fmt: dict, duration: Optional[float]) -> Optional[int]:
+    """Size of a format from its metadata, falling back to bitrate x duration"""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return int(size)
+    if fmt.get("tbr") and duration:
+        return int(fmt["tbr"] * 1000 / 8 * duration)
+    return None
+
+
+def selected_size(info: dict) -> Optional[int]:
+    """Estimated download size of the formats yt-dlp selected, None if unknown"""
+    duration = info.get("duration")
+    sizes = [estimate_size(fmt, duration) for fmt in info.get("requested_formats") or [info]]
+    if not sizes or None in sizes:
+        return None
+    return sum(sizes)
+
+
+def _is_video(fmt: dict) -> bool:
+    return fmt.get("vcodec") not in (None, "none")
+
+
+def _is_audio(fmt: dict) -> bool:
+    return fmt.get("acodec") not in (None, "none")
+
+
+def _fits(fmt: dict, profile: OutputProfile, streaming: bool) -> bool:
+    """Whether a format can end up in the profile's container"""
+    if streaming or profile.container == "webm":
+        return fmt.get("ext") == profile.container
+    return True
+
+
+def _candidates(info: dict, profile: OutputProfile, streaming: bool) -> List[tuple]:
+    """(height, bitrate, size, selector) of every way to produce the profile with a known size"""
+    duration = info.get("duration")
+    formats = info.get("formats") or []
+    candidates: List[tuple] = []
+
+    if profile.audio_only:
+        for fmt in formats:
+            size = estimate_size(fmt, duration)
+            if size is not None and _is_audio(fmt) and not _is_video(fmt) and _fits(fmt, profile, streaming):
+                candidates.append((0, fmt.get("abr") or fmt.get("tbr") or 0, size, fmt["format_id"]))
+        return candidates
+
+    for fmt in formats:
+        size = estimate_size(fmt, duration)
+        if size is None or (fmt.get("height") or 0) > profile.max_height:
+            continue
+        if _is_video(fmt) and _is_audio(fmt) and _fits(fmt, profile, streaming):
+            candidates.append((fmt.get("height") or 0, fmt.get("tbr") or 0, size, fmt["format_id"]))
+
+    if not streaming:
+        audio = [
+            (fmt, estimate_size(fmt, duration))
+            for fmt in formats
+            if _is_audio(fmt) and not _is_video(fmt) and _fits(fmt, profile, streaming)
+        ]
+        audio = [(fmt, size) for fmt, size in audio if size is not None]
+        if audio:
+            # The smallest audio track leaves the most room for video
+            audio_fmt, audio_size = min(audio, key=lambda item: item[1])
+            for fmt in formats:
+                if not _is_video(fmt) or _is_audio(fmt) or (fmt.get("height") or 0) > profile.max_height:
+                    continue
+                size = estimate_size(fmt, duration)
+                if size is not None and _fits(fmt, profile, streaming):
+                    candidates.append((
+                        fmt.get("height") or 0,
+                        fmt.get("tbr") or 0,
+                        size + audio_size,
+                        f"{fmt['format_id']}+{audio_fmt['format_id']}",
+                    ))
+
+    return candidates
+
+
+def profile_size(info: dict, profile: OutputProfile, streaming: bool) -> Optional[int]:
+    """Estimated download size of the best formats for a profile, None if unknown"""
+    candidates = _candidates(info, profile, streaming)
+    if not candidates:
+        return None
+    return max(candidates)[2]
+
+
+def _downgrade(info: dict, max_bytes: int, streaming: bool, profile: OutputProfile = DEFAULT_PROFILE) -> Optional[str]:
+    """
+    Find the highest quality format combination for the profile that fits in max_bytes
+
+    Returns:
+        An explicit yt-dlp format selector, or None if nothing fits
+    """
+    candidates = [candidate for candidate in _candidates(info, profile, streaming) if candidate[2] <= max_bytes]
+    if not candidates:
+        return None
+    return max(candidates)[3]
+
+
+def admit(
+    info: dict,
+    max_bytes: int = MAX_FILE_SIZE_MB * 1024 * 1024,
+    max_duration: int = MAX_DURATION_SECONDS,
+    streaming: bool = STREAM_UPLOADS,
+    profile: OutputProfile = DEFAULT_PROFILE,
+) -> Optional[str]:
+    """
+    Decide from extracted metadata whether and how a video is downloaded
+
+    Args:
+        info: yt-dlp info dict, extracted with the default format selector
+        profile: Output profile the download is for
+
+    Returns:
+        None to download with the profile's format selector, or a smaller
+        explicit selector when its selection would exceed max_bytes
+
+    Raises:
+        AdmissionError: If the video is live, too long or has no format
+            that fits in max_bytes
+    """
+    if not ADMISSION_CONTROL:
+        return None
+
+    if info.get("is_live"):
+        ADMISSION_DECISIONS.labels(decision="rejected").inc()
+        raise AdmissionError("Live streams cannot be downloaded")
+
+    duration = info.get("duration")
+    if max_duration and duration and duration > max_duration:
+        ADMISSION_DECISIONS.labels(decision="rejected").inc()
+        raise AdmissionError(f"Video duration ({duration / 60:.0f} min) exceeds limit ({max_duration / 60:.0f} min)")
+
+    if profile.format_selector(streaming) == VIDEO_FORMAT:
+        size = selected_size(info)
+    else:
+        # The extraction selected formats for the default selector, not this profile's
+        size = profile_size(info, profile, streaming)
+    if size is None or size <= max_bytes:
+        # Unknown sizes are left to the byte cap enforced during the download
+        ADMISSION_DECISIONS.labels(decision="admitted").inc()
+        return None
+
+    selector = _downgrade(info, max_bytes, streaming, profile)
+    if selector is None:
+        ADMISSION_DECISIONS.labels(decision="rejected").inc()
+        raise AdmissionError(
+            f"Estimated size ({size / 1024 / 1024:.1f}MB) exceeds limit "
+            f"({max_bytes / 1024 / 1024:.0f}MB) and no smaller format fits"
+        )
+
+    ADMISSION_DECISIONS.labels(decision="downgraded").inc()
+    logger.info(f"Estimated size {size / 1024 / 1024:.1f}MB exceeds limit, downgrading to format {selector}")
+    return selector
@@ -1,77 +1,64 @@
 import os
+import hmac
+import math
 import secrets
-import hashlib
 from typing import Optional
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import logging
 
+from app.metrics import RATE_LIMIT_REJECTIONS
+from app.ratelimit import request_limiter
+from app.keys import ApiKey, KeyRegistry, key_registry, hash_key
+
 logger = logging.getLogger(__name__)
 
 # Security scheme
 security = HTTPBearer(auto_error=False)
 
+# Scheduling priority for keys without an explicit one, lower runs first
+DEFAULT_PRIORITY = int(os.getenv("DEFAULT_PRIORITY", "10"))
+# Credential for registering keys through /generate-key, unset disables registration
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+
 class TokenValidator:
-    """Handle Bearer token validation"""
+    """Handle Bearer token validation against the key registry"""
     
-    def __init__(self):
-        # Get API keys from environment - support multiple keys
-        self.api_keys = self._load_api_keys()
-        if not self.api_keys:
+    def __init__(self, registry: KeyRegistry = key_registry):
+        self.registry = registry
+        if not len(registry):
             logger.warning("No API keys configured! All requests will be rejected.")
     
-    def _load_api_keys(self) -> set:
-        """Load API keys from environment variables"""
-        keys = set()
-        
-        # Primary API key
-        primary_key = os.getenv("API_KEY")
-        if primary_key:
-            keys.add(self._hash_key(primary_key))
-        
-        # Support multiple API keys (API_KEY_1, API_KEY_2, etc.)
-        i = 1
-        while True:
-            key = os.getenv(f"API_KEY_{i}")
-            if not key:
-                break
-            keys.add(self._hash_key(key))
-            i += 1
-        
-        # Support comma-separated keys in single env var
-        keys_csv = os.getenv("API_KEYS")
-        if keys_csv:
-            for key in keys_csv.split(","):
-                key = key.strip()
-                if key:
-                    keys.add(self._hash_key(key))
-        
-        logger.info(f"Loaded {len(keys)} API key(s)")
-        return keys
-    
-    def _hash_key(self, key: str) -> str:
-        """Hash API key for secure comparison"""
-        return hashlib.sha256(key.encode()).hexdigest()
-    
     def validate_token(self, token: str) -> bool:
-        """Validate bearer token against configured API keys"""
-        if not self.api_keys:
-            return False
-        
-        token_hash = self._hash_key(token)
-        return token_hash in self.api_keys
+        """Validate bearer token against configured and registered API keys"""
+        return self.registry.lookup(token) is not None
 
 # Global token validator instance
 token_validator = TokenValidator()
 
-async def verify_token(
+async def get_api_key(
     credentials: Optional[HTTPAuthorizationCredentials] = Security(security)
+) -> Optional[ApiKey]:
+    """
+    Dependency returning the caller's key and its limits, None if unknown
+    
+    Resolved once per request and shared by the dependencies below.
+    Authentication itself is enforced by verify_token.
+    """
+    if not credentials:
+        return None
+    return token_validator.registry.lookup(credentials.credentials)
+
+async def verify_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(security),
+    key: Optional[ApiKey] = Depends(get_api_key)
 ) -> bool:
     """
     Dependency to verify Bearer token
     
     Args:
         credentials: HTTP authorization credentials
+        key: The caller's key, looked up by get_api_key
         
     Returns:
         bool: True if token is valid
@@ -95,7 +82,7 @@ async def verify_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not token_validator.validate_token(credentials.credentials):
+    if key is None:
         logger.warning("Invalid or expired token")
         raise HTTPException(
             status_code=401,
@@ -106,6 +93,46 @@ async def verify_token(
     logger.debug("Token validated successfully")
     return True
 
+async def verify_admin_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(security)
+) -> bool:
+    """
+    Dependency to verify the admin Bearer token (ADMIN_API_KEY)
+    
+    Client keys are not accepted, so clients cannot mint keys or choose
+    their own limits.
+    
+    Raises:
+        HTTPException: 403 if no admin key is configured, 401 if the token is missing or wrong
+    """
+    if not ADMIN_API_KEY:
+        raise HTTPException(
+            status_code=403,
+            detail="Key registration is disabled, set ADMIN_API_KEY to enable it",
+        )
+    if (
+        not credentials
+        or credentials.scheme.lower() != "bearer"
+        or not hmac.compare_digest(hash_key(credentials.credentials), hash_key(ADMIN_API_KEY))
+    ):
+        logger.warning("Invalid admin token")
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return True
+
+async def get_request_priority(key: Optional[ApiKey] = Depends(get_api_key)) -> int:
+    """
+    Dependency returning the scheduling priority of the caller's API key
+    
+    Authentication itself is enforced by verify_token.
+    """
+    if key is None or key.priority is None:
+        return DEFAULT_PRIORITY
+    return key.priority
+
 def generate_api_key(length: int = 32) -> str:
     """
     Generate a secure API key
@@ -118,54 +145,24 @@ def generate_api_key(length: int = 32) -> str:
     """
     return secrets.token_urlsafe(length)
 
-# Optional: Rate limiting per token (basic implementation)
-class TokenRateLimiter:
-    """Simple in-memory rate limiter per token"""
-    
-    def __init__(self):
-        self.requests = {}  # token_hash -> (count, reset_time)
-        self.max_requests = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
-        self.window_seconds = int(os.getenv("RATE_LIMIT_WINDOW", "3600"))  # 1 hour
+async def get_api_key_id(key: Optional[ApiKey] = Depends(get_api_key)) -> Optional[str]:
+    """
+    Dependency returning the identifier of the caller's API key
     
-    def is_allowed(self, token: str) -> bool:
-        """Check if request is allowed based on rate limit"""
-        import time
-        
-        if not token:
-            return False
-        
-        token_hash = hashlib.sha256(token.encode()).hexdigest()[:16]  # Short hash for memory
-        current_time = time.time()
-        
-        if token_hash not in self.requests:
-            self.requests[token_hash] = (1, current_time + self.window_seconds)
-            return True
-        
-        count, reset_time = self.requests[token_hash]
-        
-        # Reset if window expired
-        if current_time > reset_time:
-            self.requests[token_hash] = (1, current_time + self.window_seconds)
-            return True
-        
-        # Check if under limit
-        if count < self.max_requests:
-            self.requests[token_hash] = (count + 1, reset_time)
-            return True
-        
-        return False
-
-# Global rate limiter instance
-rate_limiter = TokenRateLimiter()
+    Authentication itself is enforced by verify_token.
+    """
+    return key.key_id if key else None
 
 async def verify_token_with_rate_limit(
-    credentials: Optional[HTTPAuthorizationCredentials] = Security(security)
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(security),
+    key: Optional[ApiKey] = Depends(get_api_key)
 ) -> bool:
     """
     Dependency to verify Bearer token with rate limiting
     
     Args:
         credentials: HTTP authorization credentials
+        key: The caller's key, looked up by get_api_key
         
     Returns:
         bool: True if token is valid and within rate limit
@@ -174,15 +171,17 @@ async def verify_token_with_rate_limit(
         HTTPException: If token is invalid, missing, or rate limited
     """
     # First verify the token
-    await verify_token(credentials)
+    await verify_token(credentials, key)
     
     # Then check rate limit
-    if not rate_limiter.is_allowed(credentials.credentials):
+    result = request_limiter.hit(key.key_id)
+    if not result.allowed:
         logger.warning("Rate limit exceeded for token")
+        RATE_LIMIT_REJECTIONS.labels(limit="requests").inc()
         raise HTTPException(
             status_code=429,
             detail="Rate limit exceeded. Try again later.",
-            headers={"Retry-After": str(rate_limiter.window_seconds)}
+            headers={"Retry-After": str(math.ceil(result.retry_after))}
         )
     
     return True
\ No newline at end of file
@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+import itertools
+from typing import Dict, Optional
+
+from app.auth import DEFAULT_PRIORITY
+from app.metrics import BANDWIDTH_ACTIVE_DOWNLOADS, BANDWIDTH_THROTTLE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DOWNLOAD_BANDWIDTH_MBPS = float(os.getenv("DOWNLOAD_BANDWIDTH_MBPS", "0"))  # Budget shared by all downloads, 0 disables
+BANDWIDTH_BURST_SECONDS = 2.0  # Unused share a download may save up
+MIN_PAUSE_SECONDS = 0.1  # Shorter overshoots are carried over rather than paused for
+
+
+def priority_weight(priority: int) -> float:
+    """
+    Share weight of a priority, lower priority values get more
+
+    A priority-0 download gets twice the share of one at DEFAULT_PRIORITY
+    and three times that of one at twice DEFAULT_PRIORITY.
+    """
+    return DEFAULT_PRIORITY / (DEFAULT_PRIORITY + max(0, priority)) if DEFAULT_PRIORITY > 0 else 1.0
+
+
+class _Allotment:
+    def __init__(self, weight: float, credit: float):
+        self.weight = weight
+        self.credit = credit
+        self.updated = time.monotonic()
+        self.received = 0
+
+
+class BandwidthShaper:
+    """
+    Weighted fair share of a global download budget across running downloads
+
+    Each download gets budget * weight / total weight of the downloads
+    running at that moment, so shares grow as soon as others finish. Its
+    credit refills at that rate and is spent by the bytes it reports in
+    progress events; a download that overdraws is told how long to pause
+    (its process group is stopped for that long, see app.supervisor), so
+    TCP flow control slows the sender instead of yt-dlp buffering ahead.
+    The budget is per process, divide it by the number of processes
+    running downloads on a host.
+    """
+
+    def __init__(self, budget_bytes_per_second: float = DOWNLOAD_BANDWIDTH_MBPS * 1024 * 1024):
+        self.budget = budget_bytes_per_second
+        self._allotments: Dict[int, _Allotment] = {}
+        self._ids = itertools.count()
+        self.throttled_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def _total_weight(self) -> float:
+        return sum(allotment.weight for allotment in self._allotments.values())
+
+    def share(self, download_id: int) -> float:
+        """Current rate of a download in bytes per second"""
+        allotment = self._allotments[download_id]
+        return self.budget * allotment.weight / self._total_weight()
+
+    def register(self, priority: int = DEFAULT_PRIORITY) -> Optional[int]:
+        """Start accounting for a download, None when shaping is off"""
+        if not self.enabled:
+            return None
+        download_id = next(self._ids)
+        # Start with a full burst so short downloads are never paused
+        weight = priority_weight(priority)
+        rate = self.budget * weight / (self._total_weight() + weight)
+        self._allotments[download_id] = _Allotment(weight, rate * BANDWIDTH_BURST_SECONDS)
+        BANDWIDTH_ACTIVE_DOWNLOADS.set(len(self._allotments))
+        return download_id
+
+    def unregister(self, download_id: Optional[int]) -> None:
+        if download_id is None:
+            return
+        self._allotments.pop(download_id, None)
+        BANDWIDTH_ACTIVE_DOWNLOADS.set(len(self._allotments))
+
+    def consume(self, download_id: Optional[int], received: int) -> float:
+        """
+        Account for a download's total bytes received so far
+
+        Returns:
+            Seconds the download should pause to stay within its share
+        """
+        allotment = self._allotments.get(download_id) if download_id is not None else None
+        if allotment is None:
+            return 0.0
+        rate = self.share(download_id)
+        now = time.monotonic()
+        allotment.credit = min(
+            allotment.credit + rate * (now - allotment.updated),
+            rate * BANDWIDTH_BURST_SECONDS,
+        )
+        allotment.updated = now
+        allotment.credit -= max(0, received - allotment.received)
+        allotment.received = max(allotment.received, received)
+        if allotment.credit >= 0:
+            return 0.0
+        pause = -allotment.credit / rate
+        if pause < MIN_PAUSE_SECONDS:
+            return 0.0
+        self.throttled_seconds += pause
+        BANDWIDTH_THROTTLE_SECONDS.inc(pause)
+        return pause
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "budget_bytes_per_second": int(self.budget),
+            "active_downloads": len(self._allotments),
+            "throttled_seconds": round(self.throttled_seconds, 1),
+        }
+
+
+# Global bandwidth shaper instance
+bandwidth_shaper = BandwidthShaper()
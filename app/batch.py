@@ -0,0 +1,268 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.cache import extract_video_id
+from app.jobs import (
+    Job,
+    JobStatus,
+    JobQueue,
+    JobStore,
+    FINISHED_STATUSES,
+    JOB_POLL_INTERVAL,
+    WORKER_LEASE_SECONDS,
+    QueueFullError,
+    job_store,
+    job_queue,
+)
+from app.ratelimit import bytes_limiter, job_limiter
+from app.worker import get_cached_s3_key
+from app.profiles import OutputProfile, DEFAULT_PROFILE
+from app.metrics import JOBS_RECOVERED
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))  # Items of one batch queued or running at once
+# Added to the key's priority so bulk ingestion yields to interactive requests
+BATCH_PRIORITY_OFFSET = int(os.getenv("BATCH_PRIORITY_OFFSET", "10"))
+QUEUE_FULL_RETRY_SECONDS = 5
+
+
+def summarize_batch(jobs: List[Job]) -> dict:
+    """Aggregate progress of a batch from its jobs"""
+    counts: Dict[str, int] = {}
+    for job in jobs:
+        counts[job.status.value] = counts.get(job.status.value, 0) + 1
+    finished = sum(1 for job in jobs if job.status in FINISHED_STATUSES)
+    return {
+        "total": len(jobs),
+        "finished": finished,
+        "progress": round(finished / len(jobs) * 100, 1) if jobs else 100.0,
+        "counts": counts,
+    }
+
+
+class BatchDispatcher:
+    """
+    Feeds the items of each batch into the job queue a few at a time
+
+    Every item is recorded as a PENDING job up front, so a batch's progress
+    can be read from the job store by any process, and moved to the job
+    queue once one of the batch's BATCH_CONCURRENCY slots is free. Items
+    also wait for the key's concurrent job limit instead of being rejected.
+    Batches are dispatched by the API process that accepted them, whose
+    worker_id is stamped on the pending items; recover() resumes the
+    batches of processes that stopped before dispatching them all, once
+    per lease interval after start().
+    """
+
+    def __init__(self, store: JobStore, queue: JobQueue, concurrency: int = BATCH_CONCURRENCY):
+        self.store = store
+        self.queue = queue
+        self.concurrency = concurrency
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._recovery: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> int:
+        return len(self._tasks)
+
+    async def submit(
+        self,
+        urls: List[str],
+        priority: int,
+        api_key_id: Optional[str],
+        profile: OutputProfile = DEFAULT_PROFILE,
+    ) -> Tuple[str, List[Job]]:
+        """
+        Record a batch and start dispatching it
+
+        URLs of the same video are collapsed into one item and videos
+        already in the result cache are recorded as done right away.
+
+        Returns:
+            The batch id and its jobs
+        """
+        batch_id = uuid.uuid4().hex
+        # Up to BATCH_MAX_ITEMS cache lookups and one bulk insert, kept off the event loop
+        jobs = await asyncio.to_thread(self._record, batch_id, urls, priority, api_key_id, profile)
+
+        pending = [job for job in jobs if job.status == JobStatus.PENDING]
+        logger.info(f"Batch {batch_id}: {len(jobs)} item(s), {len(jobs) - len(pending)} already stored")
+        if pending:
+            self._tasks[batch_id] = asyncio.create_task(self._run(batch_id, pending), name=f"batch-{batch_id}")
+        return batch_id, jobs
+
+    def _record(
+        self,
+        batch_id: str,
+        urls: List[str],
+        priority: int,
+        api_key_id: Optional[str],
+        profile: OutputProfile,
+    ) -> List[Job]:
+        jobs: List[Job] = []
+        seen = set()
+        for url in urls:
+            identity = extract_video_id(url) or url
+            if identity in seen:
+                continue
+            seen.add(identity)
+
+            job = Job(
+                url=url,
+                status=JobStatus.PENDING,
+                priority=priority + BATCH_PRIORITY_OFFSET,
+                api_key_id=api_key_id,
+                worker_id=self.queue.worker_id,
+                batch_id=batch_id,
+                profile=profile.name,
+            )
+            cached_key = get_cached_s3_key(url, profile)
+            if cached_key:
+                job.status = JobStatus.DONE
+                job.s3_key = cached_key
+                job.finished_at = time.time()
+            jobs.append(job)
+        return self.store.create_many(jobs)
+
+    async def cancel(self, batch_id: str) -> int:
+        """
+        Cancel every unfinished item of a batch
+
+        Returns:
+            Number of items cancelled
+        """
+        task = self._tasks.pop(batch_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        cancelled = 0
+        for job in await asyncio.to_thread(self.store.list_batch, batch_id):
+            if job.status in FINISHED_STATUSES:
+                continue
+            if job.status == JobStatus.PENDING:
+                await asyncio.to_thread(self.store.set_status, job.id, JobStatus.CANCELLED)
+                cancelled += 1
+            elif await self.queue.cancel(job.id):
+                cancelled += 1
+        return cancelled
+
+    def start(self) -> None:
+        """Resume orphaned batches now and whenever another process stops"""
+        self._recovery = asyncio.create_task(self._recover_periodically(), name="batch-recovery")
+
+    async def _recover_periodically(self) -> None:
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.warning(f"Batch recovery failed: {str(e)}")
+            await asyncio.sleep(WORKER_LEASE_SECONDS)
+
+    async def recover(self) -> int:
+        """
+        Resume dispatching batches whose process stopped with items still pending
+
+        Items already queued or running count against the batch's
+        concurrency until they finish.
+
+        Returns:
+            Number of pending items taken over
+        """
+        adopted = await asyncio.to_thread(self._adopt_orphans)
+        for batch_id, (pending, running) in adopted.items():
+            logger.info(f"Resuming batch {batch_id}: {len(pending)} pending item(s)")
+            self._tasks[batch_id] = asyncio.create_task(self._run(batch_id, running + pending), name=f"batch-{batch_id}")
+
+        count = sum(len(pending) for pending, _ in adopted.values())
+        if count:
+            JOBS_RECOVERED.inc(count)
+        return count
+
+    def _adopt_orphans(self) -> Dict[str, Tuple[List[Job], List[Job]]]:
+        pending_by_batch: Dict[str, List[Job]] = {}
+        for job in self.store.orphaned([JobStatus.PENDING]):
+            if job.batch_id and self.store.adopt(job, self.queue.worker_id, JobStatus.PENDING):
+                job.worker_id = self.queue.worker_id
+                pending_by_batch.setdefault(job.batch_id, []).append(job)
+
+        adopted = {}
+        for batch_id, pending in pending_by_batch.items():
+            pending_ids = {job.id for job in pending}
+            running = [
+                job for job in self.store.list_batch(batch_id)
+                if job.id not in pending_ids and job.status not in FINISHED_STATUSES and job.status != JobStatus.PENDING
+            ]
+            adopted[batch_id] = (pending, running)
+        return adopted
+
+    async def stop(self) -> None:
+        """Stop dispatching, leaving undispatched items pending in the store"""
+        if self._recovery is not None:
+            self._recovery.cancel()
+            await asyncio.gather(self._recovery, return_exceptions=True)
+            self._recovery = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(self, batch_id: str, jobs: List[Job]) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.gather(*(self._run_item(job, slots) for job in jobs))
+            logger.info(f"Batch {batch_id} finished")
+        finally:
+            self._tasks.pop(batch_id, None)
+
+    async def _run_item(self, job: Job, slots: asyncio.Semaphore) -> None:
+        async with slots:
+            current = await asyncio.to_thread(self.store.get, job.id)
+            if current is None or current.status in FINISHED_STATUSES:
+                return
+            if current.status != JobStatus.PENDING:
+                # Queued before a restart, it keeps its slot until it finishes
+                await self.queue.wait(job.id)
+                return
+
+            key_id = job.api_key_id
+            if key_id and not (await asyncio.to_thread(bytes_limiter.check, key_id)).allowed:
+                await asyncio.to_thread(self.store.set_status, job.id, JobStatus.FAILED, error="Download quota exceeded")
+                return
+            if key_id:
+                while not await asyncio.to_thread(job_limiter.acquire, key_id):
+                    await asyncio.sleep(JOB_POLL_INTERVAL)
+
+            submitted = False
+            try:
+                while not submitted:
+                    # The item may have been cancelled while it waited
+                    current = await asyncio.to_thread(self.store.get, job.id)
+                    if current is None or current.status != JobStatus.PENDING:
+                        return
+                    job.status = JobStatus.QUEUED
+                    try:
+                        await self.queue.submit(job)
+                        submitted = True
+                    except QueueFullError:
+                        job.status = JobStatus.PENDING
+                        await asyncio.sleep(QUEUE_FULL_RETRY_SECONDS)
+            finally:
+                # Never handed to the queue, so the queue will not release the slot
+                if key_id and not submitted:
+                    await asyncio.to_thread(job_limiter.release, key_id)
+
+            # The slot is released by the job queue once the job finishes
+            await self.queue.wait(job.id)
+
+
+# Global batch dispatcher instance
+batch_dispatcher = BatchDispatcher(job_store, job_queue)
@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()  # memory, redis or none
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))  # 24 hours
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+YOUTUBE_HOSTS = {
+    "youtube.com",
+    "m.youtube.com",
+    "music.youtube.com",
+    "youtube-nocookie.com",
+}
+VIDEO_ID_PATH_PREFIXES = ("shorts", "embed", "live", "v", "e")
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """
+    Extract the canonical YouTube video ID from a URL
+
+    Handles watch, shorts, embed, live and youtu.be links.
+
+    Args:
+        url: YouTube video URL
+
+    Returns:
+        The 11 character video ID, or None if the URL is not recognised
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    candidate = None
+
+    if host == "youtu.be":
+        candidate = segments[0] if segments else None
+    elif host in YOUTUBE_HOSTS:
+        if parsed.path == "/watch":
+            candidate = parse_qs(parsed.query).get("v", [None])[0]
+        elif len(segments) >= 2 and segments[0] in VIDEO_ID_PATH_PREFIXES:
+            candidate = segments[1]
+
+    if candidate and VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    return None
+
+
+def make_cache_key(url: str, format_selector: str) -> Optional[str]:
+    """
+    Build the cache key for a URL and yt-dlp format selector
+
+    Returns:
+        Cache key, or None if the URL cannot be normalized to a video ID
+    """
+    video_id = extract_video_id(url)
+    if not video_id:
+        return None
+    format_hash = hashlib.sha256(format_selector.encode()).hexdigest()[:12]
+    return f"ytdl:{video_id}:{format_hash}"
+
+
+class CacheBackend:
+    """Interface for string caches, e.g. video ID -> S3 key"""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    """Cache that never stores anything (CACHE_BACKEND=none)"""
+
+    def get(self, key: str) -> Optional[str]:
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+
+class InMemoryCache(CacheBackend):
+    """Thread-safe in-process cache with TTL and LRU eviction"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: int = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisCache(CacheBackend):
+    """Redis-backed cache shared across workers and replicas"""
+
+    def __init__(self, url: str = REDIS_URL, ttl_seconds: int = CACHE_TTL_SECONDS):
+        import redis
+
+        self.ttl_seconds = ttl_seconds
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1)
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self.client.get(key)
+        except Exception as e:
+            # A cache outage must never fail a download, treat it as a miss
+            logger.warning(f"Redis cache get failed: {str(e)}")
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self.client.set(key, value, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Redis cache set failed: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(key)
+        except Exception as e:
+            logger.warning(f"Redis cache delete failed: {str(e)}")
+
+
+def create_cache(
+    backend: str = CACHE_BACKEND,
+    ttl_seconds: int = CACHE_TTL_SECONDS,
+    max_entries: int = CACHE_MAX_ENTRIES,
+    name: str = "result",
+) -> CacheBackend:
+    """Create the configured cache backend"""
+    if backend == "none":
+        logger.info(f"{name.capitalize()} cache disabled")
+        return NullCache()
+    if backend == "redis":
+        logger.info(f"Using Redis {name} cache")
+        return RedisCache(ttl_seconds=ttl_seconds)
+    if backend != "memory":
+        logger.warning(f"Unknown CACHE_BACKEND '{backend}', falling back to memory")
+    logger.info(f"Using in-memory {name} cache (max {max_entries} entries)")
+    return InMemoryCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+
+# Global result cache instance
+result_cache = create_cache()
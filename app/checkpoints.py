@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+
+from app.downloader import abort_upload
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOB_WORK_DIR = os.getenv("JOB_WORK_DIR", "/tmp/ytdl-work")  # Empty disables checkpoints, work dirs are then temporary
+JOB_WORK_RETENTION_SECONDS = int(os.getenv("JOB_WORK_RETENTION_SECONDS", "86400"))  # Interrupted work kept this long
+CHECKPOINT_FILE = "checkpoint.json"
+LOCK_FILE = ".lock"
+
+
+@dataclass
+class Checkpoint:
+    """
+    Progress of one video's download and upload, kept in its work directory
+
+    The directory also holds what yt-dlp needs to continue (its .part
+    files) and the multipart upload state of s3_key, the UploadId and the
+    parts already in S3, see MultipartUploader. Removing the directory
+    aborts that upload.
+    """
+    key: str
+    url: str
+    s3_key: str
+    stage: str = "downloading"  # downloading or uploading
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    directory: str = field(default="", compare=False)
+    resumed: bool = field(default=False, compare=False)
+    _lock_fd: Optional[int] = field(default=None, repr=False, compare=False)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        for name in ("directory", "resumed", "_lock_fd"):
+            data.pop(name)
+        return data
+
+    def save(self) -> None:
+        self.updated_at = time.time()
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+        self.save()
+
+
+class CheckpointStore:
+    """
+    Durable per-video work directories under JOB_WORK_DIR
+
+    A job's files live in a directory named after its media cache key
+    instead of a temporary one, so a job interrupted by a crash, deploy
+    or cancellation leaves partial downloads behind for the next job for
+    the same video and profile, whether that is the recovered job or a
+    new request. Each directory is held under an exclusive flock while in
+    use; a job that finds it held by another process falls back to a
+    private temporary directory. Directories untouched for retention
+    seconds are removed by sweep().
+    """
+
+    def __init__(self, directory: str = JOB_WORK_DIR, retention_seconds: int = JOB_WORK_RETENTION_SECONDS):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest()[:32])
+
+    def _lock(self, directory: str) -> Optional[int]:
+        fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(self, key: Optional[str], url: str, s3_key: str) -> Optional[Checkpoint]:
+        """
+        Lock the work directory of a video and load or start its checkpoint
+
+        s3_key is only used for a new checkpoint, a resumed one keeps the
+        key its upload was started under.
+
+        Returns:
+            The checkpoint, or None if checkpoints are off or another process holds the directory
+        """
+        if not (self.enabled and key):
+            return None
+        directory = self._path(key)
+        os.makedirs(directory, exist_ok=True)
+        fd = self._lock(directory)
+        if fd is None:
+            logger.info(f"Work directory for {url} is in use by another process")
+            return None
+
+        checkpoint = None
+        try:
+            with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+                checkpoint = Checkpoint(**json.load(f))
+            checkpoint.resumed = True
+            logger.info(f"Resuming {url} from its checkpoint ({checkpoint.stage})")
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint for {url}: {str(e)}")
+        if checkpoint is None or checkpoint.key != key:
+            checkpoint = Checkpoint(key=key, url=url, s3_key=s3_key)
+        checkpoint.directory = directory
+        checkpoint._lock_fd = fd
+        try:
+            checkpoint.save()
+        except OSError:
+            os.close(fd)
+            raise
+        return checkpoint
+
+    def release(self, checkpoint: Checkpoint, keep: bool = False) -> None:
+        """
+        Unlock a work directory, removing it and aborting its unfinished
+        upload unless its job is to be resumed
+        """
+        if not keep:
+            abort_upload(checkpoint.s3_key, checkpoint.directory)
+            shutil.rmtree(checkpoint.directory, ignore_errors=True)
+        if checkpoint._lock_fd is not None:
+            os.close(checkpoint._lock_fd)
+            checkpoint._lock_fd = None
+
+    def sweep(self) -> int:
+        """
+        Remove work directories not touched within the retention period,
+        aborting the multipart uploads they were resuming
+
+        Returns:
+            Number of directories removed
+        """
+        if not self.enabled:
+            return 0
+        cutoff = time.time() - self.retention_seconds
+        removed = 0
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if not os.path.isdir(directory):
+                continue
+            try:
+                marker = os.path.join(directory, CHECKPOINT_FILE)
+                updated = os.path.getmtime(marker if os.path.exists(marker) else directory)
+                if updated >= cutoff:
+                    continue
+                fd = self._lock(directory)
+            except OSError:
+                continue
+            if fd is None:
+                continue
+            try:
+                with open(marker) as f:
+                    abort_upload(json.load(f)["s3_key"], directory)
+            except (OSError, ValueError, KeyError):
+                pass
+            shutil.rmtree(directory, ignore_errors=True)
+            os.close(fd)
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} stale work director{'y' if removed == 1 else 'ies'}")
+        return removed
+
+
+# Global checkpoint store instance
+checkpoint_store = CheckpointStore()
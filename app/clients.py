@@ -0,0 +1,71 @@
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 10
+
+
+class ClientPool:
+    """
+    Process-wide S3 client and HTTP session shared by every job
+
+    boto3 clients and requests sessions are thread-safe for the calls we make,
+    so one of each is enough. Sharing them means credentials are resolved,
+    endpoints are set up and TLS connections are established once instead of
+    on every job. open() is called from the FastAPI lifespan with a pool size
+    matching executor concurrency; outside the app (scripts, benchmarks) the
+    clients are created lazily with default sizing on first use.
+    """
+
+    def __init__(
+        self,
+        s3_factory: Callable[[int], Any],
+        session_factory: Callable[[int], requests.Session],
+    ):
+        self._s3_factory = s3_factory
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._s3 = None
+        self._session: Optional[requests.Session] = None
+        self.max_connections = DEFAULT_MAX_CONNECTIONS
+
+    def open(self, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> None:
+        """Create the shared clients with connection pools of the given size"""
+        with self._lock:
+            self.max_connections = max_connections
+            self._s3 = self._s3_factory(max_connections)
+            self._session = self._session_factory(max_connections)
+        logger.info(f"Opened shared S3 client and HTTP session ({max_connections} connections each)")
+
+    def close(self) -> None:
+        """Close pooled connections"""
+        with self._lock:
+            s3, session = self._s3, self._session
+            self._s3 = None
+            self._session = None
+
+        if s3 is not None and hasattr(s3, "close"):
+            s3.close()
+        if session is not None:
+            session.close()
+        logger.info("Closed shared S3 client and HTTP session")
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            with self._lock:
+                if self._s3 is None:
+                    self._s3 = self._s3_factory(self.max_connections)
+        return self._s3
+
+    @property
+    def http_session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._session_factory(self.max_connections)
+        return self._session
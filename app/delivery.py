@@ -0,0 +1,311 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from typing import BinaryIO, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi.responses import Response, StreamingResponse
+
+from app.downloader import BUCKET_NAME, client_pool
+from app.mediacache import media_cache
+from app.cache import create_cache
+from app.metrics import PRESIGNED_URL_REQUESTS, VIDEO_BYTES_SERVED, VIDEO_RESPONSES
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+VIDEO_CHUNK_BYTES = 1024 * 1024  # Read size when streaming from S3 or without zero-copy send
+PRESIGNED_URL_TTL_SECONDS = int(os.getenv("PRESIGNED_URL_TTL_SECONDS", "900"))
+PRESIGNED_URL_CACHE_ENTRIES = int(os.getenv("PRESIGNED_URL_CACHE_ENTRIES", "10000"))
+VIDEO_METADATA_TTL_SECONDS = 3600  # Objects are never overwritten, their size and type only change on deletion
+VIDEO_CACHE_CONTROL = "private, max-age=3600"
+
+# Only keys allocated by new_s3_key are served, not whatever else lives in the bucket
+VIDEO_KEY_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}/original\.[a-z0-9]{1,8}$")
+
+# A cached URL always has at least half of its lifetime left
+presigned_url_cache = create_cache(
+    ttl_seconds=max(1, PRESIGNED_URL_TTL_SECONDS // 2), max_entries=PRESIGNED_URL_CACHE_ENTRIES, name="presigned URL"
+)
+video_metadata_cache = create_cache(
+    ttl_seconds=VIDEO_METADATA_TTL_SECONDS, max_entries=PRESIGNED_URL_CACHE_ENTRIES, name="video metadata"
+)
+
+
+class VideoDeliveryError(Exception):
+    """Raised when S3 cannot be reached to serve or sign a video"""
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised for a byte range entirely past the end of the file"""
+    pass
+
+
+def is_video_key(key: str) -> bool:
+    return bool(VIDEO_KEY_PATTERN.match(key))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    First and last byte of a single `Range: bytes=...` request
+
+    Headers that are malformed, use another unit or ask for several
+    ranges are ignored, the whole file is served instead (RFC 9110).
+
+    Returns:
+        Inclusive (start, end), or None for the whole file
+
+    Raises:
+        RangeNotSatisfiable: If the range starts past the end of the file
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            # Suffix range, the last n bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start < 0 or (end is not None and end < start):
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def content_headers(size: int, content_type: Optional[str], byte_range: Optional[Tuple[int, int]]) -> dict:
+    """Headers of a full (200) or partial (206) response"""
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Type": content_type or "application/octet-stream",
+        "Cache-Control": VIDEO_CACHE_CONTROL,
+    }
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+    else:
+        start, end = byte_range
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return headers
+
+
+def unsatisfiable_response(size: int) -> Response:
+    return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"})
+
+
+class SendfileResponse(Response):
+    """
+    A byte range of an open file
+
+    Sent with the ASGI zero-copy send extension when the server offers
+    it, so the kernel copies the file to the socket (sendfile); otherwise
+    read in chunks off the event loop. The file is closed once sent.
+    """
+
+    def __init__(self, file: BinaryIO, offset: int, count: int, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers=headers)
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self.file,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+            fd, offset, remaining = self.file.fileno(), self.offset, self.count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(os.pread, fd, min(VIDEO_CHUNK_BYTES, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # Truncated under us, end the body rather than hang the client
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            self.file.close()
+            VIDEO_BYTES_SERVED.labels(source="cache").inc(self.count)
+
+
+def _open_cached(key: str) -> Optional[Tuple[BinaryIO, dict]]:
+    """Open the media cache's copy of a key, the open file survives eviction"""
+    entry = media_cache.lookup_s3_key(key)
+    if entry is None:
+        return None
+    try:
+        return open(entry["path"], "rb"), entry
+    except FileNotFoundError:
+        return None
+
+
+def metadata_cache_key(key: str) -> str:
+    return f"ytdl:video-meta:{key}"
+
+
+def _is_missing(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+def object_metadata(key: str) -> Optional[dict]:
+    """
+    Size and content type of an uploaded video, cached
+
+    Returns:
+        Dict with size and content_type, or None if there is no such object
+
+    Raises:
+        VideoDeliveryError: If S3 cannot be reached
+    """
+    cache_key = metadata_cache_key(key)
+    cached = video_metadata_cache.get(cache_key)
+    if cached is not None:
+        try:
+            return json.loads(cached)
+        except ValueError:
+            video_metadata_cache.delete(cache_key)
+    try:
+        head = client_pool.s3.head_object(Bucket=BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if _is_missing(e):
+            return None
+        raise VideoDeliveryError(f"S3 metadata lookup failed: {str(e)}")
+    except BotoCoreError as e:
+        raise VideoDeliveryError(f"S3 metadata lookup failed: {str(e)}")
+    metadata = {"size": head["ContentLength"], "content_type": head.get("ContentType")}
+    video_metadata_cache.set(cache_key, json.dumps(metadata))
+    return metadata
+
+
+def presigned_url(key: str) -> dict:
+    """
+    A presigned GET URL for an uploaded video, from the signing cache when possible
+
+    Returns:
+        Dict with url and expires_at (unix time)
+
+    Raises:
+        VideoDeliveryError: If signing fails
+    """
+    cache_key = f"ytdl:presigned:{key}"
+    cached = presigned_url_cache.get(cache_key)
+    if cached is not None:
+        try:
+            signed = json.loads(cached)
+            PRESIGNED_URL_REQUESTS.labels(result="hit").inc()
+            return signed
+        except ValueError:
+            presigned_url_cache.delete(cache_key)
+    try:
+        url = client_pool.s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": BUCKET_NAME, "Key": key},
+            ExpiresIn=PRESIGNED_URL_TTL_SECONDS,
+        )
+    except (ClientError, BotoCoreError) as e:
+        raise VideoDeliveryError(f"Failed to sign URL: {str(e)}")
+    signed = {"url": url, "expires_at": int(time.time()) + PRESIGNED_URL_TTL_SECONDS}
+    presigned_url_cache.set(cache_key, json.dumps(signed))
+    PRESIGNED_URL_REQUESTS.labels(result="miss").inc()
+    return signed
+
+
+async def _stream_body(body, count: int):
+    """Read an S3 response body off the event loop, closing it however the client goes away"""
+    sent = 0
+    try:
+        while True:
+            chunk = await asyncio.to_thread(body.read, VIDEO_CHUNK_BYTES)
+            if not chunk:
+                return
+            sent += len(chunk)
+            yield chunk
+    finally:
+        body.close()
+        VIDEO_BYTES_SERVED.labels(source="s3").inc(min(sent, count))
+
+
+async def video_response(key: str, range_header: Optional[str], head: bool = False) -> Optional[Response]:
+    """
+    Serve an uploaded video, honouring a single byte range
+
+    The local media cache is used when it holds the file, S3 otherwise.
+
+    Returns:
+        The response, or None if there is no such video
+
+    Raises:
+        VideoDeliveryError: If S3 cannot be reached
+    """
+    cached = await asyncio.to_thread(_open_cached, key)
+    if cached is not None:
+        file, entry = cached
+        size = os.fstat(file.fileno()).st_size
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            file.close()
+            return unsatisfiable_response(size)
+        headers = content_headers(size, entry["content_type"], byte_range)
+        status_code = 206 if byte_range else 200
+        VIDEO_RESPONSES.labels(source="cache").inc()
+        if head:
+            file.close()
+            return Response(status_code=status_code, headers=headers)
+        start, end = byte_range or (0, size - 1)
+        return SendfileResponse(file, start, end - start + 1, status_code, headers)
+
+    metadata = await asyncio.to_thread(object_metadata, key)
+    if metadata is None:
+        return None
+    size = metadata["size"]
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        return unsatisfiable_response(size)
+    headers = content_headers(size, metadata["content_type"], byte_range)
+    status_code = 206 if byte_range else 200
+    VIDEO_RESPONSES.labels(source="s3").inc()
+    if head or size == 0:
+        return Response(status_code=status_code, headers=headers)
+
+    params = {"Bucket": BUCKET_NAME, "Key": key}
+    if byte_range:
+        params["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+    try:
+        response = await asyncio.to_thread(client_pool.s3.get_object, **params)
+    except ClientError as e:
+        if _is_missing(e):
+            video_metadata_cache.delete(metadata_cache_key(key))
+            return None
+        raise VideoDeliveryError(f"S3 download failed: {str(e)}")
+    except BotoCoreError as e:
+        raise VideoDeliveryError(f"S3 download failed: {str(e)}")
+    return StreamingResponse(
+        _stream_body(response["Body"], int(headers["Content-Length"])),
+        status_code=status_code,
+        headers=headers,
+    )
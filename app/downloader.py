@@ -1,16 +1,29 @@
 import os
+import time
 import uuid
 import boto3
 import subprocess
 import requests
 import logging
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 from botocore.exceptions import ClientError, BotoCoreError
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from urllib3.exceptions import InsecureRequestWarning
-import tempfile
+from app.uploader import (
+    MultipartUploader,
+    UploadError,
+    UploadSizeLimitExceeded,
+    EmptyStreamError,
+    ProgressCallback,
+    UPLOAD_GLOBAL_CONCURRENCY,
+    UPLOAD_STATE_DIR,
+)
+from app.clients import ClientPool
+from app.profiles import OutputProfile, DEFAULT_PROFILE
+from app.metrics import FALLBACKS, observe_stage, observe_transfer
 
 # Suppress urllib3 warnings for cleaner logs
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -22,8 +35,27 @@ logger = logging.getLogger(__name__)
 # Configuration
 BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
 S3_REGION = os.getenv("AWS_REGION", "us-east-1")
+S3_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL")  # Optional, e.g. MinIO or moto server
 COOKIES_FILE = os.getenv("COOKIE_FILE_PATH", "/app/cookies/youtube_cookies.txt")
+YTDLP_BINARY = os.getenv("YTDLP_BINARY", "yt-dlp")
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "500"))  # 500MB default limit
+DOWNLOAD_TIMEOUT_SECONDS = 900  # 15 minutes
+DOWNLOAD_FRAGMENTS = int(os.getenv("DOWNLOAD_FRAGMENTS", "4"))  # Concurrent fragments of DASH/HLS formats
+DOWNLOAD_JOB_MAX_MBPS = float(os.getenv("DOWNLOAD_JOB_MAX_MBPS", "0"))  # Per-download rate cap, 0 disables
+
+# Streaming mode pipes yt-dlp stdout straight into an S3 multipart upload.
+# Only single-file (progressive) formats can be written to a pipe, merged
+# video+audio downloads need a seekable file.
+STREAM_UPLOADS = os.getenv("STREAM_UPLOADS", "false").lower() == "true"
+
+MERGED_VIDEO_FORMAT = "bv*[height<=1080]+ba/b[height<=1080]/b"  # Limit to 1080p max
+STREAMABLE_VIDEO_FORMAT = "b[height<=1080][ext=mp4]/b[ext=mp4]"  # Progressive mp4 only
+VIDEO_FORMAT = STREAMABLE_VIDEO_FORMAT if STREAM_UPLOADS else MERGED_VIDEO_FORMAT
+
+
+def streams_to_s3(profile: OutputProfile) -> bool:
+    """Whether a profile's downloads are piped into S3, see STREAM_UPLOADS"""
+    return STREAM_UPLOADS and profile.streamable
 
 
 class VideoProcessingError(Exception):
@@ -31,7 +63,7 @@ class VideoProcessingError(Exception):
     pass
 
 
-def create_robust_session() -> requests.Session:
+def create_robust_session(pool_maxsize: int = 10) -> requests.Session:
     """Create a requests session with retry strategy and proper SSL handling"""
     session = requests.Session()
     
@@ -39,7 +71,7 @@ def create_robust_session() -> requests.Session:
     retry_strategy = Retry(
         total=3,
         status_forcelist=[429, 500, 502, 503, 504],
-        method_whitelist=["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"],
+        allowed_methods=["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"],
         backoff_factor=1,  # Wait 1, 2, 4 seconds between retries
         raise_on_status=False
     )
@@ -47,7 +79,7 @@ def create_robust_session() -> requests.Session:
     adapter = HTTPAdapter(
         max_retries=retry_strategy,
         pool_connections=10,
-        pool_maxsize=10,
+        pool_maxsize=pool_maxsize,
         pool_block=False
     )
     
@@ -69,43 +101,50 @@ def validate_environment() -> None:
         raise VideoProcessingError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
 
-def download_video(url: str, output_path: str) -> None:
-    """Download video using yt-dlp with robust error handling"""
+def build_ytdlp_command(
+    url: str,
+    output_path: str,
+    format_selector: str = MERGED_VIDEO_FORMAT,
+    info_json: Optional[str] = None,
+    profile: OutputProfile = DEFAULT_PROFILE,
+    cookie_file: Optional[str] = COOKIES_FILE,
+    proxy: Optional[str] = None,
+) -> list:
+    """
+    Build the yt-dlp command line, output_path "-" writes to stdout
+    
+    With info_json yt-dlp loads a previous extraction from that file
+    instead of fetching the video page and player again. Files are merged,
+    remuxed or extracted into the profile's container, output_path must
+    carry its extension. cookie_file and proxy come from the identity the
+    run leased, see app.upstream.
+    """
     cmd = [
-        "yt-dlp",
+        YTDLP_BINARY,
         "--no-warnings",
         "--quiet",
         "--progress",
-        "-f", "bv*[height<=1080]+ba/b[height<=1080]/b",  # Limit to 1080p max
-        "--merge-output-format", "mp4",
-        "-o", output_path,
-        url
+        "-f", format_selector,
     ]
+    if DOWNLOAD_FRAGMENTS > 1:
+        cmd.extend(["--concurrent-fragments", str(DOWNLOAD_FRAGMENTS)])
+    if DOWNLOAD_JOB_MAX_MBPS > 0:
+        cmd.extend(["--limit-rate", str(int(DOWNLOAD_JOB_MAX_MBPS * 1024 * 1024))])
+    if output_path != "-":
+        cmd.extend(profile.output_args())
+        # yt-dlp picks the extension of intermediate files, the final one is the profile's
+        output_path = f"{os.path.splitext(output_path)[0]}.%(ext)s"
+    cmd.extend(["-o", output_path])
+    cmd.extend(["--load-info-json", info_json] if info_json else [url])
     
     # Add cookies if file exists
-    if os.path.exists(COOKIES_FILE):
-        cmd.extend(["--cookies", COOKIES_FILE])
+    if cookie_file and os.path.exists(cookie_file):
+        cmd.extend(["--cookies", cookie_file])
         logger.info("Using cookies file for authentication")
+    if proxy:
+        cmd.extend(["--proxy", proxy])
     
-    try:
-        logger.info(f"Starting download from: {url}")
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=900  # 15 minutes timeout
-        )
-        logger.info("Video download completed successfully")
-        
-        if result.stderr:
-            logger.warning(f"yt-dlp warnings: {result.stderr}")
-            
-    except subprocess.TimeoutExpired:
-        raise VideoProcessingError("Video download timed out after 15 minutes")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"yt-dlp error: {e.stderr}")
-        raise VideoProcessingError(f"Failed to download video: {e.stderr}")
+    return cmd
 
 
 def validate_file(file_path: str) -> None:
@@ -124,48 +163,159 @@ def validate_file(file_path: str) -> None:
     logger.info(f"File validated: {file_size / 1024 / 1024:.1f}MB")
 
 
-def create_s3_client():
+def create_s3_client(max_pool_connections: int = UPLOAD_GLOBAL_CONCURRENCY):
     """Create S3 client with proper configuration"""
     try:
         return boto3.client(
             "s3",
             region_name=S3_REGION,
+            endpoint_url=S3_ENDPOINT_URL,
             aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
             aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
             config=boto3.session.Config(
                 retries={'max_attempts': 3, 'mode': 'adaptive'},
-                max_pool_connections=10
+                max_pool_connections=max(10, max_pool_connections)
             )
         )
     except Exception as e:
         raise VideoProcessingError(f"Failed to create S3 client: {str(e)}")
 
 
-def upload_to_s3_multipart(s3_client, file_path: str, s3_key: str) -> None:
-    """Upload large files using S3 multipart upload for better reliability"""
+# Shared clients, opened and closed by the FastAPI lifespan
+client_pool = ClientPool(create_s3_client, create_robust_session)
+
+
+def upload_to_s3_multipart(
+    s3_client,
+    file_path: str,
+    s3_key: str,
+    content_type: str = "video/mp4",
+    on_progress: Optional[ProgressCallback] = None,
+    state_dir: str = UPLOAD_STATE_DIR,
+) -> None:
+    """
+    Upload a file with the concurrent multipart engine
+    
+    A failed attempt is retried once; the second attempt resumes from the
+    parts that already reached S3. If that fails too the multipart upload
+    is aborted, so its parts are not left in the bucket. The UploadId and
+    finished parts are kept in state_dir, a job's work directory when it
+    is checkpointed.
+    """
+    uploader = MultipartUploader(s3_client, BUCKET_NAME, state_dir=state_dir)
+    
+    for attempt in range(2):
+        try:
+            uploader.upload_file(file_path, s3_key, content_type=content_type, on_progress=on_progress)
+            logger.info(f"Successfully uploaded to S3: {s3_key}")
+            return
+        except (UploadError, ClientError, BotoCoreError) as e:
+            if attempt == 0:
+                logger.warning(f"Multipart upload attempt failed, resuming: {str(e)}")
+                continue
+            uploader.abort_file(s3_key)
+            if isinstance(e, ClientError):
+                error_code = e.response['Error']['Code']
+                raise VideoProcessingError(f"S3 upload failed ({error_code}): {str(e)}")
+            raise VideoProcessingError(f"S3 upload failed: {str(e)}")
+        except Exception as e:
+            uploader.abort_file(s3_key)
+            raise VideoProcessingError(f"Unexpected error during S3 upload: {str(e)}")
+
+
+def stream_video_to_s3(
+    s3_client,
+    url: str,
+    s3_key: str,
+    info_json: Optional[str] = None,
+    format_selector: str = STREAMABLE_VIDEO_FORMAT,
+    on_progress: Optional[ProgressCallback] = None,
+    content_type: str = "video/mp4",
+    cookie_file: Optional[str] = COOKIES_FILE,
+    proxy: Optional[str] = None,
+    on_process: Optional[Callable[[subprocess.Popen], None]] = None,
+) -> int:
+    """
+    Stream yt-dlp output straight into an S3 multipart upload
+    
+    yt-dlp writes the video to stdout and the multipart engine uploads it
+    in parts while the download is still running, so nothing touches the
+    disk and memory stays at a few part buffers. MAX_FILE_SIZE_MB is
+    enforced as bytes arrive. yt-dlp runs in its own process group, handed
+    to on_process as soon as it starts; killing it makes the upload abort.
+    
+    Returns:
+        Number of bytes uploaded
+        
+    Raises:
+        VideoProcessingError: If the download or any part upload fails
+    """
+    cmd = build_ytdlp_command(url, "-", format_selector, info_json=info_json, cookie_file=cookie_file, proxy=proxy)
+    max_size_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    
+    logger.info(f"Starting streaming download from: {url}")
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    if on_process:
+        on_process(process)
+    
+    # Drain stderr in the background so a chatty yt-dlp cannot block on a full pipe
+    stderr_chunks = []
+    stderr_reader = threading.Thread(
+        target=lambda: stderr_chunks.append(process.stderr.read()),
+        daemon=True
+    )
+    stderr_reader.start()
+    
+    timed_out = threading.Event()
+    
+    def kill_on_timeout():
+        timed_out.set()
+        process.kill()
+    
+    watchdog = threading.Timer(DOWNLOAD_TIMEOUT_SECONDS, kill_on_timeout)
+    watchdog.start()
+    
+    def check_download():
+        process.wait()
+        stderr_reader.join()
+        stderr = b"".join(chunk for chunk in stderr_chunks if chunk).decode(errors="replace")
+        if timed_out.is_set():
+            raise VideoProcessingError("Video download timed out after 15 minutes")
+        if process.returncode != 0:
+            logger.error(f"yt-dlp error: {stderr}")
+            raise VideoProcessingError(f"Failed to download video: {stderr}")
+    
+    uploader = MultipartUploader(s3_client, BUCKET_NAME)
     try:
-        # Use S3 client's upload_file method which automatically handles multipart for large files
-        s3_client.upload_file(
-            file_path,
-            BUCKET_NAME,
+        stats = uploader.upload_stream(
+            process.stdout,
             s3_key,
-            ExtraArgs={
-                'ContentType': 'video/mp4',
-                'ServerSideEncryption': 'AES256'
-            }
+            content_type=content_type,
+            max_bytes=max_size_bytes,
+            before_complete=check_download,
+            on_progress=on_progress
         )
-        logger.info(f"Successfully uploaded to S3: {s3_key}")
-        
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        raise VideoProcessingError(f"S3 upload failed ({error_code}): {str(e)}")
+        return stats.bytes_uploaded
+    except VideoProcessingError:
+        raise
+    except UploadSizeLimitExceeded:
+        raise VideoProcessingError(f"File size exceeds limit ({MAX_FILE_SIZE_MB}MB)")
+    except EmptyStreamError:
+        raise VideoProcessingError("Downloaded file is empty")
+    except UploadError as e:
+        raise VideoProcessingError(f"S3 streaming upload failed: {str(e)}")
     except Exception as e:
-        raise VideoProcessingError(f"Unexpected error during S3 upload: {str(e)}")
+        raise VideoProcessingError(f"Unexpected error during streaming upload: {str(e)}")
+    finally:
+        watchdog.cancel()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
 
 
-def upload_with_presigned_url(file_path: str, s3_key: str) -> None:
-    """Fallback method using presigned URL with robust session"""
-    s3_client = create_s3_client()
+def upload_with_presigned_url(file_path: str, s3_key: str, content_type: str = "video/mp4") -> None:
+    """Fallback method using presigned URL with the shared session"""
+    s3_client = client_pool.s3
     
     try:
         # Generate presigned URL with longer expiration
@@ -174,16 +324,16 @@ def upload_with_presigned_url(file_path: str, s3_key: str) -> None:
             Params={
                 "Bucket": BUCKET_NAME,
                 "Key": s3_key,
-                "ContentType": "video/mp4"
+                "ContentType": content_type
             },
             ExpiresIn=7200  # 2 hours
         )
         
-        session = create_robust_session()
+        session = client_pool.http_session
         
         with open(file_path, "rb") as f:
             headers = {
-                "Content-Type": "video/mp4",
+                "Content-Type": content_type,
                 "User-Agent": "ytdl-microservice/1.0"
             }
             
@@ -206,60 +356,38 @@ def upload_with_presigned_url(file_path: str, s3_key: str) -> None:
         raise VideoProcessingError(f"Upload failed: {str(e)}")
 
 
-def cleanup_temp_file(file_path: str) -> None:
-    """Safely cleanup temporary files"""
+def new_s3_key(extension: str = "mp4") -> str:
+    """Allocate a unique S3 key for a new upload"""
+    return f"{uuid.uuid4()}/original.{extension}"
+
+
+def upload_stage(
+    file_path: str,
+    s3_key: str,
+    content_type: str = "video/mp4",
+    on_progress: Optional[ProgressCallback] = None,
+    state_dir: str = UPLOAD_STATE_DIR,
+) -> None:
+    """Upload stage: multipart upload with presigned URL fallback"""
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"Cleaned up temporary file: {file_path}")
-    except Exception as e:
-        logger.warning(f"Failed to cleanup {file_path}: {str(e)}")
+        with observe_stage("upload"):
+            upload_to_s3_multipart(
+                client_pool.s3, file_path, s3_key, content_type, on_progress=on_progress, state_dir=state_dir
+            )
+    except VideoProcessingError as e:
+        logger.warning(f"Multipart upload failed: {str(e)}")
+        logger.info("Falling back to presigned URL upload")
+        FALLBACKS.labels(kind="presigned_upload").inc()
+        started = time.perf_counter()
+        with observe_stage("presigned_fallback"):
+            upload_with_presigned_url(file_path, s3_key, content_type)
+        observe_transfer("upload", os.path.getsize(file_path), time.perf_counter() - started)
 
 
-def process_and_upload(url: str) -> str:
-    """
-    Main function to download YouTube video and upload to S3
-    
-    Args:
-        url: YouTube video URL
-        
-    Returns:
-        S3 key of uploaded file
-        
-    Raises:
-        VideoProcessingError: If any step fails
-    """
-    validate_environment()
-    
-    folder_uuid = str(uuid.uuid4())
-    s3_key = f"{folder_uuid}/original.mp4"
-    
-    # Use a more secure temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
-        tmp_output = os.path.join(temp_dir, f"{folder_uuid}.mp4")
-        
-        try:
-            # Step 1: Download video
-            download_video(url, tmp_output)
-            
-            # Step 2: Validate file
-            validate_file(tmp_output)
-            
-            # Step 3: Upload to S3 (try multipart first, fallback to presigned URL)
-            s3_client = create_s3_client()
-            
-            try:
-                upload_to_s3_multipart(s3_client, tmp_output, s3_key)
-            except VideoProcessingError as e:
-                logger.warning(f"Multipart upload failed: {str(e)}")
-                logger.info("Falling back to presigned URL upload")
-                upload_with_presigned_url(tmp_output, s3_key)
-            
-            logger.info(f"Process completed successfully. S3 key: {s3_key}")
-            return s3_key
-            
-        except VideoProcessingError:
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            raise VideoProcessingError(f"Unexpected error: {str(e)}")
\ No newline at end of file
+def abort_upload(s3_key: str, state_dir: str = UPLOAD_STATE_DIR) -> None:
+    """Abort the unfinished multipart upload of s3_key recorded in state_dir, if any"""
+    try:
+        MultipartUploader(client_pool.s3, BUCKET_NAME, state_dir=state_dir).abort_file(s3_key)
+    except Exception as e:
+        logger.warning(f"Failed to abort the upload of {s3_key}: {str(e)}")
+
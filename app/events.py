@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Set
+
+from app.jobs import Job, JobStatus, JobStore, FINISHED_STATUSES, REDIS_URL
+from app.metrics import EVENT_STREAMS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# memory only reaches subscribers in the process running the job, use redis with JOB_EXECUTION=worker
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory").lower()  # memory or redis
+PROGRESS_EVENT_INTERVAL = float(os.getenv("PROGRESS_EVENT_INTERVAL", "0.5"))  # Seconds between progress events per job
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+EVENT_STATUS_POLL_SECONDS = 2.0  # Catches status changes nobody published, e.g. cancellations
+EVENT_TTL_SECONDS = 3600
+EVENT_MAX_JOBS = 10000
+SUBSCRIPTION_QUEUE_SIZE = 100
+
+
+class Subscription:
+    """Events published for one job after subscribing"""
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None if none arrived within timeout"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self) -> "Subscription":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class EventBus:
+    """Interface for per-job progress events"""
+
+    def publish(self, job_id: str, event: dict) -> None:
+        """Deliver an event to the job's subscribers, safe to call from any thread"""
+        raise NotImplementedError
+
+    def latest(self, job_id: str) -> Optional[dict]:
+        """Last event published for a job, so late subscribers start from it"""
+        raise NotImplementedError
+
+    async def subscribe(self, job_id: str) -> Subscription:
+        raise NotImplementedError
+
+
+class InMemorySubscription(Subscription):
+    def __init__(self, bus: "InMemoryEventBus", job_id: str):
+        self.bus = bus
+        self.job_id = job_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+
+    def put(self, event: dict) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._put(event)
+        else:
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: dict) -> None:
+        if self.queue.full():
+            # Events are snapshots, a slow reader only needs the newest ones
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+
+class InMemoryEventBus(EventBus):
+    """Process-local event bus, keeps the last event of up to max_jobs jobs"""
+
+    def __init__(self, max_jobs: int = EVENT_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._latest: "OrderedDict[str, dict]" = OrderedDict()
+        self._subscribers: Dict[str, Set[InMemorySubscription]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, job_id: str, event: dict) -> None:
+        with self._lock:
+            self._latest[job_id] = event
+            self._latest.move_to_end(job_id)
+            while len(self._latest) > self.max_jobs:
+                self._latest.popitem(last=False)
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def latest(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._latest.get(job_id)
+
+    async def subscribe(self, job_id: str) -> Subscription:
+        subscription = InMemorySubscription(self, job_id)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: InMemorySubscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.job_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.job_id]
+
+
+class RedisSubscription(Subscription):
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message and message["type"] == "message":
+                try:
+                    return json.loads(message["data"])
+                except ValueError:
+                    continue
+
+    async def close(self) -> None:
+        try:
+            await self.pubsub.reset()
+        except Exception as e:
+            logger.warning(f"Failed to close event subscription: {str(e)}")
+
+
+class RedisEventBus(EventBus):
+    """
+    Event bus shared by API and worker processes through Redis pub/sub
+
+    Events are published on one channel per job and the last one is kept
+    for EVENT_TTL_SECONDS. Publishing fails open: progress is best effort
+    and must never fail a download.
+    """
+
+    CHANNEL_PREFIX = "ytdl:events:"
+    LATEST_PREFIX = "ytdl:events:latest:"
+
+    def __init__(self, url: str = REDIS_URL, ttl_seconds: int = EVENT_TTL_SECONDS):
+        import redis
+
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._async_client = None
+
+    def publish(self, job_id: str, event: dict) -> None:
+        data = json.dumps(event)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.set(f"{self.LATEST_PREFIX}{job_id}", data, ex=self.ttl_seconds)
+            pipe.publish(f"{self.CHANNEL_PREFIX}{job_id}", data)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to publish event for job {job_id}: {str(e)}")
+
+    def latest(self, job_id: str) -> Optional[dict]:
+        try:
+            data = self.client.get(f"{self.LATEST_PREFIX}{job_id}")
+            return json.loads(data) if data else None
+        except Exception as e:
+            logger.warning(f"Failed to read last event for job {job_id}: {str(e)}")
+            return None
+
+    async def subscribe(self, job_id: str) -> Subscription:
+        if self._async_client is None:
+            import redis.asyncio
+
+            self._async_client = redis.asyncio.Redis.from_url(self.url, decode_responses=True)
+        pubsub = self._async_client.pubsub()
+        await pubsub.subscribe(f"{self.CHANNEL_PREFIX}{job_id}")
+        return RedisSubscription(pubsub)
+
+
+def create_event_bus(backend: str = EVENTS_BACKEND) -> EventBus:
+    """Create the configured event bus"""
+    if backend == "redis":
+        logger.info("Using Redis event bus")
+        return RedisEventBus()
+    if backend != "memory":
+        logger.warning(f"Unknown EVENTS_BACKEND '{backend}', falling back to memory")
+    return InMemoryEventBus()
+
+
+def progress_reporter(job_id: str, bus: Optional[EventBus] = None, interval: float = PROGRESS_EVENT_INTERVAL):
+    """
+    Callback publishing a job's progress events
+
+    yt-dlp reports many times a second, in-progress download and upload
+    events are thinned to one per interval. Status changes such as a merge
+    starting or a download finishing always go through.
+    """
+    bus = bus or event_bus
+    last = {"at": 0.0}
+    lock = threading.Lock()
+
+    def report(event: dict) -> None:
+        now = time.monotonic()
+        if event.get("status") in ("downloading", "uploading"):
+            with lock:
+                if now - last["at"] < interval:
+                    return
+                last["at"] = now
+        bus.publish(job_id, dict(event, time=time.time()))
+
+    return report
+
+
+def publish_status(job_id: str, status: JobStatus, bus: Optional[EventBus] = None) -> None:
+    """Tell a job's subscribers that its status changed in the job store"""
+    (bus or event_bus).publish(job_id, {"stage": "status", "status": status.value, "time": time.time()})
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def job_snapshot(job: Job) -> dict:
+    return {
+        "task_id": job.id,
+        "status": job.status.value,
+        "s3_key": job.s3_key,
+        "error": job.error,
+        "updated_at": job.updated_at,
+    }
+
+
+async def stream_job_events(job_id: str, store: JobStore, bus: Optional[EventBus] = None) -> AsyncIterator[str]:
+    """
+    Server-sent events for one job until it finishes
+
+    Starts with a `status` event holding the job's current state and its
+    last `progress` event, then relays progress as it is published. Every
+    status change is sent as a `status` event read back from the job
+    store, the stream ends after the one with a finished status. Comment
+    lines are sent as heartbeats so proxies keep idle streams open.
+    """
+    bus = bus or event_bus
+    EVENT_STREAMS.inc()
+    try:
+        async with await bus.subscribe(job_id) as subscription:
+            job = await asyncio.to_thread(store.get, job_id)
+            if job is None:
+                return
+            yield format_sse("status", job_snapshot(job))
+            if job.status in FINISHED_STATUSES:
+                return
+            latest = await asyncio.to_thread(bus.latest, job_id)
+            if latest and latest.get("stage") != "status":
+                yield format_sse("progress", latest)
+
+            status = job.status
+            last_sent = time.monotonic()
+            while True:
+                event = await subscription.get(timeout=EVENT_STATUS_POLL_SECONDS)
+                if event is not None and event.get("stage") != "status":
+                    yield format_sse("progress", event)
+                    last_sent = time.monotonic()
+                    continue
+
+                job = await asyncio.to_thread(store.get, job_id)
+                if job is None:
+                    return
+                if job.status != status:
+                    status = job.status
+                    yield format_sse("status", job_snapshot(job))
+                    last_sent = time.monotonic()
+                    if status in FINISHED_STATUSES:
+                        return
+                elif time.monotonic() - last_sent >= EVENT_HEARTBEAT_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+    finally:
+        EVENT_STREAMS.dec()
+
+
+# Global event bus instance
+event_bus = create_event_bus()
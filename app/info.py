@@ -0,0 +1,214 @@
+import os
+import json
+import asyncio
+import logging
+from typing import List, Optional
+
+import yt_dlp
+
+from app.downloader import VideoProcessingError, COOKIES_FILE, VIDEO_FORMAT
+from app.cache import create_cache, extract_video_id
+from app.singleflight import SingleFlight
+from app.upstream import Identity, upstream_health
+from app.metrics import INFO_REQUESTS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Stream URLs inside an extraction expire after a few hours, keep entries well below that
+INFO_CACHE_TTL_SECONDS = int(os.getenv("INFO_CACHE_TTL_SECONDS", "1800"))
+INFO_CACHE_MAX_ENTRIES = int(os.getenv("INFO_CACHE_MAX_ENTRIES", "1000"))
+INFO_SOCKET_TIMEOUT_SECONDS = 30
+
+# Concurrent requests for the same video share one extraction
+inflight_extractions = SingleFlight()
+info_cache = create_cache(ttl_seconds=INFO_CACHE_TTL_SECONDS, max_entries=INFO_CACHE_MAX_ENTRIES, name="info")
+
+
+def info_cache_key(url: str) -> Optional[str]:
+    video_id = extract_video_id(url)
+    return f"ytdl:info:{video_id}" if video_id else None
+
+
+def identity_options(options: dict, identity: Optional[Identity]) -> dict:
+    """Add an identity's cookies and proxy to yt-dlp API options"""
+    cookie_file = identity.cookie_file if identity else COOKIES_FILE
+    if cookie_file and os.path.exists(cookie_file):
+        options["cookiefile"] = cookie_file
+    if identity and identity.proxy:
+        options["proxy"] = identity.proxy
+    return options
+
+
+def extract_info(url: str, identity: Optional[Identity] = None) -> dict:
+    """
+    Run yt-dlp extraction in-process without downloading anything
+
+    Formats are selected with the same selector as downloads, so the
+    result's requested formats are the ones a download would fetch.
+
+    Returns:
+        The JSON-serializable yt-dlp info dict
+
+    Raises:
+        VideoProcessingError: If extraction fails
+    """
+    options = {
+        "quiet": True,
+        "no_warnings": True,
+        "skip_download": True,
+        "noplaylist": True,
+        "format": VIDEO_FORMAT,
+        "socket_timeout": INFO_SOCKET_TIMEOUT_SECONDS,
+    }
+    identity_options(options, identity)
+
+    try:
+        with observe_stage("extract"), yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+            return ydl.sanitize_info(info)
+    except yt_dlp.utils.DownloadError as e:
+        raise VideoProcessingError(f"Failed to extract video info: {str(e)}")
+
+
+def expand_playlist(url: str, max_items: int, identity: Optional[Identity] = None) -> List[str]:
+    """
+    List the video URLs of a playlist or channel without extracting each video
+
+    A URL of a single video yields just that video.
+
+    Raises:
+        VideoProcessingError: If extraction fails
+    """
+    options = {
+        "quiet": True,
+        "no_warnings": True,
+        "skip_download": True,
+        "extract_flat": "in_playlist",
+        "playlistend": max_items,
+        "socket_timeout": INFO_SOCKET_TIMEOUT_SECONDS,
+    }
+    identity_options(options, identity)
+
+    try:
+        with observe_stage("expand"), yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        raise VideoProcessingError(f"Failed to expand playlist: {str(e)}")
+
+    if info.get("_type") not in ("playlist", "multi_video"):
+        return [info.get("webpage_url") or url]
+
+    urls = []
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        entry_url = entry.get("url") or entry.get("webpage_url")
+        if not entry_url and entry.get("id"):
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if entry_url:
+            urls.append(entry_url)
+    return urls[:max_items]
+
+
+def get_cached_info(url: str) -> Optional[dict]:
+    """Return a cached extraction for a URL, if any"""
+    cache_key = info_cache_key(url)
+    if not cache_key:
+        return None
+    data = info_cache.get(cache_key)
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        info_cache.delete(cache_key)
+        return None
+
+
+def invalidate_info(url: str) -> None:
+    cache_key = info_cache_key(url)
+    if cache_key:
+        info_cache.delete(cache_key)
+
+
+async def get_info(url: str) -> dict:
+    """
+    Extraction for a URL, served from the info cache when possible
+
+    Extractions lease an identity from app.upstream, waiting while every
+    identity is cooling down.
+
+    Raises:
+        UpstreamThrottled: If the extraction was throttled or bot-checked
+        VideoProcessingError: If extraction fails
+    """
+    info = get_cached_info(url)
+    INFO_REQUESTS.labels(result="hit" if info else "miss").inc()
+    if info:
+        return info
+
+    async def extract():
+        # yt-dlp's Python API blocks, keep it off the event loop
+        async with upstream_health.lease() as identity:
+            info = await asyncio.to_thread(extract_info, url, identity)
+        cache_key = info_cache_key(url)
+        if cache_key:
+            info_cache.set(cache_key, json.dumps(info))
+        return info
+
+    return await inflight_extractions.do(info_cache_key(url), extract)
+
+
+def write_info_json(url: str, directory: str) -> Optional[str]:
+    """
+    Write the cached extraction for a URL where yt-dlp can load it
+
+    Returns:
+        Path for `yt-dlp --load-info-json`, or None if nothing is cached
+    """
+    info = get_cached_info(url)
+    if info is None:
+        return None
+    path = os.path.join(directory, "info.json")
+    with open(path, "w") as f:
+        json.dump(info, f)
+    logger.info(f"Reusing cached extraction for {url}")
+    return path
+
+
+def format_size(fmt: dict) -> Optional[int]:
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    return int(size) if size else None
+
+
+def summarize_info(info: dict) -> dict:
+    """Reduce an info dict to what clients need to decide on a download"""
+    selected = info.get("requested_formats") or [info]
+    sizes = [format_size(fmt) for fmt in selected]
+    return {
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "uploader": info.get("uploader"),
+        "upload_date": info.get("upload_date"),
+        "thumbnail": info.get("thumbnail"),
+        "webpage_url": info.get("webpage_url"),
+        "is_live": bool(info.get("is_live")),
+        "selected_format": info.get("format_id"),
+        "estimated_size_bytes": sum(sizes) if sizes and None not in sizes else None,
+        "formats": [
+            {
+                "format_id": fmt.get("format_id"),
+                "ext": fmt.get("ext"),
+                "resolution": fmt.get("resolution"),
+                "height": fmt.get("height"),
+                "fps": fmt.get("fps"),
+                "vcodec": fmt.get("vcodec"),
+                "acodec": fmt.get("acodec"),
+                "tbr": fmt.get("tbr"),
+                "filesize": format_size(fmt),
+            }
+            for fmt in info.get("formats") or []
+        ],
+    }
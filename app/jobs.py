@@ -0,0 +1,912 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import socket
+import sqlite3
+import logging
+import threading
+from enum import Enum
+from dataclasses import dataclass, asdict, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from app.auth import DEFAULT_PRIORITY
+from app.metrics import JOBS_RECOVERED
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite").lower()  # sqlite or redis
+# inline: API processes run jobs themselves, worker: jobs are run by `python -m app.worker` processes
+JOB_EXECUTION = os.getenv("JOB_EXECUTION", "inline").lower()
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "/tmp/ytdl-jobs.db")
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "604800"))  # 7 days
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# A process whose heartbeat is older than this is considered dead and its unfinished jobs are taken over
+WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", "30"))
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "60"))  # Grace period for running jobs on shutdown
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"  # Batch item waiting for the batch to have room for it
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    UPLOADING = "uploading"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = {JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED}
+# Unfinished jobs that belong to a process, see JobStore.orphaned
+OWNED_STATUSES = [JobStatus.QUEUED, JobStatus.DOWNLOADING, JobStatus.UPLOADING]
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+    pass
+
+
+@dataclass
+class Job:
+    """A single download job and its progress"""
+    url: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    s3_key: Optional[str] = None
+    error: Optional[str] = None
+    priority: int = DEFAULT_PRIORITY
+    api_key_id: Optional[str] = None
+    worker_id: Optional[str] = None
+    batch_id: Optional[str] = None
+    profile: Optional[str] = None  # Output profile name, None for the default
+    callback_url: Optional[str] = None  # Receives the outcome, see app.webhooks
+    upload_started_at: Optional[float] = None
+    size_bytes: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["status"] = self.status.value
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        data = dict(data)
+        data["status"] = JobStatus(data["status"])
+        return cls(**data)
+
+
+JOB_FIELDS = list(Job.__dataclass_fields__)
+
+
+class JobStore:
+    """Interface for persistent job records"""
+
+    def create(self, job: Job) -> Job:
+        """Persist a job, replacing any existing record with the same id"""
+        raise NotImplementedError
+
+    def create_many(self, jobs: List[Job]) -> List[Job]:
+        """Persist several jobs at once, e.g. the items of a batch"""
+        return [self.create(job) for job in jobs]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def update(self, job_id: str, unless_finished: bool = False, **fields) -> None:
+        raise NotImplementedError
+
+    def list(self, status: Optional[JobStatus] = None, limit: int = 50) -> List[Job]:
+        raise NotImplementedError
+
+    def list_batch(self, batch_id: str) -> List[Job]:
+        """Every job of a batch, in submission order"""
+        raise NotImplementedError
+
+    def enqueue(self, job: Job) -> Job:
+        """Persist a job and make it available to claim_next"""
+        return self.create(job)
+
+    def claim_next(self, worker_id: str) -> Optional[Job]:
+        """
+        Atomically take the queued job with the lowest priority value
+
+        The job is moved to DOWNLOADING and stamped with worker_id, so no
+        two workers, in any process, can claim the same job.
+        """
+        raise NotImplementedError
+
+    def queued_count(self) -> int:
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id: str, lease_seconds: float = WORKER_LEASE_SECONDS) -> None:
+        """Keep a process's jobs owned for another lease_seconds"""
+        raise NotImplementedError
+
+    def retire_worker(self, worker_id: str) -> None:
+        """Give up a process's lease, its unfinished jobs become orphans right away"""
+        raise NotImplementedError
+
+    def orphaned(self, statuses: List[JobStatus], lease_seconds: float = WORKER_LEASE_SECONDS) -> List[Job]:
+        """Jobs in one of statuses whose owning process has stopped heartbeating"""
+        raise NotImplementedError
+
+    def adopt(self, job: Job, worker_id: Optional[str], status: JobStatus) -> bool:
+        """
+        Atomically move an orphaned job to a new owner and status
+
+        A worker_id of None makes the job claimable by any worker process.
+
+        Returns:
+            False if the job changed in the meantime, e.g. another process adopted it
+        """
+        raise NotImplementedError
+
+    def set_status(self, job_id: str, status: JobStatus, **fields) -> None:
+        """
+        Move a job to a new status, stamping the relevant timestamps
+
+        Progress updates never overwrite a finished status, so a job
+        cancelled from another process stays cancelled.
+        """
+        now = time.time()
+        if status == JobStatus.DOWNLOADING:
+            fields.setdefault("started_at", now)
+        if status == JobStatus.UPLOADING:
+            fields.setdefault("upload_started_at", now)
+        if status in FINISHED_STATUSES:
+            fields.setdefault("finished_at", now)
+        self.update(job_id, status=status, unless_finished=status not in FINISHED_STATUSES, **fields)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLite-backed job store
+
+    The database file can be shared by every uvicorn worker on the host,
+    WAL mode lets readers poll while a worker writes.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    s3_key TEXT,
+                    error TEXT
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)"
+            )
+            self._migrate()
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id)")
+
+    # Columns added after the initial schema, with their SQL definitions
+    ADDED_COLUMNS = {
+        "priority": f"INTEGER NOT NULL DEFAULT {DEFAULT_PRIORITY}",
+        "api_key_id": "TEXT",
+        "worker_id": "TEXT",
+        "batch_id": "TEXT",
+        "profile": "TEXT",
+        "callback_url": "TEXT",
+        "upload_started_at": "REAL",
+        "size_bytes": "INTEGER",
+    }
+
+    def _migrate(self) -> None:
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, definition in self.ADDED_COLUMNS.items():
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def _row_to_job(self, row: sqlite3.Row) -> Job:
+        return Job.from_dict({name: row[name] for name in JOB_FIELDS})
+
+    def create(self, job: Job) -> Job:
+        self.create_many([job])
+        return job
+
+    def create_many(self, jobs: List[Job]) -> List[Job]:
+        columns = ", ".join(JOB_FIELDS)
+        placeholders = ", ".join(f":{name}" for name in JOB_FIELDS)
+        # One transaction and one retention sweep however many jobs there are
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO jobs ({columns}) VALUES ({placeholders})",
+                [job.to_dict() for job in jobs]
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE created_at < ?",
+                (time.time() - JOB_RETENTION_SECONDS,)
+            )
+        return jobs
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id: str, unless_finished: bool = False, **fields) -> None:
+        fields["updated_at"] = time.time()
+        if "status" in fields:
+            fields["status"] = JobStatus(fields["status"]).value
+        unknown = set(fields) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        query = f"UPDATE jobs SET {assignments} WHERE id = :id"
+        if unless_finished:
+            finished = ", ".join(f"'{status.value}'" for status in FINISHED_STATUSES)
+            query += f" AND status NOT IN ({finished})"
+        with self._lock, self._conn:
+            self._conn.execute(query, {**fields, "id": job_id})
+
+    def claim_next(self, worker_id: str) -> Optional[Job]:
+        now = time.time()
+        with self._lock, self._conn:
+            # Take the write lock up front so workers in other processes cannot claim the same row
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY priority, created_at LIMIT 1",
+                (JobStatus.QUEUED.value,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, updated_at = ?, worker_id = ? WHERE id = ?",
+                (JobStatus.DOWNLOADING.value, now, now, worker_id, row["id"])
+            )
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        return self._row_to_job(row)
+
+    def queued_count(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (JobStatus.QUEUED.value,)
+            ).fetchone()
+        return row[0]
+
+    def heartbeat(self, worker_id: str, lease_seconds: float = WORKER_LEASE_SECONDS) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)", (worker_id, now))
+            self._conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - lease_seconds * 10,))
+
+    def retire_worker(self, worker_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def orphaned(self, statuses: List[JobStatus], lease_seconds: float = WORKER_LEASE_SECONDS) -> List[Job]:
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({placeholders}) AND worker_id IS NOT NULL "
+                "AND worker_id NOT IN (SELECT worker_id FROM workers WHERE heartbeat_at >= ?) "
+                "ORDER BY priority, created_at",
+                [JobStatus(status).value for status in statuses] + [time.time() - lease_seconds]
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def adopt(self, job: Job, worker_id: Optional[str], status: JobStatus) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, updated_at = ? WHERE id = ? AND status = ? AND worker_id = ?",
+                (JobStatus(status).value, worker_id, time.time(), job.id, job.status.value, job.worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def list(self, status: Optional[JobStatus] = None, limit: int = 50) -> List[Job]:
+        query = "SELECT * FROM jobs"
+        params: list = []
+        if status is not None:
+            query += " WHERE status = ?"
+            params.append(JobStatus(status).value)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def list_batch(self, batch_id: str) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at, rowid", (batch_id,)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+
+class RedisJobStore(JobStore):
+    """Redis-backed job store shared across workers and replicas"""
+
+    KEY_PREFIX = "ytdl:job:"
+    INDEX_KEY = "ytdl:jobs"
+    # Jobs waiting for a worker, scored so ZPOPMIN returns the lowest priority value, oldest first
+    QUEUED_KEY = "ytdl:jobs:queued"
+    BATCH_PREFIX = "ytdl:batch:"
+    # Heartbeat leases, every process that ever owned jobs, and the unfinished jobs each one owns
+    WORKER_PREFIX = "ytdl:worker:"
+    WORKERS_KEY = "ytdl:workers"
+    OWNED_PREFIX = "ytdl:jobs:owned:"
+    ADOPT_PREFIX = "ytdl:adopt:"
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.KEY_PREFIX}{job_id}"
+
+    def create(self, job: Job) -> Job:
+        self.create_many([job])
+        return job
+
+    def create_many(self, jobs: List[Job]) -> List[Job]:
+        # One round trip for the whole list
+        pipe = self.client.pipeline()
+        for job in jobs:
+            pipe.set(self._key(job.id), json.dumps(job.to_dict()), ex=JOB_RETENTION_SECONDS)
+            pipe.zadd(self.INDEX_KEY, {job.id: job.created_at})
+            if job.batch_id:
+                batch_key = f"{self.BATCH_PREFIX}{job.batch_id}"
+                pipe.zadd(batch_key, {job.id: job.created_at})
+                pipe.expire(batch_key, JOB_RETENTION_SECONDS)
+            if job.worker_id and job.status not in FINISHED_STATUSES:
+                pipe.sadd(f"{self.OWNED_PREFIX}{job.worker_id}", job.id)
+        pipe.zremrangebyscore(self.INDEX_KEY, 0, time.time() - JOB_RETENTION_SECONDS)
+        pipe.execute()
+        return jobs
+
+    def get(self, job_id: str) -> Optional[Job]:
+        data = self.client.get(self._key(job_id))
+        return Job.from_dict(json.loads(data)) if data else None
+
+    def update(self, job_id: str, unless_finished: bool = False, **fields) -> None:
+        key = self._key(job_id)
+
+        def apply(pipe) -> None:
+            data = pipe.get(key)
+            if data is None:
+                return
+            job = Job.from_dict(json.loads(data))
+            if unless_finished and job.status in FINISHED_STATUSES:
+                return
+            data = job.to_dict()
+            data.update(fields)
+            data["updated_at"] = time.time()
+            data["status"] = JobStatus(data["status"]).value
+            pipe.multi()
+            pipe.set(key, json.dumps(data), ex=JOB_RETENTION_SECONDS)
+            if data["status"] != JobStatus.QUEUED.value:
+                pipe.zrem(self.QUEUED_KEY, job_id)
+            if job.worker_id and (job.worker_id != data["worker_id"] or JobStatus(data["status"]) in FINISHED_STATUSES):
+                pipe.srem(f"{self.OWNED_PREFIX}{job.worker_id}", job_id)
+            if data["worker_id"] and JobStatus(data["status"]) not in FINISHED_STATUSES:
+                pipe.sadd(f"{self.OWNED_PREFIX}{data['worker_id']}", job_id)
+
+        # WATCHed, so a concurrent cancel or status change makes redis-py rerun apply instead of being lost
+        self.client.transaction(apply, key)
+
+    def list_batch(self, batch_id: str) -> List[Job]:
+        job_ids = self.client.zrange(f"{self.BATCH_PREFIX}{batch_id}", 0, -1)
+        return [job for job in (self.get(job_id) for job_id in job_ids) if job is not None]
+
+    def enqueue(self, job: Job) -> Job:
+        self.create(job)
+        self.client.zadd(self.QUEUED_KEY, {job.id: job.priority * 1e10 + job.created_at})
+        return job
+
+    def claim_next(self, worker_id: str) -> Optional[Job]:
+        while True:
+            popped = self.client.zpopmin(self.QUEUED_KEY)
+            if not popped:
+                return None
+            job_id = popped[0][0]
+            job = self.get(job_id)
+            # Expired or cancelled between being queued and popped
+            if job is None or job.status != JobStatus.QUEUED:
+                continue
+            self.set_status(job_id, JobStatus.DOWNLOADING, worker_id=worker_id)
+            return self.get(job_id)
+
+    def queued_count(self) -> int:
+        return self.client.zcard(self.QUEUED_KEY)
+
+    def heartbeat(self, worker_id: str, lease_seconds: float = WORKER_LEASE_SECONDS) -> None:
+        pipe = self.client.pipeline()
+        pipe.set(f"{self.WORKER_PREFIX}{worker_id}", time.time(), ex=max(1, int(lease_seconds)))
+        pipe.sadd(self.WORKERS_KEY, worker_id)
+        pipe.execute()
+
+    def retire_worker(self, worker_id: str) -> None:
+        self.client.delete(f"{self.WORKER_PREFIX}{worker_id}")
+
+    def orphaned(self, statuses: List[JobStatus], lease_seconds: float = WORKER_LEASE_SECONDS) -> List[Job]:
+        # Leases expire on their own, lease_seconds is applied by heartbeat()
+        wanted = {JobStatus(status) for status in statuses}
+        orphans = []
+        for worker_id in self.client.smembers(self.WORKERS_KEY):
+            if self.client.exists(f"{self.WORKER_PREFIX}{worker_id}"):
+                continue
+            owned_key = f"{self.OWNED_PREFIX}{worker_id}"
+            unfinished = 0
+            for job_id in self.client.smembers(owned_key):
+                job = self.get(job_id)
+                if job is None or job.worker_id != worker_id or job.status in FINISHED_STATUSES:
+                    self.client.srem(owned_key, job_id)
+                    continue
+                unfinished += 1
+                if job.status in wanted:
+                    orphans.append(job)
+            if not unfinished:
+                # Nothing left to take over from this process
+                self.client.srem(self.WORKERS_KEY, worker_id)
+                self.client.delete(owned_key)
+        orphans.sort(key=lambda job: (job.priority, job.created_at))
+        return orphans
+
+    def adopt(self, job: Job, worker_id: Optional[str], status: JobStatus) -> bool:
+        # Only one process may take a job over, the marker outlives any recovery pass
+        if not self.client.set(f"{self.ADOPT_PREFIX}{job.id}:{job.worker_id}", worker_id or "", nx=True, ex=3600):
+            return False
+        current = self.get(job.id)
+        if current is None or current.status != job.status or current.worker_id != job.worker_id:
+            return False
+        self.update(job.id, status=status, worker_id=worker_id)
+        if worker_id is None and status == JobStatus.QUEUED:
+            self.client.zadd(self.QUEUED_KEY, {job.id: job.priority * 1e10 + job.created_at})
+        return True
+
+    def list(self, status: Optional[JobStatus] = None, limit: int = 50) -> List[Job]:
+        jobs = []
+        # Over-fetch when filtering so a page of matches is usually found in one pass
+        batch = limit if status is None else limit * 5
+        job_ids = self.client.zrevrange(self.INDEX_KEY, 0, batch - 1)
+        for job_id in job_ids:
+            job = self.get(job_id)
+            if job is None or (status is not None and job.status != JobStatus(status)):
+                continue
+            jobs.append(job)
+            if len(jobs) >= limit:
+                break
+        return jobs
+
+
+def create_job_store(backend: str = JOB_STORE_BACKEND) -> JobStore:
+    """Create the configured job store"""
+    if backend == "redis":
+        logger.info("Using Redis job store")
+        return RedisJobStore()
+    if backend != "sqlite":
+        logger.warning(f"Unknown JOB_STORE_BACKEND '{backend}', falling back to sqlite")
+    logger.info(f"Using SQLite job store at {JOB_DB_PATH}")
+    return SQLiteJobStore()
+
+
+class JobQueue:
+    """
+    Bounded in-process queue feeding a fixed number of job workers
+
+    submit() never blocks: when the queue is full it raises QueueFullError so
+    the API can shed load instead of piling up background tasks.
+
+    Jobs are stamped with the worker_id of the process holding them, which
+    keeps a lease in the job store by heartbeating. Jobs left unfinished
+    by a process that crashed or was stopped are taken over by recover(),
+    which runs once per lease interval.
+    """
+
+    def __init__(self, store: JobStore, maxsize: int = JOB_QUEUE_SIZE):
+        self.store = store
+        self.maxsize = maxsize
+        # Unique per process start, a restarted container may reuse its pids
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled: Set[str] = set()
+        self._submitting = 0
+        self._stopping = False
+        self._draining = False
+        self._on_finished: Optional[Callable[[Job], Awaitable[None]]] = None
+        self._on_recovered: Optional[Callable[[Job], None]] = None
+        self._gate: Optional[Callable[[], Awaitable[None]]] = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(
+        self,
+        handler: Callable[[Job], Awaitable[None]],
+        concurrency: int,
+        on_finished: Optional[Callable[[Job], Awaitable[None]]] = None,
+        gate: Optional[Callable[[], Awaitable[None]]] = None,
+        on_recovered: Optional[Callable[[Job], None]] = None,
+    ) -> None:
+        """
+        Start worker tasks that pass queued jobs to handler
+
+        on_finished is awaited once for every job that leaves the queue,
+        whether it ran to completion, failed or was cancelled before starting.
+        Workers await gate, if given, before starting each job, which lets
+        it hold jobs in the queue (e.g. while the upstream is throttling).
+        on_recovered is called, off the event loop, for every job taken over
+        from a stopped process before it is queued.
+        """
+        self._stopping = False
+        self._draining = False
+        self._on_finished = on_finished
+        self._on_recovered = on_recovered
+        self._gate = gate
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._worker(handler), name=f"job-worker-{i}")
+            for i in range(concurrency)
+        ]
+        self._start_heartbeat()
+        logger.info(f"Started {concurrency} job worker(s), queue size {self.maxsize}")
+
+    def _start_heartbeat(self) -> None:
+        # Taken before anything else so recover() never mistakes this process's jobs for orphans
+        self.store.heartbeat(self.worker_id)
+        self._workers.append(asyncio.create_task(self._heartbeat(), name="job-heartbeat"))
+        self._workers.append(asyncio.create_task(self._recover_periodically(), name="job-recovery"))
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(WORKER_LEASE_SECONDS / 3)
+            try:
+                # A write stuck on the store's lock must not stall the loop, nor the lease with it
+                await asyncio.to_thread(self.store.heartbeat, self.worker_id)
+            except Exception as e:
+                logger.warning(f"Job store heartbeat failed: {str(e)}")
+
+    async def _recover_periodically(self) -> None:
+        # A process that stops later is only seen as dead once its lease has run out, look again every lease
+        while True:
+            if not self._draining:
+                try:
+                    await self.recover()
+                except Exception as e:
+                    logger.warning(f"Job recovery failed: {str(e)}")
+            await asyncio.sleep(WORKER_LEASE_SECONDS)
+
+    async def drain(self, timeout: float = JOB_DRAIN_SECONDS) -> None:
+        """
+        Stop accepting and starting jobs, and give running ones up to
+        timeout seconds to finish
+
+        Jobs still running afterwards are cancelled by stop() and resumed
+        from their checkpoints by whichever process recovers them.
+        """
+        self._draining = True
+        if not self._running:
+            return
+        logger.info(f"Draining {len(self._running)} running job(s), waiting up to {timeout:.0f}s")
+        deadline = time.monotonic() + timeout
+        while self._running and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        if self._running:
+            logger.warning(f"{len(self._running)} job(s) still running after {timeout:.0f}s, leaving them for recovery")
+
+    async def stop(self) -> None:
+        """Cancel the workers, leaving unstarted and interrupted jobs in the store for recovery"""
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        try:
+            await asyncio.to_thread(self.store.retire_worker, self.worker_id)
+        except Exception as e:
+            logger.warning(f"Failed to give up job lease: {str(e)}")
+
+    async def submit(self, job: Job) -> Job:
+        """Persist and enqueue a job"""
+        if self._queue is None:
+            raise QueueFullError("Job queue is not running")
+        if self._draining:
+            raise QueueFullError("Shutting down, not accepting new jobs")
+        if self._queue.qsize() + self._submitting >= self.maxsize:
+            raise QueueFullError(f"Job queue is full ({self.maxsize} jobs waiting)")
+        job.worker_id = self.worker_id
+        # The slot is held while the job is written off the event loop
+        self._submitting += 1
+        try:
+            await asyncio.to_thread(self.store.create, job)
+        finally:
+            self._submitting -= 1
+        self._queue.put_nowait(job)
+        return job
+
+    async def recover(self) -> List[Job]:
+        """
+        Take over jobs left queued or running by dead processes
+
+        Interrupted downloads and uploads restart from their checkpoints,
+        see app.checkpoints.
+
+        Returns:
+            The jobs taken over
+        """
+        room = self.maxsize - self._queue.qsize() - self._submitting
+        recovered = await asyncio.to_thread(self._adopt_orphans, room)
+        for job in recovered:
+            # Submissions may have taken the room in the meantime, wait for the workers
+            await self._queue.put(job)
+        if recovered:
+            JOBS_RECOVERED.inc(len(recovered))
+            logger.info(f"Recovered {len(recovered)} job(s) from stopped processes")
+        return recovered
+
+    def _adopt_orphans(self, limit: int) -> List[Job]:
+        adopted = []
+        for job in self.store.orphaned(OWNED_STATUSES):
+            if len(adopted) >= limit:
+                logger.warning("Job queue is full, leaving the remaining orphaned jobs for later")
+                break
+            if not self.store.adopt(job, self.worker_id, JobStatus.QUEUED):
+                continue
+            job.status = JobStatus.QUEUED
+            job.worker_id = self.worker_id
+            self._recovered(job)
+            adopted.append(job)
+        return adopted
+
+    def _recovered(self, job: Job) -> None:
+        if self._on_recovered is None:
+            return
+        try:
+            self._on_recovered(job)
+        except Exception as e:
+            logger.warning(f"Job recovered callback failed for {job.id}: {str(e)}")
+
+    async def cancel(self, job_id: str, timeout: float = 5.0) -> bool:
+        """
+        Cancel a queued or running job owned by this process
+
+        Running jobs have their task cancelled, which kills the yt-dlp
+        process unless another request is sharing the download, and are
+        given up to `timeout` seconds to unwind.
+
+        Returns:
+            True if the job was found and cancelled
+        """
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.wait({task}, timeout=timeout)
+            await asyncio.to_thread(self.store.set_status, job_id, JobStatus.CANCELLED)
+            return True
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job.status != JobStatus.QUEUED:
+            return False
+        self._cancelled.add(job_id)
+        await asyncio.to_thread(self.store.set_status, job_id, JobStatus.CANCELLED)
+        return True
+
+    async def wait(self, job_id: str, poll_interval: float = JOB_POLL_INTERVAL) -> Optional[Job]:
+        """
+        Wait until a job, run by any process, has finished
+
+        Returns:
+            The finished job, or None if it disappeared from the store
+        """
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return job
+            await asyncio.sleep(poll_interval)
+
+    async def _worker(self, handler: Callable[[Job], Awaitable[None]]) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if self._gate is not None:
+                    await self._gate()
+                if self._draining:
+                    # Left queued in the store for the next process
+                    continue
+                if job.id in self._cancelled:
+                    self._cancelled.discard(job.id)
+                    await self._finished(job)
+                    continue
+                await self._run(job, handler)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job, handler: Callable[[Job], Awaitable[None]]) -> None:
+        task = asyncio.create_task(handler(job), name=f"job-{job.id}")
+        self._running[job.id] = task
+        interrupted = False
+        try:
+            await task
+        except asyncio.CancelledError:
+            if self._stopping:
+                # Not finished, whoever recovers the job finishes it
+                interrupted = True
+                raise
+            logger.info(f"Job {job.id} cancelled")
+            await asyncio.to_thread(self.store.set_status, job.id, JobStatus.CANCELLED)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            await asyncio.to_thread(self.store.set_status, job.id, JobStatus.FAILED, error=str(e))
+        finally:
+            self._running.pop(job.id, None)
+            if not interrupted:
+                await self._finished(job)
+
+    async def _finished(self, job: Job) -> None:
+        if self._on_finished is None:
+            return
+        try:
+            await self._on_finished(job)
+        except Exception as e:
+            logger.warning(f"Job finished callback failed for {job.id}: {str(e)}")
+
+
+class SharedJobQueue(JobQueue):
+    """
+    Job queue kept in the job store and drained by worker processes
+
+    API processes only persist jobs with submit(), workers started with
+    `python -m app.worker` claim them with JobStore.claim_next. Cancelling
+    marks the job in the store; the worker running it notices on its next
+    poll and cancels the job locally.
+    """
+
+    def __init__(self, store: JobStore, maxsize: int = JOB_QUEUE_SIZE, poll_interval: float = JOB_POLL_INTERVAL):
+        super().__init__(store, maxsize)
+        self.poll_interval = poll_interval
+
+    @property
+    def depth(self) -> int:
+        return self.store.queued_count()
+
+    def start(
+        self,
+        handler: Callable[[Job], Awaitable[None]],
+        concurrency: int,
+        on_finished: Optional[Callable[[Job], Awaitable[None]]] = None,
+        gate: Optional[Callable[[], Awaitable[None]]] = None,
+        on_recovered: Optional[Callable[[Job], None]] = None,
+    ) -> None:
+        """
+        Start claiming jobs from the store, see JobQueue.start
+
+        API processes start with a concurrency of zero, which claims
+        nothing but still reports jobs they cancel to on_finished. Jobs
+        are only claimed once gate lets the worker through, so held jobs
+        stay queued for workers whose gate is open.
+        """
+        self._stopping = False
+        self._draining = False
+        self._on_finished = on_finished
+        self._on_recovered = on_recovered
+        self._gate = gate
+        self._workers = [
+            asyncio.create_task(self._worker(handler), name=f"job-worker-{i}")
+            for i in range(concurrency)
+        ]
+        # API processes heartbeat too, they own the batches they dispatch
+        self._start_heartbeat()
+        if concurrency:
+            self._workers.append(asyncio.create_task(self._watch_cancellations(), name="job-cancel-watcher"))
+            logger.info(f"Worker {self.worker_id} started with {concurrency} job worker(s)")
+
+    async def submit(self, job: Job) -> Job:
+        """Persist a job for a worker process to claim"""
+        if self._draining:
+            raise QueueFullError("Shutting down, not accepting new jobs")
+        # Owned by whichever worker claims it
+        job.worker_id = None
+        return await asyncio.to_thread(self._enqueue, job)
+
+    def _enqueue(self, job: Job) -> Job:
+        if self.store.queued_count() >= self.maxsize:
+            raise QueueFullError(f"Job queue is full ({self.maxsize} jobs waiting)")
+        return self.store.enqueue(job)
+
+    async def cancel(self, job_id: str, timeout: float = 5.0) -> bool:
+        """
+        Cancel a queued or running job in any process
+
+        Jobs running in this process are cancelled directly, jobs running
+        elsewhere are marked cancelled and stopped by their worker.
+
+        Returns:
+            True if the job was found and cancelled
+        """
+        if job_id in self._running:
+            return await super().cancel(job_id, timeout)
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return False
+        await asyncio.to_thread(self.store.set_status, job_id, JobStatus.CANCELLED)
+        if job.status == JobStatus.QUEUED:
+            # No worker will ever see it
+            await self._finished(job)
+        return True
+
+    async def recover(self) -> List[Job]:
+        """Put jobs claimed by dead worker processes back in the shared queue, see JobQueue.recover"""
+        recovered = await asyncio.to_thread(self._requeue_orphans)
+        if recovered:
+            JOBS_RECOVERED.inc(len(recovered))
+            logger.info(f"Requeued {len(recovered)} job(s) from stopped worker processes")
+        return recovered
+
+    def _requeue_orphans(self) -> List[Job]:
+        requeued = []
+        for job in self.store.orphaned(OWNED_STATUSES):
+            if job.status == JobStatus.QUEUED:
+                # Claimable already
+                continue
+            if self.store.adopt(job, None, JobStatus.QUEUED):
+                self._recovered(job)
+                requeued.append(job)
+        return requeued
+
+    async def _worker(self, handler: Callable[[Job], Awaitable[None]]) -> None:
+        while True:
+            if self._draining:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if self._gate is not None:
+                await self._gate()
+            # Claims wait on the store's write lock, keep them off the event loop
+            job = await asyncio.to_thread(self.store.claim_next, self.worker_id)
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._run(job, handler)
+
+    async def _watch_cancellations(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for job_id, task in list(self._running.items()):
+                job = await asyncio.to_thread(self.store.get, job_id)
+                if job is not None and job.status == JobStatus.CANCELLED and not task.done():
+                    logger.info(f"Job {job_id} was cancelled, stopping it")
+                    task.cancel()
+
+
+def create_job_queue(execution: str = JOB_EXECUTION) -> JobQueue:
+    """Create the job queue for the configured execution mode"""
+    if execution == "worker":
+        logger.info("Jobs are executed by worker processes")
+        return SharedJobQueue(job_store)
+    if execution != "inline":
+        logger.warning(f"Unknown JOB_EXECUTION '{execution}', falling back to inline")
+    return JobQueue(job_store)
+
+
+# Global job store and queue
+job_store = create_job_store()
+job_queue = create_job_queue()
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, asdict, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.metrics import API_KEYS_LOADED
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Keys registered at runtime, e.g. by /generate-key: sqlite, file or none (environment keys only)
+API_KEY_STORE = os.getenv("API_KEY_STORE", "sqlite").lower()
+API_KEY_DB_PATH = os.getenv("API_KEY_DB_PATH", os.getenv("JOB_DB_PATH", "/tmp/ytdl-jobs.db"))
+API_KEYS_FILE = os.getenv("API_KEYS_FILE", "/app/keys/api_keys.json")
+API_KEY_RELOAD_SECONDS = float(os.getenv("API_KEY_RELOAD_SECONDS", "5"))  # How often the store is checked for changes
+
+
+def hash_key(key: str) -> str:
+    """SHA-256 hex digest of an API key, the only form in which keys are stored"""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class ApiKey:
+    """
+    A registered key and its limits
+
+    Limits left as None fall back to the global defaults (DEFAULT_PRIORITY,
+    RATE_LIMIT_*), a limit of 0 disables that limit for the key.
+    """
+    key_hash: str
+    name: Optional[str] = None
+    priority: Optional[int] = None
+    requests_per_window: Optional[int] = None
+    bytes_per_window_mb: Optional[int] = None
+    max_concurrent_jobs: Optional[int] = None
+    disabled: bool = False
+    created_at: float = 0.0
+
+    @property
+    def key_id(self) -> str:
+        """Short, non-reversible identifier used to key limits and jobs"""
+        return self.key_hash[:16]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ApiKey":
+        known = {f.name for f in fields(cls)}
+        data = {name: value for name, value in data.items() if name in known}
+        data["disabled"] = bool(data.get("disabled"))
+        return cls(**data)
+
+
+def load_env_keys() -> List[ApiKey]:
+    """
+    Keys configured through the environment
+
+    API_KEY, API_KEY_1, API_KEY_2, ... and the comma-separated API_KEYS.
+    API_KEY_PRIORITIES holds comma-separated key:priority pairs, e.g.
+    "premium-key:0,batch-key:20". Lower values are scheduled first.
+    """
+    keys = []
+    primary_key = os.getenv("API_KEY")
+    if primary_key:
+        keys.append(primary_key)
+    i = 1
+    while True:
+        key = os.getenv(f"API_KEY_{i}")
+        if not key:
+            break
+        keys.append(key)
+        i += 1
+    for key in os.getenv("API_KEYS", "").split(","):
+        key = key.strip()
+        if key:
+            keys.append(key)
+
+    priorities = {}
+    for entry in os.getenv("API_KEY_PRIORITIES", "").split(","):
+        key, _, priority = entry.strip().rpartition(":")
+        if not key:
+            continue
+        try:
+            priorities[hash_key(key)] = int(priority)
+        except ValueError:
+            logger.warning("Ignoring API_KEY_PRIORITIES entry with a non-integer priority")
+
+    records = {}
+    for key in keys:
+        key_hash = hash_key(key)
+        records[key_hash] = ApiKey(key_hash=key_hash, priority=priorities.get(key_hash))
+    return list(records.values())
+
+
+class KeyStore:
+    """Interface for keys registered at runtime"""
+
+    def load(self) -> List[ApiKey]:
+        raise NotImplementedError
+
+    def add(self, key: ApiKey) -> None:
+        raise NotImplementedError
+
+    def version(self) -> Any:
+        """Cheap marker that changes whenever the stored keys may have changed"""
+        raise NotImplementedError
+
+
+class FileKeyStore(KeyStore):
+    """
+    Keys in a JSON file, a list of objects with the fields of ApiKey
+
+    Operators may add an entry with a plaintext "key" instead of a
+    "key_hash". Edits are picked up by mtime, writes replace the file
+    atomically so readers in other processes never see a partial list.
+    """
+
+    def __init__(self, path: str = API_KEYS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> List[dict]:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        if isinstance(entries, dict):
+            entries = entries.get("keys", [])
+        return entries
+
+    def load(self) -> List[ApiKey]:
+        keys = []
+        for entry in self._read():
+            entry = dict(entry)
+            if "key" in entry:
+                entry["key_hash"] = hash_key(entry.pop("key"))
+            if not entry.get("key_hash"):
+                logger.warning(f"Ignoring entry without a key in {self.path}")
+                continue
+            keys.append(ApiKey.from_dict(entry))
+        return keys
+
+    def add(self, key: ApiKey) -> None:
+        with self._lock:
+            entries = self._read()
+            entries.append(key.to_dict())
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def version(self) -> Any:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class SQLiteKeyStore(KeyStore):
+    """Keys in a table of the job database, shared by every process on the host"""
+
+    def __init__(self, path: str = API_KEY_DB_PATH):
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS api_keys (
+                    key_hash TEXT PRIMARY KEY,
+                    name TEXT,
+                    priority INTEGER,
+                    requests_per_window INTEGER,
+                    bytes_per_window_mb INTEGER,
+                    max_concurrent_jobs INTEGER,
+                    disabled INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def load(self) -> List[ApiKey]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM api_keys").fetchall()
+        return [ApiKey.from_dict(dict(row)) for row in rows]
+
+    def add(self, key: ApiKey) -> None:
+        data = key.to_dict()
+        columns = ", ".join(data)
+        placeholders = ", ".join(f":{name}" for name in data)
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO api_keys ({columns}) VALUES ({placeholders})", data)
+            self._writes += 1
+
+    def version(self) -> Any:
+        # data_version only moves on commits by other connections, count our own
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            return (data_version, self._writes)
+
+
+def create_key_store(backend: str = API_KEY_STORE) -> Optional[KeyStore]:
+    """Create the configured key store, None keeps to the environment keys"""
+    if backend == "sqlite":
+        logger.info("Using SQLite API key store")
+        return SQLiteKeyStore()
+    if backend == "file":
+        logger.info(f"Using API key file {API_KEYS_FILE}")
+        return FileKeyStore()
+    if backend != "none":
+        logger.warning(f"Unknown API_KEY_STORE '{backend}', using environment keys only")
+    return None
+
+
+class KeyRegistry:
+    """
+    In-memory index of every valid key, reloaded when the store changes
+
+    Keys are looked up by their SHA-256 digest, so a lookup costs one hash
+    and one dict probe whatever the number of keys, and its timing reveals
+    nothing about stored keys. Both indexes are rebuilt off to the side and
+    swapped in with a single assignment, readers never take a lock. API
+    and worker processes call start() to check the store every
+    reload_seconds from a background task that reads it in a thread, so
+    they see new keys without a restart and lookups never wait on the
+    store. Without it (scripts, benchmarks) the first lookup after
+    reload_seconds checks the store itself.
+    """
+
+    def __init__(
+        self,
+        store: Optional[KeyStore],
+        env_keys: Optional[List[ApiKey]] = None,
+        reload_seconds: float = API_KEY_RELOAD_SECONDS,
+    ):
+        self.store = store
+        self.env_keys = env_keys or []
+        self.reload_seconds = reload_seconds
+        self._index: Tuple[Dict[bytes, ApiKey], Dict[str, ApiKey]] = ({}, {})
+        self._version: Any = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        self._refresher: Optional[asyncio.Task] = None
+        self.reload(force=True)
+
+    def __len__(self) -> int:
+        return len(self._index[0])
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Rebuild the index if the store changed
+
+        Returns:
+            True if the index was rebuilt
+        """
+        with self._reload_lock:
+            self._next_check = time.monotonic() + self.reload_seconds
+            stored: List[ApiKey] = []
+            version = None
+            if self.store is not None:
+                try:
+                    version = self.store.version()
+                    if not force and version == self._version:
+                        return False
+                    stored = self.store.load()
+                except Exception as e:
+                    # Keep serving the last good index rather than locking every client out
+                    logger.error(f"Failed to load API keys, keeping the previous ones: {str(e)}")
+                    return False
+            elif not force:
+                return False
+
+            by_digest: Dict[bytes, ApiKey] = {}
+            for key in self.env_keys + stored:
+                try:
+                    digest = bytes.fromhex(key.key_hash)
+                except ValueError:
+                    logger.warning(f"Ignoring API key '{key.name or ''}' with a malformed key_hash")
+                    continue
+                # Stored entries come last and override environment keys with the same value
+                by_digest[digest] = key
+            by_digest = {digest: key for digest, key in by_digest.items() if not key.disabled}
+            by_id = {key.key_id: key for key in by_digest.values()}
+
+            self._index = (by_digest, by_id)
+            self._version = version
+        API_KEYS_LOADED.set(len(by_digest))
+        logger.info(f"Loaded {len(by_digest)} API key(s)")
+        return True
+
+    def start(self) -> None:
+        """Check the store for changes every reload_seconds in the background"""
+        if self.store is None or self._refresher is not None:
+            return
+        self._refresher = asyncio.create_task(self._refresh(), name="api-key-refresh")
+
+    async def stop(self) -> None:
+        if self._refresher is None:
+            return
+        self._refresher.cancel()
+        await asyncio.gather(self._refresher, return_exceptions=True)
+        self._refresher = None
+
+    async def _refresh(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            # SQLite or file reads, kept off the event loop
+            await asyncio.to_thread(self.reload)
+
+    def _maybe_reload(self) -> None:
+        if self._refresher is not None:
+            return
+        if time.monotonic() >= self._next_check:
+            # Claim the check so concurrent callers keep using the current index
+            self._next_check = time.monotonic() + self.reload_seconds
+            self.reload()
+
+    def lookup(self, token: str) -> Optional[ApiKey]:
+        """The key a bearer token belongs to, None if it is not a valid key"""
+        self._maybe_reload()
+        return self._index[0].get(hashlib.sha256(token.encode()).digest())
+
+    def get(self, key_id: str) -> Optional[ApiKey]:
+        """A key by its identifier, as recorded on jobs"""
+        self._maybe_reload()
+        return self._index[1].get(key_id)
+
+    def requests_limit(self, key_id: str) -> Optional[int]:
+        key = self.get(key_id)
+        return key.requests_per_window if key else None
+
+    def bytes_limit(self, key_id: str) -> Optional[int]:
+        key = self.get(key_id)
+        if key is None or key.bytes_per_window_mb is None:
+            return None
+        return key.bytes_per_window_mb * 1024 * 1024
+
+    def jobs_limit(self, key_id: str) -> Optional[int]:
+        key = self.get(key_id)
+        return key.max_concurrent_jobs if key else None
+
+    def register(self, key: str, **settings) -> ApiKey:
+        """
+        Store a new key, usable right away in this process and within
+        reload_seconds in every other one
+
+        Raises:
+            RuntimeError: If there is no key store to register it in
+        """
+        if self.store is None:
+            raise RuntimeError("No API key store configured (API_KEY_STORE=none)")
+        record = ApiKey(key_hash=hash_key(key), created_at=time.time(), **settings)
+        self.store.add(record)
+        self.reload(force=True)
+        return record
+
+
+# Global key registry instance
+key_registry = KeyRegistry(create_key_store(), load_env_keys())
@@ -1,12 +1,56 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.downloader import process_and_upload, VideoProcessingError
-from app.auth import verify_token, verify_token_with_rate_limit, generate_api_key
-from pydantic import BaseModel, HttpUrl
+from fastapi.responses import StreamingResponse
+from app.downloader import VideoProcessingError
+from app.scheduler import scheduler
+from app.jobs import (
+    Job,
+    JobStatus,
+    FINISHED_STATUSES,
+    JOB_EXECUTION,
+    QueueFullError,
+    job_store,
+    job_queue,
+)
+from app.worker import (
+    inflight_downloads,
+    get_cached_s3_key,
+    run_download,
+    charge_download,
+    handle_job,
+    finish_job,
+    reclaim_job_slot,
+    start_execution,
+    stop_execution,
+)
+from app.info import get_info, get_cached_info, summarize_info, expand_playlist
+from app.upstream import UpstreamThrottled, upstream_health
+from app.batch import batch_dispatcher, summarize_batch, BATCH_MAX_ITEMS
+from app.events import stream_job_events
+from app.profiles import OutputProfile, ProfileError, PROFILES, get_profile
+from app.webhooks import Delivery, notify_job_finished, webhook_dispatcher
+from app.auth import (
+    verify_token,
+    verify_token_with_rate_limit,
+    verify_admin_token,
+    generate_api_key,
+    get_request_priority,
+    get_api_key_id,
+)
+from app.keys import key_registry
+from app.mediacache import media_cache
+from app.bandwidth import bandwidth_shaper
+from app.delivery import VideoDeliveryError, is_video_key, object_metadata, presigned_url, video_response
+from app.ratelimit import bytes_limiter, job_limiter
+from app import metrics
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel, Field, HttpUrl
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import math
+import time
 from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 
 # Configure logging
 logging.basicConfig(
@@ -15,17 +59,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Thread pool for CPU-bound tasks
-executor = ThreadPoolExecutor(max_workers=3)
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting ytdl-microservice")
+    key_registry.start()
+    if JOB_EXECUTION == "worker":
+        # Stateless API, jobs are run by `python -m app.worker` processes
+        webhook_dispatcher.start()
+        job_queue.start(handle_job, concurrency=0, on_finished=finish_job, on_recovered=reclaim_job_slot)
+    else:
+        start_execution()
+    batch_dispatcher.start()
     yield
     # Shutdown
     logger.info("Shutting down ytdl-microservice")
-    executor.shutdown(wait=True)
+    await batch_dispatcher.stop()
+    if JOB_EXECUTION == "worker":
+        await job_queue.stop()
+        await webhook_dispatcher.stop()
+    else:
+        await stop_execution()
+    await key_registry.stop()
 
 app = FastAPI(
     title="YouTube Downloader Microservice",
@@ -45,74 +100,390 @@ app.add_middleware(
 
 class VideoRequest(BaseModel):
     youtube_url: HttpUrl
+    profile: Optional[str] = None  # e.g. "mp4-720" or "audio-m4a", see GET /profiles
+    callback_url: Optional[HttpUrl] = None  # /download-async only, receives the outcome
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "youtube_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+                "profile": "mp4-720"
+            }
+        }
+
+class KeyRequest(BaseModel):
+    name: Optional[str] = None
+    priority: Optional[int] = Field(None, ge=0)  # Lower runs first, defaults to DEFAULT_PRIORITY
+    # Unset limits follow RATE_LIMIT_*, 0 disables the limit for this key
+    requests_per_window: Optional[int] = Field(None, ge=0)
+    bytes_per_window_mb: Optional[int] = Field(None, ge=0)
+    max_concurrent_jobs: Optional[int] = Field(None, ge=0)
     
     class Config:
         schema_extra = {
             "example": {
-                "youtube_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+                "name": "reporting-service",
+                "priority": 5,
+                "max_concurrent_jobs": 2
             }
         }
 
 class VideoResponse(BaseModel):
     s3_key: str
     message: str = "Video processed successfully"
+    profile: Optional[str] = None
+    content_type: Optional[str] = None
+
+class FormatInfo(BaseModel):
+    format_id: Optional[str] = None
+    ext: Optional[str] = None
+    resolution: Optional[str] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    vcodec: Optional[str] = None
+    acodec: Optional[str] = None
+    tbr: Optional[float] = None
+    filesize: Optional[int] = None
+
+class InfoResponse(BaseModel):
+    id: Optional[str] = None
+    title: Optional[str] = None
+    duration: Optional[float] = None
+    uploader: Optional[str] = None
+    upload_date: Optional[str] = None
+    thumbnail: Optional[str] = None
+    webpage_url: Optional[str] = None
+    is_live: bool = False
+    selected_format: Optional[str] = None
+    estimated_size_bytes: Optional[int] = None
+    formats: List[FormatInfo] = []
+
+class TaskResponse(BaseModel):
+    task_id: str
+    url: str
+    status: str
+    created_at: float
+    updated_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    s3_key: Optional[str] = None
+    error: Optional[str] = None
+    batch_id: Optional[str] = None
+    profile: Optional[str] = None
+    size_bytes: Optional[int] = None
+
+    @classmethod
+    def from_job(cls, job: Job) -> "TaskResponse":
+        data = job.to_dict()
+        data["task_id"] = data.pop("id")
+        return cls(**data)
+
+class BatchRequest(BaseModel):
+    urls: List[HttpUrl] = []
+    playlist_url: Optional[HttpUrl] = None
+    profile: Optional[str] = None
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "playlist_url": "https://www.youtube.com/playlist?list=PLxxxxxxxxxxxxxxxx"
+            }
+        }
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    total: int
+    finished: int
+    progress: float
+    counts: Dict[str, int]
+    items: List[TaskResponse]
+
+class ProfileResponse(BaseModel):
+    name: str
+    container: str
+    content_type: str
+    audio_only: bool
+    max_height: Optional[int] = None
+
+class DeadLetterResponse(BaseModel):
+    delivery_id: str
+    url: str
+    payload: dict
+    attempts: int
+    created_at: float
+    failed_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_delivery(cls, delivery: Delivery) -> "DeadLetterResponse":
+        data = delivery.to_dict()
+        data["delivery_id"] = data.pop("id")
+        return cls(**data)
+
+class PresignedUrlResponse(BaseModel):
+    s3_key: str
+    url: str
+    expires_at: int
 
 class ErrorResponse(BaseModel):
     error: str
     detail: str
 
+def resolve_profile(name: Optional[str]) -> OutputProfile:
+    """
+    Output profile requested by the client
+    
+    Raises:
+        HTTPException: 400 if there is no such profile
+    """
+    try:
+        return get_profile(name)
+    except ProfileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def admit_job(key_id: Optional[str]) -> None:
+    """
+    Enforce the per-key download quota and concurrent job limit
+    
+    A successful call holds one of the key's job slots, which must be
+    given back with job_limiter.release once the job has finished.
+    
+    Raises:
+        HTTPException: 429 if the key is over either limit
+    """
+    if key_id is None:
+        return
+    quota = bytes_limiter.check(key_id)
+    if not quota.allowed:
+        logger.warning("Download quota exceeded for token")
+        metrics.RATE_LIMIT_REJECTIONS.labels(limit="bytes").inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Download quota exceeded. Try again later.",
+            headers={"Retry-After": str(math.ceil(quota.retry_after))}
+        )
+    if not job_limiter.acquire(key_id):
+        logger.warning("Concurrent job limit reached for token")
+        metrics.RATE_LIMIT_REJECTIONS.labels(limit="jobs").inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many concurrent jobs for this API key. Try again later.",
+            headers={"Retry-After": "30"}
+        )
+
+async def upstream_throttled() -> HTTPException:
+    """503 for requests that need YouTube right now while it is throttling every identity"""
+    retry_after = await asyncio.to_thread(lambda: upstream_health.retry_after)
+    return HTTPException(
+        status_code=503,
+        detail="YouTube is throttling this service. Try again later.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+async def wait_for_job(job_id: str) -> str:
+    """
+    Wait for a job run by a worker process, cancelling it if abandoned
+    
+    Raises:
+        VideoProcessingError: If the job failed or was cancelled elsewhere
+    """
+    try:
+        job = await job_queue.wait(job_id)
+    except asyncio.CancelledError:
+        await job_queue.cancel(job_id)
+        raise
+    if job is None:
+        raise VideoProcessingError("Job disappeared from the job store")
+    if job.status == JobStatus.FAILED:
+        raise VideoProcessingError(job.error or "Job failed")
+    if job.status == JobStatus.CANCELLED:
+        raise VideoProcessingError("Job was cancelled")
+    return job.s3_key
+
+async def cancel_on_disconnect(request: Request, awaitable, poll_interval: float = 1.0):
+    """
+    Await a download, cancelling it if the client goes away
+    
+    Raises:
+        HTTPException: 499 if the client disconnected first
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling download")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint - no authentication required"""
     return {"status": "healthy", "service": "ytdl-microservice"}
 
-@app.get("/generate-key")
-async def generate_key(authenticated: bool = Depends(verify_token)):
+@app.post("/generate-key")
+async def generate_key(
+    req: Optional[KeyRequest] = None,
+    authenticated: bool = Depends(verify_admin_token)
+):
     """
-    Generate a new API key (admin endpoint)
-    Requires valid authentication
+    Generate and register a new API key (admin endpoint)
+    Requires the ADMIN_API_KEY token, client keys are rejected
+    
+    The key is stored in the key store (API_KEY_STORE) with the limits
+    from the optional body and is accepted by every process within
+    API_KEY_RELOAD_SECONDS, no restart needed. Only its hash is kept.
+    
+    Raises:
+        HTTPException: 503 if no key store is configured
     """
+    settings = (req or KeyRequest()).dict()
     new_key = generate_api_key()
+    try:
+        record = await asyncio.to_thread(key_registry.register, new_key, **settings)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    logger.info(f"Registered API key {record.key_id}")
     return {
         "api_key": new_key,
+        "key_id": record.key_id,
+        **settings,
         "message": "Store this key securely. It cannot be retrieved again.",
         "usage": "Include in Authorization header: Bearer <api_key>"
     }
 
+@app.get("/profiles", response_model=List[ProfileResponse])
+async def list_profiles(authenticated: bool = Depends(verify_token)):
+    """
+    Output profiles accepted by the download endpoints
+    Requires Bearer token authentication
+    """
+    return [
+        ProfileResponse(
+            name=profile.name,
+            container=profile.container,
+            content_type=profile.content_type,
+            audio_only=profile.audio_only,
+            max_height=profile.max_height
+        )
+        for profile in PROFILES.values()
+    ]
+
+@app.post("/info", response_model=InfoResponse)
+async def video_info(
+    req: VideoRequest,
+    authenticated: bool = Depends(verify_token_with_rate_limit)
+):
+    """
+    Get title, duration, available formats and estimated download size
+    Requires Bearer token authentication
+    
+    The extraction is cached, a following /download of the same video
+    reuses it instead of fetching the video page again.
+    
+    Raises:
+        HTTPException: 422 if the video information cannot be extracted,
+            503 if YouTube is throttling and nothing is cached
+    """
+    if await asyncio.to_thread(lambda: upstream_health.is_open) and get_cached_info(str(req.youtube_url)) is None:
+        raise await upstream_throttled()
+    try:
+        info = await get_info(str(req.youtube_url))
+    except UpstreamThrottled as e:
+        logger.warning(f"Info extraction throttled: {str(e)}")
+        raise await upstream_throttled()
+    except VideoProcessingError as e:
+        logger.error(f"Info extraction error: {str(e)}")
+        raise HTTPException(
+            status_code=422,
+            detail=f"Video info extraction failed: {str(e)}"
+        )
+    return InfoResponse(**summarize_info(info))
+
 @app.post("/download", response_model=VideoResponse)
 async def download_and_upload(
     req: VideoRequest,
-    authenticated: bool = Depends(verify_token_with_rate_limit)
+    request: Request,
+    authenticated: bool = Depends(verify_token_with_rate_limit),
+    priority: int = Depends(get_request_priority),
+    key_id: Optional[str] = Depends(get_api_key_id)
 ):
     """
     Download a YouTube video and upload it to S3
     Requires Bearer token authentication
     
     Args:
-        req: VideoRequest containing the YouTube URL
+        req: VideoRequest containing the YouTube URL and optional output profile
         
     Returns:
-        VideoResponse with S3 key
+        VideoResponse with S3 key and content type
         
     Raises:
         HTTPException: If processing fails or authentication fails
     """
+    profile = resolve_profile(req.profile)
     try:
-        logger.info(f"Processing authenticated request for URL: {req.youtube_url}")
+        logger.info(f"Processing authenticated request for URL: {req.youtube_url} ({profile.name})")
         
-        # Run the blocking operation in thread pool
-        loop = asyncio.get_event_loop()
-        s3_key = await loop.run_in_executor(
-            executor, 
-            process_and_upload, 
-            str(req.youtube_url)
-        )
+        cached_key = get_cached_s3_key(str(req.youtube_url), profile)
+        if cached_key:
+            return VideoResponse(
+                s3_key=cached_key,
+                message="Video already processed, served from cache",
+                profile=profile.name,
+                content_type=profile.content_type
+            )
+        
+        admit_job(key_id)
+        if JOB_EXECUTION == "worker":
+            # Hand the job to a worker process, its slot is released when the worker finishes it
+            try:
+                job = await job_queue.submit(Job(
+                    url=str(req.youtube_url), priority=priority, api_key_id=key_id, profile=profile.name
+                ))
+            except QueueFullError as e:
+                if key_id:
+                    job_limiter.release(key_id)
+                logger.warning(f"Rejecting request: {str(e)}")
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, too many queued downloads. Try again later.",
+                    headers={"Retry-After": "30"}
+                )
+            s3_key = await cancel_on_disconnect(request, wait_for_job(job.id))
+        else:
+            try:
+                # Schedule the download and upload stages, abandoning them if the client leaves
+                s3_key = await cancel_on_disconnect(
+                    request,
+                    run_download(
+                        str(req.youtube_url),
+                        priority=priority,
+                        on_downloaded=charge_download(key_id),
+                        profile=profile
+                    )
+                )
+            finally:
+                if key_id:
+                    job_limiter.release(key_id)
         
         return VideoResponse(
             s3_key=s3_key,
-            message="Video processed and uploaded successfully"
+            message="Video processed and uploaded successfully",
+            profile=profile.name,
+            content_type=profile.content_type
         )
         
+    except HTTPException:
+        raise
+    except UpstreamThrottled as e:
+        logger.error(f"Download throttled: {str(e)}")
+        raise await upstream_throttled()
     except VideoProcessingError as e:
         logger.error(f"Video processing error: {str(e)}")
         raise HTTPException(
@@ -128,36 +499,342 @@ async def download_and_upload(
 
 @app.post("/download-async")
 async def download_and_upload_async(
-    req: VideoRequest, 
-    background_tasks: BackgroundTasks,
-    authenticated: bool = Depends(verify_token_with_rate_limit)
+    req: VideoRequest,
+    authenticated: bool = Depends(verify_token_with_rate_limit),
+    priority: int = Depends(get_request_priority),
+    key_id: Optional[str] = Depends(get_api_key_id)
 ):
     """
     Asynchronously download a YouTube video and upload it to S3
     Requires Bearer token authentication
-    Returns immediately with a task ID for status checking
+    Returns immediately with a task ID for status checking via GET /tasks/{task_id}
+    
+    With a callback_url the outcome is also POSTed there as signed JSON
+    once the task finishes, see app.webhooks.
+    
+    Raises:
+        HTTPException: 400 if the profile is unknown, 429 if the API key is over
+            its limits, 503 if the job queue is full
     """
-    task_id = f"task_{asyncio.current_task().get_name()}"
+    url = str(req.youtube_url)
+    profile = resolve_profile(req.profile)
+    callback_url = str(req.callback_url) if req.callback_url else None
+    
+    cached_key = get_cached_s3_key(url, profile)
+    if cached_key:
+        job = await asyncio.to_thread(job_store.create, Job(
+            url=url,
+            status=JobStatus.DONE,
+            s3_key=cached_key,
+            finished_at=time.time(),
+            profile=profile.name,
+            callback_url=callback_url
+        ))
+        await notify_job_finished(job.id)
+        return {
+            "task_id": job.id,
+            "message": "Video already processed, served from cache",
+            "status": job.status.value,
+            "s3_key": cached_key
+        }
+    
+    admit_job(key_id)
+    try:
+        job = await job_queue.submit(Job(
+            url=url, priority=priority, api_key_id=key_id, profile=profile.name, callback_url=callback_url
+        ))
+    except QueueFullError as e:
+        if key_id:
+            job_limiter.release(key_id)
+        logger.warning(f"Rejecting async request: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, too many queued downloads. Try again later.",
+            headers={"Retry-After": "30"}
+        )
     
-    async def process_video():
+    return {
+        "task_id": job.id,
+        "message": "Video queued for processing",
+        "status": job.status.value
+    }
+
+@app.post("/download/batch", response_model=BatchResponse, status_code=202)
+async def download_batch(
+    req: BatchRequest,
+    authenticated: bool = Depends(verify_token_with_rate_limit),
+    priority: int = Depends(get_request_priority),
+    key_id: Optional[str] = Depends(get_api_key_id)
+):
+    """
+    Download a list of videos and/or every video of a playlist
+    Requires Bearer token authentication, the whole batch counts as one request
+    
+    Duplicates are collapsed, videos already stored are answered from the
+    result cache and the rest are scheduled a few at a time. Poll progress
+    via GET /download/batch/{batch_id}.
+    
+    Raises:
+        HTTPException: 400 if the batch is empty or too large or the profile is unknown, 422 if the
+            playlist cannot be expanded, 429 if the key's download quota is used up, 503 if
+            YouTube is throttling the playlist expansion
+    """
+    profile = resolve_profile(req.profile)
+    urls = [str(url) for url in req.urls]
+    if req.playlist_url:
+        if await asyncio.to_thread(lambda: upstream_health.is_open):
+            raise await upstream_throttled()
         try:
-            loop = asyncio.get_event_loop()
-            s3_key = await loop.run_in_executor(
-                executor, 
-                process_and_upload, 
-                str(req.youtube_url)
+            async with upstream_health.lease() as identity:
+                urls.extend(await asyncio.to_thread(
+                    expand_playlist, str(req.playlist_url), BATCH_MAX_ITEMS, identity
+                ))
+        except UpstreamThrottled as e:
+            logger.warning(f"Playlist expansion throttled: {str(e)}")
+            raise await upstream_throttled()
+        except VideoProcessingError as e:
+            logger.error(f"Playlist expansion error: {str(e)}")
+            raise HTTPException(status_code=422, detail=str(e))
+    
+    if not urls:
+        raise HTTPException(status_code=400, detail="Batch contains no videos")
+    if len(urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {BATCH_MAX_ITEMS} videos")
+    
+    if key_id:
+        quota = bytes_limiter.check(key_id)
+        if not quota.allowed:
+            metrics.RATE_LIMIT_REJECTIONS.labels(limit="bytes").inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Download quota exceeded. Try again later.",
+                headers={"Retry-After": str(math.ceil(quota.retry_after))}
             )
-            logger.info(f"Background task {task_id} completed: {s3_key}")
-        except Exception as e:
-            logger.error(f"Background task {task_id} failed: {str(e)}")
     
-    background_tasks.add_task(process_video)
+    batch_id, jobs = await batch_dispatcher.submit(urls, priority=priority, api_key_id=key_id, profile=profile)
+    return BatchResponse(
+        batch_id=batch_id,
+        items=[TaskResponse.from_job(job) for job in jobs],
+        **summarize_batch(jobs)
+    )
+
+@app.get("/download/batch/{batch_id}", response_model=BatchResponse)
+async def get_batch(
+    batch_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Get aggregate progress and per-item results of a batch
+    Requires Bearer token authentication
+    """
+    jobs = await asyncio.to_thread(job_store.list_batch, batch_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return BatchResponse(
+        batch_id=batch_id,
+        items=[TaskResponse.from_job(job) for job in jobs],
+        **summarize_batch(jobs)
+    )
+
+@app.delete("/download/batch/{batch_id}", response_model=BatchResponse)
+async def cancel_batch(
+    batch_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Cancel every unfinished item of a batch
+    Requires Bearer token authentication
+    """
+    if not await asyncio.to_thread(job_store.list_batch, batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    cancelled = await batch_dispatcher.cancel(batch_id)
+    logger.info(f"Cancelled {cancelled} item(s) of batch {batch_id}")
+    jobs = await asyncio.to_thread(job_store.list_batch, batch_id)
+    return BatchResponse(
+        batch_id=batch_id,
+        items=[TaskResponse.from_job(job) for job in jobs],
+        **summarize_batch(jobs)
+    )
+
+@app.get("/tasks/{task_id}", response_model=TaskResponse)
+async def get_task(
+    task_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Get the status of an asynchronous download task
+    Requires Bearer token authentication
+    """
+    job = await asyncio.to_thread(job_store.get, task_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return TaskResponse.from_job(job)
+
+@app.get("/tasks/{task_id}/events")
+async def task_events(
+    task_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Stream a task's progress as server-sent events until it finishes
+    Requires Bearer token authentication
     
-    return {
-        "task_id": task_id,
-        "message": "Video processing started in background",
-        "status": "processing"
+    `status` events carry the task's state, `progress` events the parsed
+    download percentage, speed and ETA, merges and S3 upload parts.
+    
+    Raises:
+        HTTPException: 404 if the task does not exist
+    """
+    if await asyncio.to_thread(job_store.get, task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return StreamingResponse(
+        stream_job_events(task_id, job_store),
+        media_type="text/event-stream",
+        # Keep proxies from buffering or caching the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/tasks/{task_id}", response_model=TaskResponse)
+async def cancel_task(
+    task_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Cancel a queued or running task
+    Requires Bearer token authentication
+    
+    Raises:
+        HTTPException: 404 if the task does not exist, 409 if it already finished
+            or is running on another worker process
+    """
+    job = await asyncio.to_thread(job_store.get, task_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if job.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Task already {job.status.value}")
+    
+    if not await job_queue.cancel(task_id):
+        raise HTTPException(status_code=409, detail="Task is not running on this worker")
+    
+    return TaskResponse.from_job(await asyncio.to_thread(job_store.get, task_id))
+
+@app.get("/tasks", response_model=List[TaskResponse])
+async def list_tasks(
+    status: Optional[JobStatus] = None,
+    limit: int = Query(50, ge=1, le=500),
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    List recent download tasks, newest first
+    Requires Bearer token authentication
+    """
+    jobs = await asyncio.to_thread(job_store.list, status=status, limit=limit)
+    return [TaskResponse.from_job(job) for job in jobs]
+
+@app.get("/webhooks/dead-letters", response_model=List[DeadLetterResponse])
+async def list_dead_letters(
+    limit: int = Query(50, ge=1, le=500),
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Task callbacks that could not be delivered, newest first
+    Requires Bearer token authentication
+    """
+    return [DeadLetterResponse.from_delivery(delivery) for delivery in webhook_dispatcher.dead_letters.list(limit)]
+
+@app.post("/webhooks/dead-letters/{delivery_id}/retry", response_model=DeadLetterResponse, status_code=202)
+async def retry_dead_letter(
+    delivery_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Queue a dead-lettered callback for delivery again, with a fresh set of attempts
+    Requires Bearer token authentication
+    
+    Raises:
+        HTTPException: 404 if there is no such dead letter
+    """
+    delivery = webhook_dispatcher.dead_letters.pop(delivery_id)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    response = DeadLetterResponse.from_delivery(delivery)
+    delivery.attempts = 0
+    delivery.failed_at = None
+    delivery.error = None
+    webhook_dispatcher.enqueue(delivery)
+    return response
+
+@app.api_route("/videos/{key:path}", methods=["GET", "HEAD"])
+async def get_video(
+    key: str,
+    request: Request,
+    presigned: bool = Query(False, description="Return a short-lived S3 URL instead of the file"),
+    authenticated: bool = Depends(verify_token)
+):
+    """
+    Fetch an uploaded video by the s3_key of its download
+    Requires Bearer token authentication
+    
+    Single `Range: bytes=...` requests are answered with 206, so players
+    can seek and downloaders can fetch in parallel. The file is sent from
+    the local media cache when this host still has it, streamed from S3
+    otherwise. With ?presigned=true the response is a presigned GET URL
+    valid for PRESIGNED_URL_TTL_SECONDS instead, which clients can fetch
+    without AWS credentials.
+    
+    Raises:
+        HTTPException: 404 if there is no such video, 416 if the range starts past
+            its end, 502 if S3 cannot be reached
+    """
+    if not is_video_key(key):
+        raise HTTPException(status_code=404, detail="Video not found")
+    try:
+        if presigned:
+            if await asyncio.to_thread(object_metadata, key) is None:
+                raise HTTPException(status_code=404, detail="Video not found")
+            return PresignedUrlResponse(s3_key=key, **await asyncio.to_thread(presigned_url, key))
+        response = await video_response(key, request.headers.get("range"), head=request.method == "HEAD")
+    except VideoDeliveryError as e:
+        logger.error(f"Video delivery error: {str(e)}")
+        raise HTTPException(status_code=502, detail="Storage is unavailable, try again later")
+    if response is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return response
+
+@app.get("/stats")
+async def get_stats(authenticated: bool = Depends(verify_token)):
+    """
+    Scheduler and queue statistics: per-stage workers, occupancy,
+    queue depth and wait times
+    Requires Bearer token authentication
+    """
+    stats = {
+        "execution": JOB_EXECUTION,
+        # A store query with worker execution
+        "job_queue": {"depth": await asyncio.to_thread(lambda: job_queue.depth), "max_size": job_queue.maxsize},
+        "active_batches": batch_dispatcher.active,
+        "pending_webhooks": webhook_dispatcher.depth,
     }
+    if JOB_EXECUTION != "worker":
+        stats["scheduler"] = scheduler.stats()
+        stats["inflight_downloads"] = len(inflight_downloads)
+        stats["media_cache"] = media_cache.stats()
+        stats["bandwidth"] = bandwidth_shaper.stats()
+        stats["upstream"] = await asyncio.to_thread(upstream_health.stats)
+    return stats
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus metrics - no authentication required, restrict access at the proxy
+    """
+    for pool in (scheduler.download_pool, scheduler.upload_pool):
+        metrics.STAGE_QUEUE_DEPTH.labels(stage=pool.name).set(pool.depth)
+        metrics.STAGE_ACTIVE.labels(stage=pool.name).set(pool.active)
+        metrics.STAGE_WORKERS.labels(stage=pool.name).set(pool.workers)
+    metrics.JOB_QUEUE_DEPTH.set(await asyncio.to_thread(lambda: job_queue.depth))
+    metrics.INFLIGHT_DOWNLOADS.set(len(inflight_downloads))
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.exception_handler(VideoProcessingError)
 async def video_processing_exception_handler(request, exc):
@@ -0,0 +1,251 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from app.metrics import MEDIA_CACHE_BYTES, MEDIA_CACHE_EVICTIONS, MEDIA_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "/tmp/ytdl-media")
+MEDIA_CACHE_MAX_MB = int(os.getenv("MEDIA_CACHE_MAX_MB", "2048"))  # 0 disables
+MANIFEST_NAME = "manifest.db"
+
+
+class MediaCache:
+    """
+    Size-capped LRU directory of recently downloaded media
+
+    Keeps finished downloads after their job so a retried job, or a new
+    request for a video whose upload failed, is uploaded again without
+    downloading it again, and so files can be served locally. Entries are
+    keyed like the result cache. A file is moved in under a temporary name
+    and renamed into place, so readers never see a partial file; the
+    manifest is a SQLite table next to the files, shared by every process
+    on the host. Least recently used entries are evicted once the total
+    size passes max_bytes. Files are handed out as hard links, so an entry
+    evicted while in use stays readable by its holder.
+    """
+
+    def __init__(self, directory: str = MEDIA_CACHE_DIR, max_bytes: int = MEDIA_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if not self.enabled:
+            logger.info("Media cache disabled")
+            return
+
+        self._tmp_dir = os.path.join(directory, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, MANIFEST_NAME), check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS media (
+                    key TEXT PRIMARY KEY,
+                    file TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT,
+                    s3_key TEXT,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_media_last_used ON media (last_used)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_media_s3_key ON media (s3_key)")
+        self._reconcile()
+        logger.info(f"Using media cache in {directory} (max {max_bytes // 1024 // 1024}MB)")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, file: str) -> str:
+        return os.path.join(self.directory, file)
+
+    def _reconcile(self) -> None:
+        """Drop entries whose file is gone and files no entry points to, e.g. after a crash"""
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT key, file FROM media").fetchall()
+            known = set()
+            for row in rows:
+                if os.path.exists(self._path(row["file"])):
+                    known.add(row["file"])
+                else:
+                    self._conn.execute("DELETE FROM media WHERE key = ?", (row["key"],))
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if name in known or name.startswith(MANIFEST_NAME) or not os.path.isfile(path):
+                continue
+            self._remove(path)
+        # Temporary files are only leftovers of interrupted writes, unless another process is writing one now
+        cutoff = time.time() - 3600
+        for name in os.listdir(self._tmp_dir):
+            path = os.path.join(self._tmp_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+        self._update_size()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove cached media {path}: {str(e)}")
+
+    def _update_size(self) -> None:
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+        MEDIA_CACHE_BYTES.set(total)
+
+    def _link_or_copy(self, src: str, dest: str) -> None:
+        try:
+            os.link(src, dest)
+        except OSError:
+            # Different filesystems, or no hard link support
+            shutil.copyfile(src, dest)
+
+    def checkout(self, key: Optional[str], dest: str) -> Optional[int]:
+        """
+        Place the cached file for key at dest
+
+        Returns:
+            Size of the file, or None on a miss
+        """
+        if not (self.enabled and key):
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT file, size FROM media WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            MEDIA_CACHE_REQUESTS.labels(result="miss").inc()
+            return None
+        try:
+            self._link_or_copy(self._path(row["file"]), dest)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            self.delete(key)
+            MEDIA_CACHE_REQUESTS.labels(result="miss").inc()
+            return None
+        self._touch(key)
+        MEDIA_CACHE_REQUESTS.labels(result="hit").inc()
+        logger.info(f"Media cache hit for {key}")
+        return row["size"]
+
+    def lookup_s3_key(self, s3_key: str) -> Optional[dict]:
+        """
+        The cached file uploaded as s3_key, for serving it locally
+
+        Returns:
+            Dict with path, size and content_type, or None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, file, size, content_type FROM media WHERE s3_key = ?", (s3_key,)
+            ).fetchone()
+        if row is None or not os.path.exists(self._path(row["file"])):
+            MEDIA_CACHE_REQUESTS.labels(result="miss").inc()
+            return None
+        self._touch(row["key"])
+        MEDIA_CACHE_REQUESTS.labels(result="hit").inc()
+        return {"path": self._path(row["file"]), "size": row["size"], "content_type": row["content_type"]}
+
+    def _touch(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE media SET last_used = ? WHERE key = ?", (time.time(), key))
+
+    def put(self, key: Optional[str], src: str, content_type: Optional[str] = None) -> bool:
+        """
+        Keep a copy of a downloaded file, src itself is left in place
+
+        Returns:
+            True if the file was cached
+        """
+        if not (self.enabled and key):
+            return False
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            return False
+
+        extension = os.path.splitext(src)[1]
+        file = f"{hashlib.sha256(key.encode()).hexdigest()[:32]}{extension}"
+        tmp_path = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        try:
+            self._link_or_copy(src, tmp_path)
+            os.replace(tmp_path, self._path(file))
+        except OSError as e:
+            self._remove(tmp_path)
+            logger.warning(f"Failed to cache media for {key}: {str(e)}")
+            return False
+
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (key, file, size, content_type, s3_key, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (key, file, size, content_type, now, now)
+            )
+        self._evict()
+        return True
+
+    def set_s3_key(self, key: Optional[str], s3_key: str) -> None:
+        """Record where a cached file was uploaded"""
+        if not (self.enabled and key):
+            return
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE media SET s3_key = ? WHERE key = ?", (s3_key, key))
+
+    def delete(self, key: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT file FROM media WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("DELETE FROM media WHERE key = ?", (key,))
+        if row is not None:
+            self._remove(self._path(row["file"]))
+        self._update_size()
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits max_bytes"""
+        removed = []
+        with self._lock, self._conn:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+            if total > self.max_bytes:
+                for row in self._conn.execute("SELECT key, file, size FROM media ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM media WHERE key = ?", (row["key"],))
+                    removed.append(row["file"])
+                    total -= row["size"]
+        for file in removed:
+            self._remove(self._path(file))
+        if removed:
+            MEDIA_CACHE_EVICTIONS.inc(len(removed))
+            logger.info(f"Evicted {len(removed)} media cache entr{'y' if len(removed) == 1 else 'ies'}")
+        MEDIA_CACHE_BYTES.set(total)
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media").fetchone()
+        return {"enabled": True, "entries": count, "bytes": total, "max_bytes": self.max_bytes}
+
+
+# Global media cache instance
+media_cache = MediaCache()
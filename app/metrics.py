@@ -0,0 +1,183 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Stage durations range from milliseconds (validate) to the 15 minute download timeout
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+THROUGHPUT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+STAGE_SECONDS = Histogram(
+    "ytdl_stage_duration_seconds",
+    "Time spent in each processing stage",
+    ["stage", "outcome"],
+    buckets=DURATION_BUCKETS,
+)
+BYTES_TRANSFERRED = Counter(
+    "ytdl_bytes_transferred_total",
+    "Bytes downloaded from YouTube or uploaded to S3",
+    ["direction"],
+)
+THROUGHPUT_MBPS = Histogram(
+    "ytdl_throughput_megabytes_per_second",
+    "Transfer throughput per job",
+    ["direction"],
+    buckets=THROUGHPUT_BUCKETS,
+)
+UPLOAD_PART_RETRIES = Counter(
+    "ytdl_upload_part_retries_total",
+    "S3 part uploads that had to be retried",
+)
+FALLBACKS = Counter(
+    "ytdl_fallbacks_total",
+    "Times a degraded path was taken",
+    ["kind"],
+)
+JOBS = Counter(
+    "ytdl_jobs_total",
+    "Download jobs by outcome",
+    ["outcome"],
+)
+JOBS_RECOVERED = Counter(
+    "ytdl_jobs_recovered_total",
+    "Jobs and batch items taken over from processes that stopped without finishing them",
+)
+CACHE_REQUESTS = Counter(
+    "ytdl_cache_requests_total",
+    "Result cache lookups",
+    ["result"],
+)
+INFO_REQUESTS = Counter(
+    "ytdl_info_requests_total",
+    "Video info lookups served from the extraction cache or extracted",
+    ["result"],
+)
+ADMISSION_DECISIONS = Counter(
+    "ytdl_admission_decisions_total",
+    "Downloads admitted, downgraded or rejected from metadata, or aborted at the byte cap",
+    ["decision"],
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "ytdl_rate_limit_rejections_total",
+    "Requests and jobs rejected by the per-key limits",
+    ["limit"],
+)
+STAGE_QUEUE_DEPTH = Gauge(
+    "ytdl_stage_queue_depth",
+    "Work items waiting for a scheduler stage",
+    ["stage"],
+)
+STAGE_ACTIVE = Gauge(
+    "ytdl_stage_active_workers",
+    "Scheduler stage workers currently busy",
+    ["stage"],
+)
+STAGE_WORKERS = Gauge(
+    "ytdl_stage_workers",
+    "Scheduler stage worker count",
+    ["stage"],
+)
+STAGE_WAIT_SECONDS = Histogram(
+    "ytdl_stage_wait_seconds",
+    "Time work items waited in a scheduler stage queue",
+    ["stage"],
+    buckets=DURATION_BUCKETS,
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "ytdl_job_queue_depth",
+    "Async jobs waiting in the job queue",
+)
+INFLIGHT_DOWNLOADS = Gauge(
+    "ytdl_inflight_downloads",
+    "Distinct videos currently being processed",
+)
+WEBHOOK_DELIVERIES = Counter(
+    "ytdl_webhook_deliveries_total",
+    "Completion callbacks delivered, retried or dead-lettered",
+    ["result"],
+)
+EVENT_STREAMS = Gauge(
+    "ytdl_event_streams",
+    "Open task progress event streams",
+)
+MEDIA_CACHE_REQUESTS = Counter(
+    "ytdl_media_cache_requests_total",
+    "Local media cache lookups, by hit or miss",
+    ["result"],
+)
+MEDIA_CACHE_BYTES = Gauge(
+    "ytdl_media_cache_bytes",
+    "Bytes held in the local media cache",
+)
+MEDIA_CACHE_EVICTIONS = Counter(
+    "ytdl_media_cache_evictions_total",
+    "Files evicted from the local media cache",
+)
+BANDWIDTH_ACTIVE_DOWNLOADS = Gauge(
+    "ytdl_bandwidth_active_downloads",
+    "Downloads sharing the global bandwidth budget",
+)
+BANDWIDTH_THROTTLE_SECONDS = Counter(
+    "ytdl_bandwidth_throttle_seconds_total",
+    "Time downloads were paused to stay within their bandwidth share",
+)
+YTDLP_WORKERS = Gauge(
+    "ytdl_ytdlp_warm_workers",
+    "Warm yt-dlp worker processes running",
+)
+YTDLP_WORKER_RECYCLES = Counter(
+    "ytdl_ytdlp_worker_recycles_total",
+    "Warm yt-dlp workers replaced, by reason (jobs, memory, failed)",
+    ["reason"],
+)
+UPSTREAM_ERRORS = Counter(
+    "ytdl_upstream_errors_total",
+    "Failed yt-dlp runs by error kind (throttled, blocked, unavailable, transient, unknown)",
+    ["kind"],
+)
+UPSTREAM_COOLDOWNS = Counter(
+    "ytdl_upstream_cooldowns_total",
+    "Times an identity was put on cooldown after being throttled or bot-checked",
+)
+UPSTREAM_IDENTITIES_AVAILABLE = Gauge(
+    "ytdl_upstream_identities_available",
+    "Identities not cooling down, downloads pause at zero",
+)
+VIDEO_RESPONSES = Counter(
+    "ytdl_video_responses_total",
+    "GET /videos responses by where the file came from (cache, s3)",
+    ["source"],
+)
+VIDEO_BYTES_SERVED = Counter(
+    "ytdl_video_bytes_served_total",
+    "Bytes of video served by GET /videos, by source",
+    ["source"],
+)
+PRESIGNED_URL_REQUESTS = Counter(
+    "ytdl_presigned_url_requests_total",
+    "Presigned video URLs served from the signing cache or newly signed",
+    ["result"],
+)
+API_KEYS_LOADED = Gauge(
+    "ytdl_api_keys",
+    "Valid API keys in this process's key index",
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Record the duration of a block in STAGE_SECONDS, labelled by outcome"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        STAGE_SECONDS.labels(stage=stage, outcome=outcome).observe(time.perf_counter() - started)
+
+
+def observe_transfer(direction: str, num_bytes: int, seconds: float) -> None:
+    """Record bytes moved and the resulting throughput"""
+    BYTES_TRANSFERRED.labels(direction=direction).inc(num_bytes)
+    if seconds > 0 and num_bytes:
+        THROUGHPUT_MBPS.labels(direction=direction).observe(num_bytes / 1024 / 1024 / seconds)
@@ -0,0 +1,112 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Configuration
+DEFAULT_OUTPUT_PROFILE = os.getenv("DEFAULT_OUTPUT_PROFILE", "mp4-1080")
+
+# Content-Type of each stored container
+CONTENT_TYPES = {
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+    "mkv": "video/x-matroska",
+    "m4a": "audio/mp4",
+    "opus": "audio/ogg",
+}
+VIDEO_CONTAINERS = ("mp4", "webm", "mkv")
+AUDIO_CONTAINERS = ("m4a", "opus")
+HEIGHT_CAPS = (360, 480, 720, 1080)
+
+# Audio yt-dlp can store as is, extraction only re-encodes when none is offered
+AUDIO_FORMATS = {
+    "m4a": "ba[ext=m4a]/ba/b",
+    "opus": "ba[acodec=opus]/ba/b",
+}
+
+
+class ProfileError(ValueError):
+    """Raised for an unknown output profile"""
+    pass
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """
+    What a download produces: audio only or video up to a height, in a container
+
+    Video profiles merge or remux into their container and audio profiles
+    extract the audio track; yt-dlp copies the streams without re-encoding
+    whenever the selected formats already fit the container.
+    """
+    name: str
+    container: str
+    max_height: Optional[int] = None  # None for audio only
+
+    @property
+    def audio_only(self) -> bool:
+        return self.max_height is None
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.container]
+
+    @property
+    def streamable(self) -> bool:
+        """Whether a single downloaded format is already the result, so it can be piped to S3"""
+        return self.container in ("mp4", "m4a")
+
+    def format_selector(self, streaming: bool = False) -> str:
+        """yt-dlp format selector, streaming ones never need merging or post-processing"""
+        if self.audio_only:
+            return f"ba[ext={self.container}]" if streaming else AUDIO_FORMATS[self.container]
+        height = self.max_height
+        if streaming:
+            return f"b[height<={height}][ext={self.container}]/b[ext={self.container}]"
+        if self.container == "webm":
+            # WebM only holds VP8/VP9/AV1 with Opus/Vorbis, never fall back to other codecs
+            return f"bv*[height<={height}][ext=webm]+ba[ext=webm]/b[height<={height}][ext=webm]/b[ext=webm]"
+        return f"bv*[height<={height}]+ba/b[height<={height}]/b"
+
+    def output_args(self) -> List[str]:
+        """yt-dlp options that produce the container from the downloaded formats"""
+        if self.audio_only:
+            return ["--extract-audio", "--audio-format", self.container]
+        return ["--merge-output-format", self.container, "--remux-video", self.container]
+
+    def cache_variant(self, streaming: bool = False) -> str:
+        """Cache key material, mp4 keeps the bare selector of entries stored before profiles existed"""
+        selector = self.format_selector(streaming)
+        return selector if self.container == "mp4" else f"{selector} -> {self.container}"
+
+
+def _build_profiles() -> Dict[str, OutputProfile]:
+    profiles = {}
+    for container in VIDEO_CONTAINERS:
+        for height in HEIGHT_CAPS:
+            name = f"{container}-{height}"
+            profiles[name] = OutputProfile(name=name, container=container, max_height=height)
+    for container in AUDIO_CONTAINERS:
+        name = f"audio-{container}"
+        profiles[name] = OutputProfile(name=name, container=container)
+    return profiles
+
+
+PROFILES = _build_profiles()
+
+
+def get_profile(name: Optional[str] = None) -> OutputProfile:
+    """
+    Look up an output profile, None selects DEFAULT_OUTPUT_PROFILE
+
+    Raises:
+        ProfileError: If there is no profile with that name
+    """
+    if name is None:
+        return DEFAULT_PROFILE
+    profile = PROFILES.get(name.lower())
+    if profile is None:
+        raise ProfileError(f"Unknown profile '{name}', expected one of: {', '.join(PROFILES)}")
+    return profile
+
+
+DEFAULT_PROFILE = get_profile(DEFAULT_OUTPUT_PROFILE)
@@ -0,0 +1,347 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+from app.keys import key_registry
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # memory or redis
+RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "3600"))  # 1 hour
+RATE_LIMIT_CONCURRENT_JOBS = int(os.getenv("RATE_LIMIT_CONCURRENT_JOBS", "0"))  # 0 disables
+RATE_LIMIT_BYTES = int(os.getenv("RATE_LIMIT_BYTES_MB", "0")) * 1024 * 1024  # Per window, 0 disables
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SWEEP_INTERVAL = int(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60"))
+JOB_SLOT_LEASE_SECONDS = 3600  # Redis job slots expire if a worker dies without releasing them
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: float
+    retry_after: float  # Seconds until the request would be allowed, 0 when allowed
+
+
+class RateLimitBackend:
+    """Storage for token buckets and concurrency slots"""
+
+    # Whether state outlives the process, slots of a crashed process are then still held
+    shared = False
+
+    def take(
+        self,
+        name: str,
+        key: str,
+        capacity: float,
+        refill_per_second: float,
+        cost: float = 1,
+        allow_debt: bool = False,
+    ) -> RateLimitResult:
+        """
+        Take `cost` tokens from a bucket that refills continuously up to `capacity`
+
+        With allow_debt the tokens are always taken, even past zero; the
+        bucket then stays empty until the debt has been refilled. A cost of
+        zero just checks whether any tokens are left.
+        """
+        raise NotImplementedError
+
+    def acquire_slot(self, name: str, key: str, limit: int) -> bool:
+        raise NotImplementedError
+
+    def release_slot(self, name: str, key: str) -> None:
+        raise NotImplementedError
+
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, refill_per_second: float) -> float:
+    return min(capacity, tokens + (now - updated) * refill_per_second)
+
+
+def _rejected(tokens: float, refill_per_second: float, cost: float) -> RateLimitResult:
+    # A zero-cost check needs the bucket back above zero, anything else needs `cost` tokens
+    missing = cost - tokens if cost else -tokens
+    retry_after = missing / refill_per_second if refill_per_second else float("inf")
+    return RateLimitResult(False, max(0.0, tokens), max(0.0, retry_after))
+
+
+def _decide(tokens: float, refill_per_second: float, cost: float, allow_debt: bool):
+    """Shared token bucket decision, returns (result, tokens after)"""
+    if allow_debt or (tokens >= cost and (cost > 0 or tokens > 0)):
+        return RateLimitResult(True, tokens - cost, 0.0), tokens - cost
+    return _rejected(tokens, refill_per_second, cost), tokens
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Per-process token buckets with bounded memory
+
+    Buckets idle long enough to have refilled completely are indistinguishable
+    from new ones, so they are evicted by a periodic sweep. The total number
+    of buckets is also capped, evicting the least recently used.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, sweep_interval: int = RATE_LIMIT_SWEEP_INTERVAL):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._buckets = OrderedDict()  # (name, key) -> (tokens, updated, full_at)
+        self._slots = {}  # (name, key) -> count
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, name, key, capacity, refill_per_second, cost=1, allow_debt=False) -> RateLimitResult:
+        now = time.monotonic()
+        bucket_key = (name, key)
+        with self._lock:
+            if now - self._last_sweep > self.sweep_interval:
+                self._sweep(now)
+
+            entry = self._buckets.get(bucket_key)
+            tokens = capacity if entry is None else _refill(entry[0], entry[1], now, capacity, refill_per_second)
+            result, tokens = _decide(tokens, refill_per_second, cost, allow_debt)
+
+            full_at = now + (capacity - tokens) / refill_per_second
+            self._buckets[bucket_key] = (tokens, now, full_at)
+            self._buckets.move_to_end(bucket_key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return result
+
+    def _sweep(self, now: float) -> None:
+        idle = [bucket_key for bucket_key, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for bucket_key in idle:
+            del self._buckets[bucket_key]
+        self._last_sweep = now
+        if idle:
+            logger.debug(f"Evicted {len(idle)} idle rate limit bucket(s)")
+
+    def acquire_slot(self, name: str, key: str, limit: int) -> bool:
+        with self._lock:
+            count = self._slots.get((name, key), 0)
+            if count >= limit:
+                return False
+            self._slots[(name, key)] = count + 1
+            return True
+
+    def release_slot(self, name: str, key: str) -> None:
+        with self._lock:
+            count = self._slots.get((name, key), 0) - 1
+            if count > 0:
+                self._slots[(name, key)] = count
+            else:
+                self._slots.pop((name, key), None)
+
+
+# KEYS[1] bucket hash; ARGV capacity, refill per second, cost, allow debt (0/1), ttl ms
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local allow_debt = ARGV[4] == '1'
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + (now - tonumber(state[2])) * rate)
+end
+local allowed = 0
+if allow_debt or (tokens >= cost and (cost > 0 or tokens > 0)) then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+return {allowed, tostring(tokens)}
+"""
+
+# KEYS[1] slot counter; ARGV limit, lease seconds
+ACQUIRE_SLOT_SCRIPT = """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+RELEASE_SLOT_SCRIPT = """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count <= 1 then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('DECR', KEYS[1])
+end
+return 1
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets and slots in Redis, shared by every worker and replica
+
+    Each decision is a single Lua script so concurrent workers cannot race,
+    and every key carries a TTL so idle buckets disappear on their own.
+    """
+
+    KEY_PREFIX = "ytdl:ratelimit:"
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1)
+        self._take = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._acquire = self.client.register_script(ACQUIRE_SLOT_SCRIPT)
+        self._release = self.client.register_script(RELEASE_SLOT_SCRIPT)
+
+    def take(self, name, key, capacity, refill_per_second, cost=1, allow_debt=False) -> RateLimitResult:
+        # Keep the bucket until it has refilled completely, plus the time to repay any debt
+        ttl_ms = int((capacity + cost) / refill_per_second * 1000) + 1000
+        try:
+            allowed, tokens = self._take(
+                keys=[f"{self.KEY_PREFIX}{name}:{key}"],
+                args=[capacity, refill_per_second, cost, "1" if allow_debt else "0", ttl_ms],
+            )
+        except Exception as e:
+            # Fail open: a limiter outage should not take the API down with it
+            logger.warning(f"Redis rate limiter unavailable, allowing request: {str(e)}")
+            return RateLimitResult(True, capacity, 0.0)
+
+        tokens = float(tokens)
+        if allowed:
+            return RateLimitResult(True, tokens, 0.0)
+        return _rejected(tokens, refill_per_second, cost)
+
+    def acquire_slot(self, name: str, key: str, limit: int) -> bool:
+        try:
+            return bool(self._acquire(keys=[f"{self.KEY_PREFIX}slots:{name}:{key}"], args=[limit, JOB_SLOT_LEASE_SECONDS]))
+        except Exception as e:
+            logger.warning(f"Redis rate limiter unavailable, allowing job: {str(e)}")
+            return True
+
+    def release_slot(self, name: str, key: str) -> None:
+        try:
+            self._release(keys=[f"{self.KEY_PREFIX}slots:{name}:{key}"])
+        except Exception as e:
+            logger.warning(f"Failed to release job slot: {str(e)}")
+
+
+# Per-key limit, None for keys that use the limiter's default
+LimitOverride = Callable[[str], Optional[int]]
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket holding `limit` units that refills evenly over `window_seconds`
+
+    `overrides` gives the limit of individual keys, e.g. from the key store.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        name: str,
+        limit: int,
+        window_seconds: int,
+        overrides: Optional[LimitOverride] = None,
+    ):
+        self.backend = backend
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.overrides = overrides
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def limit_for(self, key: str) -> int:
+        limit = self.overrides(key) if self.overrides else None
+        return self.limit if limit is None else limit
+
+    def enabled_for(self, key: str) -> bool:
+        return self.limit_for(key) > 0
+
+    def hit(self, key: str, cost: float = 1) -> RateLimitResult:
+        """Take cost units if available"""
+        limit = self.limit_for(key)
+        if limit <= 0:
+            return RateLimitResult(True, float("inf"), 0.0)
+        return self.backend.take(self.name, key, limit, limit / self.window_seconds, cost)
+
+    def check(self, key: str) -> RateLimitResult:
+        """Allowed while any units are left, without taking any"""
+        return self.hit(key, cost=0)
+
+    def consume(self, key: str, amount: float) -> None:
+        """Record usage after the fact, possibly going into debt"""
+        limit = self.limit_for(key)
+        if limit > 0 and amount > 0:
+            self.backend.take(self.name, key, limit, limit / self.window_seconds, amount, allow_debt=True)
+
+
+class ConcurrencyLimiter:
+    """Caps how many jobs a key may have queued or running at once"""
+
+    def __init__(self, backend: RateLimitBackend, name: str, limit: int, overrides: Optional[LimitOverride] = None):
+        self.backend = backend
+        self.name = name
+        self.limit = limit
+        self.overrides = overrides
+
+    def limit_for(self, key: str) -> int:
+        limit = self.overrides(key) if self.overrides else None
+        return self.limit if limit is None else limit
+
+    def acquire(self, key: str) -> bool:
+        limit = self.limit_for(key)
+        if limit <= 0:
+            return True
+        return self.backend.acquire_slot(self.name, key, limit)
+
+    def release(self, key: str) -> None:
+        # Always released, the key's limit may have changed since it acquired the slot
+        self.backend.release_slot(self.name, key)
+
+    def reclaim(self, key: str) -> None:
+        """
+        Hold a slot for a job taken over from a stopped process, over the
+        limit if need be, so releasing it when the job finishes balances out
+        """
+        if not self.backend.shared:
+            self.backend.acquire_slot(self.name, key, sys.maxsize)
+
+
+def create_backend(backend: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    """Create the configured rate limit backend"""
+    if backend == "redis":
+        logger.info("Using Redis rate limiter")
+        return RedisRateLimitBackend()
+    if backend != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{backend}', falling back to memory")
+    return InMemoryRateLimitBackend()
+
+
+# Global limiters
+rate_limit_backend = create_backend()
+request_limiter = TokenBucketLimiter(
+    rate_limit_backend, "requests", RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, overrides=key_registry.requests_limit
+)
+bytes_limiter = TokenBucketLimiter(
+    rate_limit_backend, "bytes", RATE_LIMIT_BYTES, RATE_LIMIT_WINDOW, overrides=key_registry.bytes_limit
+)
+job_limiter = ConcurrencyLimiter(
+    rate_limit_backend, "jobs", RATE_LIMIT_CONCURRENT_JOBS, overrides=key_registry.jobs_limit
+)
@@ -0,0 +1,438 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+
+from app.downloader import (
+    VideoProcessingError,
+    abort_upload,
+    client_pool,
+    new_s3_key,
+    stream_video_to_s3,
+    streams_to_s3,
+    upload_stage,
+    validate_environment,
+    validate_file,
+)
+from app.profiles import OutputProfile, DEFAULT_PROFILE
+from app.cache import make_cache_key
+from app.mediacache import media_cache
+from app.checkpoints import checkpoint_store
+from app.supervisor import supervisor, ProgressCallback, ThreadedProcesses
+from app.info import get_info, write_info_json, invalidate_info
+from app.admission import ADMISSION_CONTROL, admit
+from app.upstream import UPSTREAM_MAX_ATTEMPTS, UpstreamThrottled, is_upstream_error, upstream_health
+from app.metrics import JOBS, STAGE_WAIT_SECONDS, observe_stage, observe_transfer
+from app.uploader import UPLOAD_GLOBAL_CONCURRENCY, UPLOAD_JOB_CONCURRENCY
+from app.auth import DEFAULT_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Downloads wait on the network and on ffmpeg merges, so default to one per core
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", str(max(2, os.cpu_count() or 1))))
+# Each upload already runs UPLOAD_JOB_CONCURRENCY parts, enough workers to fill the global part budget
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", str(max(2, UPLOAD_GLOBAL_CONCURRENCY // UPLOAD_JOB_CONCURRENCY))))
+
+
+class StagePool:
+    """
+    Priority queue drained by a fixed number of workers for one pipeline stage
+
+    Blocking work runs on the stage's own thread pool and coroutine functions
+    run directly on the loop, either way a stage that is saturated (e.g.
+    fifteen minute downloads) never takes capacity from the other one. Items
+    with a lower priority value are started first, ties are served in
+    submission order. Cancelling the caller cancels coroutine work in flight.
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-stage")
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._sequence = itertools.count()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self) -> None:
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.executor.shutdown(wait=True)
+
+    async def run(self, func: Callable, *args, priority: int = DEFAULT_PRIORITY):
+        """Queue func(*args) on this stage and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._sequence), time.monotonic(), func, args, future))
+        return await future
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, enqueued_at, func, args, future = await self._queue.get()
+            if future.cancelled():
+                continue
+
+            waited = time.monotonic() - enqueued_at
+            STAGE_WAIT_SECONDS.labels(stage=self.name).observe(waited)
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.active += 1
+            if asyncio.iscoroutinefunction(func):
+                work = asyncio.ensure_future(func(*args))
+            else:
+                work = loop.run_in_executor(self.executor, func, *args)
+            future.add_done_callback(lambda f, work=work: work.cancel() if f.cancelled() else None)
+            try:
+                result = await work
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # The worker itself is being stopped
+                    raise
+                self.cancelled += 1
+            except Exception as e:
+                self.failed += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                self.completed += 1
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed + self.cancelled + self.active
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queue_depth": self.depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "average_wait_seconds": round(self.total_wait_seconds / started, 3) if started else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+
+class Scheduler:
+    """Runs jobs through independently sized download and upload stages"""
+
+    def __init__(self, download_workers: int = DOWNLOAD_WORKERS, upload_workers: int = UPLOAD_WORKERS):
+        self.download_pool = StagePool("download", download_workers)
+        self.upload_pool = StagePool("upload", upload_workers)
+        self._warmup: Optional[asyncio.Task] = None
+
+    @property
+    def total_workers(self) -> int:
+        return self.download_pool.workers + self.upload_pool.workers
+
+    def start(self) -> None:
+        self.download_pool.start()
+        self.upload_pool.start()
+        self._warmup = asyncio.create_task(supervisor.start())
+        logger.info(
+            f"Scheduler started with {self.download_pool.workers} download "
+            f"and {self.upload_pool.workers} upload worker(s)"
+        )
+
+    async def stop(self) -> None:
+        # Stopping a pool waits for its threads, streaming ones run until their yt-dlp ends
+        supervisor.kill_adopted()
+        await self.download_pool.stop()
+        await self.upload_pool.stop()
+        if self._warmup is not None:
+            self._warmup.cancel()
+            await asyncio.gather(self._warmup, return_exceptions=True)
+        await supervisor.shutdown()
+
+    async def _admit(self, url: str, profile: OutputProfile) -> Optional[str]:
+        """Check the video's metadata before it takes a download slot, see app.admission"""
+        if not ADMISSION_CONTROL:
+            return None
+        return admit(await get_info(url), streaming=streams_to_s3(profile), profile=profile)
+
+    async def _download(
+        self,
+        url: str,
+        output_path: str,
+        on_progress: Optional[ProgressCallback],
+        format_selector: Optional[str] = None,
+        profile: OutputProfile = DEFAULT_PROFILE,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> int:
+        started = time.perf_counter()
+        format_selector = format_selector or profile.format_selector()
+        info_json = write_info_json(url, os.path.dirname(output_path))
+        async with upstream_health.lease() as identity:
+            try:
+                await supervisor.download(
+                    url,
+                    output_path,
+                    on_progress=on_progress,
+                    info_json=info_json,
+                    format_selector=format_selector,
+                    profile=profile,
+                    priority=priority,
+                    cookie_file=identity.cookie_file,
+                    proxy=identity.proxy,
+                )
+            except VideoProcessingError as e:
+                if not info_json or is_upstream_error(e):
+                    raise
+                # Stream URLs in the cached extraction may have expired, extract afresh
+                logger.warning(f"Download from cached extraction failed, retrying {url}")
+                invalidate_info(url)
+                await supervisor.download(
+                    url,
+                    output_path,
+                    on_progress=on_progress,
+                    format_selector=format_selector,
+                    profile=profile,
+                    priority=priority,
+                    cookie_file=identity.cookie_file,
+                    proxy=identity.proxy,
+                )
+        with observe_stage("validate"):
+            validate_file(output_path)
+        num_bytes = os.path.getsize(output_path)
+        observe_transfer("download", num_bytes, time.perf_counter() - started)
+        return num_bytes
+
+    def _stream(
+        self,
+        url: str,
+        s3_key: str,
+        format_selector: Optional[str] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        profile: OutputProfile = DEFAULT_PROFILE,
+        processes: Optional[ThreadedProcesses] = None,
+    ) -> int:
+        started = time.perf_counter()
+        format_selector = format_selector or profile.format_selector(streaming=True)
+        on_process = processes.adopt if processes else None
+        with observe_stage("stream"), tempfile.TemporaryDirectory(prefix="ytdl-info-") as info_dir:
+            info_json = write_info_json(url, info_dir)
+            with upstream_health.lease_blocking() as identity:
+                try:
+                    num_bytes = stream_video_to_s3(
+                        client_pool.s3,
+                        url,
+                        s3_key,
+                        info_json=info_json,
+                        format_selector=format_selector,
+                        on_progress=on_progress,
+                        content_type=profile.content_type,
+                        cookie_file=identity.cookie_file,
+                        proxy=identity.proxy,
+                        on_process=on_process,
+                    )
+                except VideoProcessingError as e:
+                    if not info_json or is_upstream_error(e):
+                        raise
+                    logger.warning(f"Stream from cached extraction failed, retrying {url}")
+                    invalidate_info(url)
+                    num_bytes = stream_video_to_s3(
+                        client_pool.s3,
+                        url,
+                        s3_key,
+                        format_selector=format_selector,
+                        on_progress=on_progress,
+                        content_type=profile.content_type,
+                        cookie_file=identity.cookie_file,
+                        proxy=identity.proxy,
+                        on_process=on_process,
+                    )
+        observe_transfer("download", num_bytes, time.perf_counter() - started)
+        return num_bytes
+
+    async def _retry_throttled(self, url: str, attempt: Callable[[], Awaitable]):
+        """
+        Run attempt() again while the upstream throttles it, up to UPSTREAM_MAX_ATTEMPTS times
+
+        Each try leases an identity afresh, so it rotates to another
+        identity or waits for the throttled one's cooldown.
+        """
+        for number in itertools.count(1):
+            try:
+                return await attempt()
+            except UpstreamThrottled as e:
+                if number >= UPSTREAM_MAX_ATTEMPTS:
+                    raise
+                logger.warning(
+                    f"{url} was {e.kind.value} by the upstream, retrying on another identity "
+                    f"(attempt {number + 1}/{UPSTREAM_MAX_ATTEMPTS})"
+                )
+
+    async def _download_or_reuse(
+        self,
+        url: str,
+        output_path: str,
+        media_key: Optional[str],
+        on_stage: Optional[Callable[[str], None]],
+        priority: int,
+        on_progress: Optional[ProgressCallback],
+        on_downloaded: Optional[Callable[[int], None]],
+        profile: OutputProfile,
+    ) -> None:
+        """Put the video at output_path, from the media cache if a previous job kept it"""
+        if await asyncio.to_thread(media_cache.checkout, media_key, output_path) is not None:
+            return
+
+        # Reject or downgrade from metadata before spending bandwidth and a worker slot
+        format_selector = await self._admit(url, profile)
+        if on_stage:
+            on_stage("downloading")
+        num_bytes = await self.download_pool.run(
+            self._download, url, output_path, on_progress, format_selector, profile, priority, priority=priority
+        )
+        if on_downloaded:
+            on_downloaded(num_bytes)
+        # Kept until the upload is through, a failed upload is retried without downloading again
+        await asyncio.to_thread(media_cache.put, media_key, output_path, profile.content_type)
+
+    async def run_job(
+        self,
+        url: str,
+        on_stage: Optional[Callable[[str], None]] = None,
+        priority: int = DEFAULT_PRIORITY,
+        on_progress: Optional[ProgressCallback] = None,
+        on_downloaded: Optional[Callable[[int], None]] = None,
+        profile: OutputProfile = DEFAULT_PROFILE,
+    ) -> str:
+        """
+        Download a video and upload it to S3 through the stage pools
+
+        Downloaded files are kept in the media cache, so a job for a video
+        whose upload failed earlier skips admission and the download stage.
+        Work happens in the video's checkpointed work directory, so a job
+        interrupted by cancellation or shutdown leaves its partial download
+        and upload to be resumed by the next job for the same video.
+        Downloads the upstream throttles are retried on other identities,
+        see app.upstream.
+
+        Args:
+            url: YouTube video URL
+            on_stage: Optional callback invoked with "downloading" or "uploading"
+            priority: Lower values are scheduled first
+            on_progress: Optional callback receiving parsed yt-dlp progress events
+                and S3 upload part events, possibly from a stage thread
+            on_downloaded: Optional callback receiving the number of bytes downloaded,
+                not called for files reused from the media cache
+            profile: Output profile deciding the formats, container and S3 key
+
+        Returns:
+            S3 key of the uploaded file
+
+        Raises:
+            VideoProcessingError: If any stage fails
+        """
+        validate_environment()
+        s3_key = new_s3_key(profile.container)
+
+        try:
+            if streams_to_s3(profile):
+                async def stream() -> int:
+                    # Reject or downgrade from metadata before spending bandwidth and a worker slot
+                    format_selector = await self._admit(url, profile)
+                    # Download and upload overlap, the whole job runs in the download stage
+                    if on_stage:
+                        on_stage("downloading")
+                    # yt-dlp runs on a stage thread, which cancelling this coroutine does not stop
+                    processes = supervisor.threaded()
+                    try:
+                        return await self.download_pool.run(
+                            self._stream, url, s3_key, format_selector, on_progress, profile, processes,
+                            priority=priority,
+                        )
+                    except asyncio.CancelledError:
+                        processes.kill()
+                        raise
+                    finally:
+                        processes.release()
+
+                num_bytes = await self._retry_throttled(url, stream)
+                if on_downloaded:
+                    on_downloaded(num_bytes)
+            else:
+                media_key = make_cache_key(url, profile.cache_variant())
+                checkpoint = await asyncio.to_thread(checkpoint_store.acquire, media_key, url, s3_key)
+                work_dir = checkpoint.directory if checkpoint else tempfile.mkdtemp(prefix="ytdl-")
+                interrupted = False
+                try:
+                    if checkpoint:
+                        # The multipart upload of an interrupted job resumes under its key
+                        s3_key = checkpoint.s3_key
+                    output_path = os.path.join(work_dir, f"original.{profile.container}")
+                    if checkpoint and checkpoint.stage == "uploading" and os.path.exists(output_path):
+                        logger.info(f"Download of {url} finished before the interruption, resuming its upload")
+                    else:
+                        await self._retry_throttled(url, lambda: self._download_or_reuse(
+                            url, output_path, media_key, on_stage, priority, on_progress, on_downloaded, profile
+                        ))
+                        if checkpoint:
+                            await asyncio.to_thread(checkpoint.set_stage, "uploading")
+                    if on_stage:
+                        on_stage("uploading")
+                    await self.upload_pool.run(
+                        upload_stage, output_path, s3_key, profile.content_type, on_progress, work_dir, priority=priority
+                    )
+                    await asyncio.to_thread(media_cache.set_s3_key, media_key, s3_key)
+                except asyncio.CancelledError:
+                    # Partial downloads and the upload state stay for the job's next run
+                    interrupted = True
+                    raise
+                finally:
+                    # Releasing a work directory for good aborts its unfinished upload, an S3 call
+                    if checkpoint:
+                        await asyncio.to_thread(checkpoint_store.release, checkpoint, interrupted)
+                    else:
+                        await asyncio.to_thread(abort_upload, s3_key, work_dir)
+                        shutil.rmtree(work_dir, ignore_errors=True)
+        except asyncio.CancelledError:
+            JOBS.labels(outcome="cancelled").inc()
+            raise
+        except VideoProcessingError:
+            JOBS.labels(outcome="failed").inc()
+            raise
+        except Exception as e:
+            JOBS.labels(outcome="failed").inc()
+            logger.error(f"Unexpected error: {str(e)}")
+            raise VideoProcessingError(f"Unexpected error: {str(e)}")
+
+        JOBS.labels(outcome="done").inc()
+        logger.info(f"Process completed successfully. S3 key: {s3_key}")
+        return s3_key
+
+    def stats(self) -> dict:
+        return {
+            "download": self.download_pool.stats(),
+            "upload": self.upload_pool.stats(),
+        }
+
+
+# Global scheduler instance
+scheduler = Scheduler()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution
+
+    The first caller for a key starts the work as its own task; every caller
+    arriving while it is still running awaits the same task and receives the
+    same result (or exception). The work is shielded, so a cancelled caller
+    does not cancel the download for the others; it is only cancelled once
+    every caller waiting on it has gone away.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def is_inflight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Optional[str], func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run func once per key among concurrent callers
+
+        Args:
+            key: Coalescing key, or None to always run func
+            func: Coroutine function producing the result
+
+        Returns:
+            The shared result of func
+        """
+        if key is None:
+            return await func()
+
+        task = self._inflight.get(key)
+        if task is not None:
+            logger.info(f"Joining in-flight request for {key}")
+        else:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                logger.info(f"Last caller for {key} cancelled, cancelling the request")
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,483 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Callable, List, Optional, Set
+
+from app.downloader import (
+    VideoProcessingError,
+    DOWNLOAD_TIMEOUT_SECONDS,
+    MAX_FILE_SIZE_MB,
+    MERGED_VIDEO_FORMAT,
+    COOKIES_FILE,
+    build_ytdlp_command,
+)
+from app.profiles import OutputProfile, DEFAULT_PROFILE
+from app.warmpool import WarmWorkerPool, WorkerError
+from app.bandwidth import bandwidth_shaper
+from app.auth import DEFAULT_PRIORITY
+from app.metrics import ADMISSION_DECISIONS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_CONCURRENT_MERGES = int(os.getenv("MAX_CONCURRENT_MERGES", str(max(1, (os.cpu_count() or 2) // 2))))
+STDERR_TAIL_LINES = 50
+LINE_LIMIT_BYTES = 1024 * 1024
+
+# Machine-readable progress lines, one per update thanks to --newline
+PROGRESS_PREFIX = "[ytdl-progress]"
+POSTPROCESS_PREFIX = "[ytdl-postprocess]"
+PROGRESS_ARGS = [
+    "--newline",
+    "--progress-template",
+    f"download:{PROGRESS_PREFIX} %(progress.status)s %(progress.downloaded_bytes)s "
+    "%(progress.total_bytes)s %(progress.total_bytes_estimate)s %(progress.speed)s "
+    "%(progress.eta)s %(info.format_id)s",
+    "--progress-template",
+    f"postprocess:{POSTPROCESS_PREFIX} %(progress.postprocessor)s %(progress.status)s",
+]
+
+ProgressCallback = Callable[[dict], None]
+
+
+def _number(value: str) -> Optional[float]:
+    if value in ("NA", "None", ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_progress_line(line: str) -> Optional[dict]:
+    """
+    Parse one yt-dlp output line produced by PROGRESS_ARGS
+
+    Returns:
+        A progress event dict, or None for any other output
+    """
+    if line.startswith(PROGRESS_PREFIX):
+        fields = line[len(PROGRESS_PREFIX):].split()
+        if len(fields) < 6:
+            return None
+        status, downloaded, total, estimate, speed, eta = fields[:6]
+        downloaded_bytes = _number(downloaded)
+        total_bytes = _number(total) or _number(estimate)
+        percent = None
+        if downloaded_bytes is not None and total_bytes:
+            percent = round(min(100.0, downloaded_bytes / total_bytes * 100), 1)
+        return {
+            "stage": "download",
+            "status": status,
+            "downloaded_bytes": int(downloaded_bytes) if downloaded_bytes is not None else None,
+            "total_bytes": int(total_bytes) if total_bytes else None,
+            "percent": percent,
+            "speed": _number(speed),
+            "eta": _number(eta),
+            "format_id": fields[6] if len(fields) > 6 else None,
+        }
+
+    if line.startswith(POSTPROCESS_PREFIX):
+        fields = line[len(POSTPROCESS_PREFIX):].split()
+        if len(fields) < 2:
+            return None
+        postprocessor, status = fields[0], fields[1]
+        return {
+            "stage": "merge" if postprocessor == "Merger" else "postprocess",
+            "postprocessor": postprocessor,
+            "status": status,
+        }
+
+    return None
+
+
+class _DownloadMonitor:
+    """
+    Per-download state for SubprocessSupervisor: stage timings, the byte
+    cap, the bandwidth share, the merge slot and the stderr tail
+
+    process is anything with the pid of a process group leader, a yt-dlp
+    subprocess or a warm worker.
+    """
+
+    def __init__(
+        self,
+        supervisor: "SubprocessSupervisor",
+        process,
+        on_progress: Optional[ProgressCallback],
+        max_bytes: Optional[int],
+        priority: int = DEFAULT_PRIORITY,
+    ):
+        self.supervisor = supervisor
+        self.process = process
+        self.on_progress = on_progress
+        self.max_bytes = max_bytes
+        self.bandwidth_id = bandwidth_shaper.register(priority)
+        self.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        self.merge_held = False
+        # Merged downloads fetch video and audio one after the other, each reporting from zero
+        self.downloaded = {"completed": 0, "current": 0}
+        # Stage boundaries: start -> first progress line (URL resolve) -> merge start (download) -> merge end
+        self.timings = {"started": time.perf_counter()}
+
+    def mark(self, name: str, stage: str, since: str) -> None:
+        if name in self.timings or since not in self.timings:
+            return
+        self.timings[name] = time.perf_counter()
+        STAGE_SECONDS.labels(stage=stage, outcome="success").observe(self.timings[name] - self.timings[since])
+
+    async def handle_line(self, line: str, keep_tail: bool) -> None:
+        line = line.strip()
+        if not line:
+            return
+        event = parse_progress_line(line)
+        if event:
+            await self.handle_event(event)
+        elif keep_tail:
+            self.stderr_tail.append(line)
+
+    async def handle_event(self, event: dict) -> None:
+        supervisor = self.supervisor
+        if event["stage"] == "download":
+            self.mark("resolved", "resolve", "started")
+            if event["downloaded_bytes"] is not None:
+                total = self.count(event)
+                if self.max_bytes:
+                    self.check_size(total)
+                await self.throttle(total)
+        elif event["stage"] == "merge" and event["status"] == "started":
+            self.mark("downloaded", "download", "resolved")
+        elif event["stage"] == "merge" and event["status"] == "finished":
+            self.mark("merged", "merge", "downloaded")
+
+        if event["stage"] == "merge" and event["status"] == "started" and not self.merge_held:
+            if supervisor.merge_slots.locked():
+                logger.info(f"Merge limit reached, pausing yt-dlp {self.process.pid}")
+                supervisor._signal(self.process, signal.SIGSTOP)
+                await supervisor.merge_slots.acquire()
+                supervisor._signal(self.process, signal.SIGCONT)
+            else:
+                await supervisor.merge_slots.acquire()
+            self.merge_held = True
+        elif event["stage"] == "merge" and event["status"] == "finished" and self.merge_held:
+            supervisor.merge_slots.release()
+            self.merge_held = False
+
+        if self.on_progress:
+            try:
+                self.on_progress(event)
+            except Exception as e:
+                logger.warning(f"Progress callback failed: {str(e)}")
+
+    def count(self, event: dict) -> int:
+        """Bytes downloaded across all files of the download so far"""
+        downloaded = self.downloaded
+        current = event["downloaded_bytes"]
+        if current < downloaded["current"]:
+            downloaded["completed"] += downloaded["current"]
+        downloaded["current"] = current
+        if event["status"] == "finished":
+            downloaded["completed"] += current
+            downloaded["current"] = 0
+        return downloaded["completed"] + downloaded["current"]
+
+    def check_size(self, total: int) -> None:
+        if total > self.max_bytes:
+            logger.warning(f"yt-dlp {self.process.pid} crossed the {self.max_bytes / 1024 / 1024:.0f}MB cap, killing it")
+            ADMISSION_DECISIONS.labels(decision="aborted").inc()
+            self.supervisor._kill(self.process)
+            raise VideoProcessingError(f"File size exceeds limit ({self.max_bytes / 1024 / 1024:.0f}MB)")
+
+    async def throttle(self, total: int) -> None:
+        """Pause the process group while the download is ahead of its bandwidth share"""
+        pause = bandwidth_shaper.consume(self.bandwidth_id, total)
+        if pause <= 0:
+            return
+        self.supervisor._signal(self.process, signal.SIGSTOP)
+        try:
+            await asyncio.sleep(pause)
+        finally:
+            self.supervisor._signal(self.process, signal.SIGCONT)
+
+    def release(self) -> None:
+        """Give back the merge slot of a download that ended mid-merge, and its bandwidth share"""
+        bandwidth_shaper.unregister(self.bandwidth_id)
+        self.bandwidth_id = None
+        if self.merge_held:
+            self.supervisor.merge_slots.release()
+            self.merge_held = False
+
+    def finish(self, returncode: Optional[int]) -> None:
+        """Raise on a failed run, record the download stage of a successful one"""
+        if returncode != 0:
+            stderr = "\n".join(self.stderr_tail)
+            logger.error(f"yt-dlp error: {stderr}")
+            raise VideoProcessingError(f"Failed to download video: {stderr}")
+
+        # Single-file formats are never merged, the download ends with the process
+        self.mark("downloaded", "download", "resolved")
+        if self.stderr_tail:
+            logger.warning(f"yt-dlp warnings: {' | '.join(self.stderr_tail)}")
+
+
+class ThreadedProcesses:
+    """
+    Processes a stage thread starts on behalf of a coroutine, e.g. the
+    yt-dlp piping a streaming upload
+
+    The thread reports each process it starts through adopt(). Cancelling
+    the coroutine calls kill(), which kills the process groups already
+    started and any adopted afterwards, so the thread's upload sees the
+    stream end early and aborts. Adopted processes are tracked by the
+    supervisor until release(), so its shutdown kills them too.
+    """
+
+    def __init__(self, supervisor: "SubprocessSupervisor"):
+        self.supervisor = supervisor
+        self.killed = False
+        self._processes: List = []
+        self._lock = threading.Lock()
+
+    def adopt(self, process) -> None:
+        """Track a process started with start_new_session, called from the stage thread"""
+        with self._lock:
+            killed = self.killed
+            if not killed:
+                self._processes.append(process)
+                self.supervisor._adopted.add(process)
+        if killed:
+            # Started after the coroutine was cancelled
+            self.supervisor._kill(process)
+
+    def kill(self) -> None:
+        with self._lock:
+            self.killed = True
+            processes = list(self._processes)
+        for process in processes:
+            logger.info(f"Download cancelled, killing yt-dlp {process.pid}")
+            self.supervisor._kill(process)
+
+    def release(self) -> None:
+        with self._lock:
+            for process in self._processes:
+                self.supervisor._adopted.discard(process)
+
+
+class SubprocessSupervisor:
+    """
+    Runs yt-dlp as asyncio subprocesses
+
+    Each process gets its own process group so yt-dlp and the ffmpeg children
+    it spawns can be stopped, resumed and killed together. Output is read
+    line by line: progress lines are parsed and handed to a callback while
+    only the last few stderr lines are kept for error messages.
+
+    Concurrent ffmpeg merges are capped by pausing (SIGSTOP) a process group
+    that starts merging while all merge slots are taken and resuming it
+    (SIGCONT) once a slot frees up.
+
+    With YTDLP_WARM_WORKERS set, downloads run on warm worker processes
+    from app.warmpool instead of a fresh yt-dlp process each, under the
+    same supervision. Streaming uploads start yt-dlp on a stage thread,
+    see ThreadedProcesses.
+    """
+
+    def __init__(self, max_merges: int = MAX_CONCURRENT_MERGES, warm_pool: Optional[WarmWorkerPool] = None):
+        self.max_merges = max_merges
+        self.warm_pool = warm_pool or WarmWorkerPool()
+        self._merge_slots: Optional[asyncio.Semaphore] = None
+        self._processes: Set[asyncio.subprocess.Process] = set()
+        self._adopted: Set = set()
+
+    @property
+    def running(self) -> int:
+        return len(self._processes) + len(self._adopted)
+
+    def threaded(self) -> ThreadedProcesses:
+        """Track the processes of one blocking call run on a stage thread"""
+        return ThreadedProcesses(self)
+
+    @property
+    def merge_slots(self) -> asyncio.Semaphore:
+        if self._merge_slots is None:
+            self._merge_slots = asyncio.Semaphore(self.max_merges)
+        return self._merge_slots
+
+    async def download(
+        self,
+        url: str,
+        output_path: str,
+        on_progress: Optional[ProgressCallback] = None,
+        timeout: float = DOWNLOAD_TIMEOUT_SECONDS,
+        info_json: Optional[str] = None,
+        format_selector: str = MERGED_VIDEO_FORMAT,
+        max_bytes: Optional[int] = MAX_FILE_SIZE_MB * 1024 * 1024,
+        profile: OutputProfile = DEFAULT_PROFILE,
+        priority: int = DEFAULT_PRIORITY,
+        cookie_file: Optional[str] = COOKIES_FILE,
+        proxy: Optional[str] = None,
+    ) -> None:
+        """
+        Download a video with yt-dlp, from a saved extraction if info_json is given
+
+        The result is written in the profile's container, output_path must
+        carry its extension. cookie_file and proxy are the leased identity's.
+
+        Raises:
+            VideoProcessingError: If yt-dlp fails, times out or downloads more than max_bytes
+            asyncio.CancelledError: If cancelled, after killing the process group
+        """
+        cmd = build_ytdlp_command(
+            url, output_path, format_selector, info_json=info_json, profile=profile, cookie_file=cookie_file, proxy=proxy
+        ) + PROGRESS_ARGS
+        logger.info(f"Starting download from: {url}")
+        if self.warm_pool.enabled:
+            # Same arguments, minus the binary
+            await self.run_warm(cmd[1:], on_progress=on_progress, timeout=timeout, max_bytes=max_bytes, priority=priority)
+        else:
+            await self.run(cmd, on_progress=on_progress, timeout=timeout, max_bytes=max_bytes, priority=priority)
+        logger.info("Video download completed successfully")
+
+    async def run(
+        self,
+        cmd: list,
+        on_progress: Optional[ProgressCallback] = None,
+        timeout: float = DOWNLOAD_TIMEOUT_SECONDS,
+        max_bytes: Optional[int] = None,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> None:
+        """
+        Run a yt-dlp command line under supervision
+
+        With max_bytes the process group is killed as soon as the bytes
+        downloaded across all of its files cross the limit. priority
+        weighs the download's share of DOWNLOAD_BANDWIDTH_MBPS.
+        """
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+            limit=LINE_LIMIT_BYTES,
+        )
+        self._processes.add(process)
+        monitor = _DownloadMonitor(self, process, on_progress, max_bytes, priority)
+
+        async def read_stream(stream: asyncio.StreamReader, keep_tail: bool) -> None:
+            while True:
+                raw = await stream.readline()
+                if not raw:
+                    return
+                await monitor.handle_line(raw.decode(errors="replace"), keep_tail)
+
+        supervised = asyncio.gather(
+            read_stream(process.stdout, keep_tail=False),
+            read_stream(process.stderr, keep_tail=True),
+            process.wait(),
+        )
+        try:
+            await asyncio.wait_for(supervised, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._kill(process)
+            raise VideoProcessingError(f"Video download timed out after {timeout / 60:.0f} minutes")
+        except asyncio.CancelledError:
+            logger.info(f"Download cancelled, killing yt-dlp {process.pid}")
+            self._kill(process)
+            raise
+        finally:
+            if supervised.done() and not supervised.cancelled():
+                supervised.exception()
+            monitor.release()
+            if process.returncode is None:
+                self._kill(process)
+                await process.wait()
+            self._processes.discard(process)
+
+        monitor.finish(process.returncode)
+
+    async def run_warm(
+        self,
+        argv: list,
+        on_progress: Optional[ProgressCallback] = None,
+        timeout: float = DOWNLOAD_TIMEOUT_SECONDS,
+        max_bytes: Optional[int] = None,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> None:
+        """
+        Run yt-dlp arguments on a warm worker, supervised like run()
+
+        A worker that is killed, times out or dies mid-job is replaced
+        rather than returned to the pool.
+        """
+        worker = await self.warm_pool.acquire()
+        monitor = _DownloadMonitor(self, worker, on_progress, max_bytes, priority)
+        clean = False
+
+        async def read_job() -> None:
+            await worker.start_job(argv)
+            while True:
+                line, from_stderr = await worker.read_line()
+                if line is None:
+                    return
+                await monitor.handle_line(line, keep_tail=from_stderr)
+
+        try:
+            await asyncio.wait_for(read_job(), timeout=timeout)
+            clean = True
+        except asyncio.TimeoutError:
+            self._kill(worker)
+            raise VideoProcessingError(f"Video download timed out after {timeout / 60:.0f} minutes")
+        except asyncio.CancelledError:
+            logger.info(f"Download cancelled, killing yt-dlp worker {worker.pid}")
+            self._kill(worker)
+            raise
+        except (WorkerError, ConnectionError) as e:
+            raise VideoProcessingError(f"Failed to download video: {str(e)}")
+        finally:
+            monitor.release()
+            self.warm_pool.release(worker, clean)
+
+        monitor.finish(worker.exit_code)
+
+    async def start(self) -> None:
+        """Start the warm workers, if enabled"""
+        if self.warm_pool.enabled:
+            await self.warm_pool.start()
+
+    def _signal(self, process, sig: int) -> None:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _kill(self, process) -> None:
+        self._signal(process, signal.SIGKILL)
+
+    def kill_adopted(self) -> None:
+        """Kill the process groups started by stage threads, whose threads then wind down"""
+        processes = list(self._adopted)
+        if processes:
+            logger.info(f"Killing {len(processes)} streaming yt-dlp process group(s)")
+        for process in processes:
+            self._kill(process)
+        self._adopted.clear()
+
+    async def shutdown(self) -> None:
+        """Kill every supervised process group that is still running"""
+        processes = list(self._processes)
+        if processes:
+            logger.info(f"Killing {len(processes)} orphaned yt-dlp process group(s)")
+        for process in processes:
+            self._kill(process)
+        await asyncio.gather(*(process.wait() for process in processes), return_exceptions=True)
+        self._processes.clear()
+        self.kill_adopted()
+        await self.warm_pool.shutdown()
+
+
+# Global supervisor instance
+supervisor = SubprocessSupervisor()
@@ -0,0 +1,413 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Optional
+from botocore.exceptions import ClientError, BotoCoreError
+
+from app import metrics
+from app.metrics import observe_transfer
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UPLOAD_PART_SIZE_MB = max(5, int(os.getenv("UPLOAD_PART_SIZE_MB", "16")))  # S3 minimum part size is 5MB
+UPLOAD_JOB_CONCURRENCY = int(os.getenv("UPLOAD_JOB_CONCURRENCY", "4"))  # Parts in flight per job
+UPLOAD_GLOBAL_CONCURRENCY = int(os.getenv("UPLOAD_GLOBAL_CONCURRENCY", "16"))  # Parts in flight per process
+UPLOAD_PART_RETRIES = int(os.getenv("UPLOAD_PART_RETRIES", "3"))
+UPLOAD_STATE_DIR = os.getenv("UPLOAD_STATE_DIR", "/tmp/ytdl-uploads")
+
+ProgressCallback = Callable[[dict], None]
+
+# Shared across every uploader so concurrent jobs cannot oversubscribe the connection pool
+global_part_slots = threading.BoundedSemaphore(UPLOAD_GLOBAL_CONCURRENCY)
+
+
+class UploadError(Exception):
+    """Raised when an upload cannot be completed"""
+    pass
+
+
+class UploadSizeLimitExceeded(UploadError):
+    """Raised when a streamed upload grows past its byte limit"""
+    pass
+
+
+class EmptyStreamError(UploadError):
+    """Raised when a streamed upload produced no bytes"""
+    pass
+
+
+@dataclass
+class UploadStats:
+    """Outcome of a single upload"""
+    bytes_uploaded: int = 0
+    parts_uploaded: int = 0
+    parts_resumed: int = 0
+    part_retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput_mbps(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return self.bytes_uploaded / 1024 / 1024 / self.seconds
+
+
+@dataclass
+class MultipartState:
+    """Persisted progress of a multipart upload, used to resume after a failure"""
+    path: str
+    key: str
+    upload_id: str
+    part_size: int
+    file_size: int
+    parts: Dict[int, str] = field(default_factory=dict)  # part number -> ETag
+
+    @classmethod
+    def load(cls, path: str) -> Optional["MultipartState"]:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        data["parts"] = {int(number): etag for number, etag in data.get("parts", {}).items()}
+        return cls(path=path, **data)
+
+    def save(self) -> None:
+        data = {
+            "key": self.key,
+            "upload_id": self.upload_id,
+            "part_size": self.part_size,
+            "file_size": self.file_size,
+            "parts": self.parts,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def delete(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class MultipartUploader:
+    """
+    Concurrent S3 multipart upload engine
+
+    Parts are uploaded with at most `concurrency` in flight for this upload
+    and UPLOAD_GLOBAL_CONCURRENCY across the process. Each part is retried
+    with exponential backoff, and file uploads persist their UploadId and
+    finished parts so a later attempt resumes instead of starting over.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        part_size_mb: int = UPLOAD_PART_SIZE_MB,
+        concurrency: int = UPLOAD_JOB_CONCURRENCY,
+        part_retries: int = UPLOAD_PART_RETRIES,
+        state_dir: str = UPLOAD_STATE_DIR,
+        extra_args: Optional[dict] = None,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.part_size = max(5, part_size_mb) * 1024 * 1024
+        self.concurrency = max(1, concurrency)
+        self.part_retries = part_retries
+        self.state_dir = state_dir
+        self.extra_args = extra_args if extra_args is not None else {"ServerSideEncryption": "AES256"}
+
+    def state_path(self, key: str) -> str:
+        """Location of the resume state for an S3 key"""
+        digest = hashlib.sha256(f"{self.bucket}/{key}".encode()).hexdigest()[:32]
+        return os.path.join(self.state_dir, f"{digest}.json")
+
+    def upload_file(
+        self,
+        file_path: str,
+        key: str,
+        content_type: str = "video/mp4",
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> UploadStats:
+        """
+        Upload a local file, resuming a previous attempt when possible
+
+        Args:
+            file_path: Local file to upload
+            key: Destination S3 key
+            content_type: Content-Type stored with the object
+            on_progress: Optional callback receiving an upload event after
+                each part, called from the part upload threads
+
+        Returns:
+            UploadStats for this attempt
+
+        Raises:
+            UploadError: If the upload fails, resume state is kept for a retry
+        """
+        started = time.monotonic()
+        stats = UploadStats()
+        file_size = os.path.getsize(file_path)
+
+        if file_size <= self.part_size:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            self._with_retries(
+                stats,
+                lambda: self.s3_client.put_object(
+                    Bucket=self.bucket, Key=key, Body=data, ContentType=content_type, **self.extra_args
+                ),
+            )
+            stats.bytes_uploaded = file_size
+            stats.parts_uploaded = 1
+            self._report(on_progress, 1, 1, file_size, file_size)
+            return self._finish(stats, started, key)
+
+        state = self._resume_or_create(key, file_size, content_type)
+        state_lock = threading.Lock()
+        part_count = (file_size + self.part_size - 1) // self.part_size
+        pending = [number for number in range(1, part_count + 1) if number not in state.parts]
+        stats.parts_resumed = part_count - len(pending)
+        resumed_bytes = sum(min(self.part_size, file_size - (number - 1) * self.part_size) for number in state.parts)
+        if stats.parts_resumed:
+            logger.info(f"Resuming upload {state.upload_id}: {stats.parts_resumed}/{part_count} parts already done")
+
+        def upload_part(part_number: int) -> None:
+            offset = (part_number - 1) * self.part_size
+            length = min(self.part_size, file_size - offset)
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+            etag = self._upload_part(stats, key, state.upload_id, part_number, data)
+            with state_lock:
+                state.parts[part_number] = etag
+                stats.parts_uploaded += 1
+                stats.bytes_uploaded += length
+                state.save()
+                self._report(
+                    on_progress, len(state.parts), part_count, resumed_bytes + stats.bytes_uploaded, file_size
+                )
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(upload_part, number) for number in pending]
+            errors = [future.exception() for future in futures if future.exception()]
+        if errors:
+            raise UploadError(f"{len(errors)} part(s) failed for {key}: {str(errors[0])}")
+
+        self._complete(stats, key, state.upload_id, state.parts)
+        state.delete()
+        return self._finish(stats, started, key)
+
+    def abort_file(self, key: str) -> None:
+        """Abort the unfinished file upload of an S3 key and forget its resume state"""
+        state = MultipartState.load(self.state_path(key))
+        if state is None:
+            return
+        self._abort(key, state.upload_id)
+        state.delete()
+
+    def upload_stream(
+        self,
+        stream: BinaryIO,
+        key: str,
+        content_type: str = "video/mp4",
+        max_bytes: Optional[int] = None,
+        before_complete: Optional[Callable[[], None]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> UploadStats:
+        """
+        Upload a non-seekable stream as it is being produced
+
+        Bytes are cut into parts and uploaded concurrently while the producer
+        is still writing. At most `concurrency` parts are buffered in memory
+        besides the one being filled. Streams cannot be resumed, the upload is
+        aborted on any failure.
+
+        Args:
+            stream: Readable binary stream, read until EOF
+            key: Destination S3 key
+            content_type: Content-Type stored with the object
+            max_bytes: Abort with UploadSizeLimitExceeded past this many bytes
+            before_complete: Called after EOF and before the upload is
+                completed, raising from it aborts the upload
+            on_progress: Optional callback receiving an upload event after
+                each part, the total is unknown until the stream ends
+
+        Returns:
+            UploadStats for the upload
+        """
+        started = time.monotonic()
+        stats = UploadStats()
+        upload_id = self._create(key, content_type)
+        parts: Dict[int, str] = {}
+        parts_lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(self.concurrency)
+        done_bytes = {"bytes": 0}
+
+        def upload_part(part_number: int, data: bytes) -> None:
+            try:
+                etag = self._upload_part(stats, key, upload_id, part_number, data)
+                with parts_lock:
+                    parts[part_number] = etag
+                    stats.parts_uploaded += 1
+                    done_bytes["bytes"] += len(data)
+                    self._report(on_progress, len(parts), None, done_bytes["bytes"], None)
+            finally:
+                in_flight.release()
+
+        try:
+            futures = []
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                part_number = 1
+                while True:
+                    chunk = stream.read(self.part_size)
+                    if not chunk:
+                        break
+
+                    stats.bytes_uploaded += len(chunk)
+                    if max_bytes is not None and stats.bytes_uploaded > max_bytes:
+                        raise UploadSizeLimitExceeded(f"Stream exceeded {max_bytes} bytes")
+
+                    in_flight.acquire()
+                    failed = next((f for f in futures if f.done() and f.exception()), None)
+                    if failed:
+                        in_flight.release()
+                        raise failed.exception()
+
+                    futures.append(pool.submit(upload_part, part_number, chunk))
+                    part_number += 1
+
+                for future in futures:
+                    future.result()
+
+            if before_complete:
+                before_complete()
+            if not parts:
+                raise EmptyStreamError(f"Stream for {key} was empty")
+
+            self._complete(stats, key, upload_id, parts)
+            return self._finish(stats, started, key)
+
+        except Exception as e:
+            self._abort(key, upload_id)
+            if isinstance(e, UploadError):
+                raise
+            if isinstance(e, ClientError):
+                raise UploadError(f"Streaming upload failed ({e.response['Error']['Code']}): {str(e)}")
+            raise
+
+    def _report(
+        self,
+        on_progress: Optional[ProgressCallback],
+        parts_done: int,
+        parts_total: Optional[int],
+        uploaded_bytes: int,
+        total_bytes: Optional[int],
+    ) -> None:
+        if not on_progress:
+            return
+        percent = None
+        if total_bytes:
+            percent = round(min(100.0, uploaded_bytes / total_bytes * 100), 1)
+        try:
+            on_progress({
+                "stage": "upload",
+                "status": "uploading",
+                "parts_done": parts_done,
+                "parts_total": parts_total,
+                "uploaded_bytes": uploaded_bytes,
+                "total_bytes": total_bytes,
+                "percent": percent,
+            })
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {str(e)}")
+
+    def _resume_or_create(self, key: str, file_size: int, content_type: str) -> MultipartState:
+        path = self.state_path(key)
+        state = MultipartState.load(path)
+        if state and state.key == key and state.file_size == file_size and state.part_size == self.part_size:
+            try:
+                # S3 is the source of truth for which parts actually landed
+                listed = self.s3_client.list_parts(Bucket=self.bucket, Key=key, UploadId=state.upload_id)
+                state.parts = {part["PartNumber"]: part["ETag"] for part in listed.get("Parts", [])}
+                return state
+            except ClientError as e:
+                logger.warning(f"Cannot resume upload {state.upload_id}, starting over: {str(e)}")
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        state = MultipartState(
+            path=path,
+            key=key,
+            upload_id=self._create(key, content_type),
+            part_size=self.part_size,
+            file_size=file_size,
+        )
+        state.save()
+        return state
+
+    def _create(self, key: str, content_type: str) -> str:
+        response = self.s3_client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type, **self.extra_args
+        )
+        return response["UploadId"]
+
+    def _upload_part(self, stats: UploadStats, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        with global_part_slots:
+            response = self._with_retries(
+                stats,
+                lambda: self.s3_client.upload_part(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data
+                ),
+            )
+        return response["ETag"]
+
+    def _complete(self, stats: UploadStats, key: str, upload_id: str, parts: Dict[int, str]) -> None:
+        self._with_retries(
+            stats,
+            lambda: self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [{"PartNumber": number, "ETag": parts[number]} for number in sorted(parts)]
+                },
+            ),
+        )
+
+    def _abort(self, key: str, upload_id: str) -> None:
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logger.warning(f"Failed to abort multipart upload {upload_id}: {str(e)}")
+
+    def _with_retries(self, stats: UploadStats, call: Callable):
+        for attempt in range(self.part_retries + 1):
+            try:
+                return call()
+            except (ClientError, BotoCoreError) as e:
+                if attempt == self.part_retries:
+                    raise
+                stats.part_retries += 1
+                delay = 2 ** attempt
+                logger.warning(f"S3 request failed, retrying in {delay}s: {str(e)}")
+                time.sleep(delay)
+
+    def _finish(self, stats: UploadStats, started: float, key: str) -> UploadStats:
+        stats.seconds = time.monotonic() - started
+        observe_transfer("upload", stats.bytes_uploaded, stats.seconds)
+        metrics.UPLOAD_PART_RETRIES.inc(stats.part_retries)
+        logger.info(
+            f"Uploaded {stats.bytes_uploaded / 1024 / 1024:.1f}MB to {key} "
+            f"in {stats.seconds:.1f}s ({stats.throughput_mbps:.1f}MB/s, "
+            f"{stats.parts_uploaded} parts, {stats.parts_resumed} resumed, {stats.part_retries} retries)"
+        )
+        return stats
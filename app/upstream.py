@@ -0,0 +1,448 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from enum import Enum
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.downloader import VideoProcessingError, COOKIES_FILE
+from app.jobs import REDIS_URL
+from app.metrics import UPSTREAM_COOLDOWNS, UPSTREAM_ERRORS, UPSTREAM_IDENTITIES_AVAILABLE
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+COOKIE_POOL_DIR = os.getenv("COOKIE_POOL_DIR", "")  # One identity per *.txt cookie file, empty uses COOKIE_FILE_PATH alone
+IDENTITY_MAX_CONCURRENCY = int(os.getenv("IDENTITY_MAX_CONCURRENCY", "0"))  # yt-dlp runs per identity, 0 is unlimited
+UPSTREAM_BACKOFF_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_SECONDS", "60"))  # First cooldown of a throttled identity
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MAX_SECONDS", "1800"))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "5"))  # Throttled attempts before a job fails
+# memory keeps cooldowns per process, redis shares them between processes behind the same address
+UPSTREAM_STATE_BACKEND = os.getenv("UPSTREAM_STATE_BACKEND", "memory").lower()
+UPSTREAM_POLL_SECONDS = 1.0
+POOL_RESCAN_SECONDS = 10.0
+PROXY_SUFFIX = ".proxy"  # Optional file next to a cookie file holding the identity's proxy URL
+
+
+class ErrorKind(str, Enum):
+    THROTTLED = "throttled"  # HTTP 429 and YouTube's rate limit notices
+    BLOCKED = "blocked"  # Bot checks and rejected cookies
+    UNAVAILABLE = "unavailable"  # The video itself cannot be had, retrying will not help
+    TRANSIENT = "transient"  # Network trouble and server errors
+    UNKNOWN = "unknown"
+
+
+# Only these are the upstream refusing us, they cool the identity down instead of failing the job
+UPSTREAM_KINDS = (ErrorKind.THROTTLED, ErrorKind.BLOCKED)
+
+ERROR_PATTERNS: List[Tuple[ErrorKind, re.Pattern]] = [
+    (ErrorKind.THROTTLED, re.compile(
+        r"HTTP Error 429|Too Many Requests|rate[- ]limited|rate limit|"
+        r"This content isn.t available, try again later",
+        re.IGNORECASE,
+    )),
+    (ErrorKind.BLOCKED, re.compile(
+        r"confirm you.re not a bot|unusual traffic|cookies are no longer valid|"
+        r"Use --cookies-from-browser or --cookies for the authentication",
+        re.IGNORECASE,
+    )),
+    (ErrorKind.UNAVAILABLE, re.compile(
+        r"Video unavailable|Private video|has been removed|confirm your age|members[- ]only|"
+        r"Premieres in|live event will begin|Unsupported URL|is not a valid URL|"
+        r"Requested format is not available|File size exceeds limit|exceeds limit",
+        re.IGNORECASE,
+    )),
+    (ErrorKind.TRANSIENT, re.compile(
+        r"timed out|Connection reset|Connection refused|Temporary failure in name resolution|"
+        r"HTTP Error 5\d\d|IncompleteRead|Unable to download webpage|Remote end closed",
+        re.IGNORECASE,
+    )),
+]
+
+
+def classify_error(message: str) -> ErrorKind:
+    """Kind of a yt-dlp failure, from its error output"""
+    for kind, pattern in ERROR_PATTERNS:
+        if pattern.search(message):
+            return kind
+    return ErrorKind.UNKNOWN
+
+
+def is_upstream_error(error: BaseException) -> bool:
+    """Whether a failure was the upstream refusing us rather than about the video"""
+    return isinstance(error, UpstreamThrottled) or classify_error(str(error)) in UPSTREAM_KINDS
+
+
+class UpstreamThrottled(VideoProcessingError):
+    """Raised when yt-dlp failed because the upstream throttled or blocked the identity used"""
+
+    def __init__(self, message: str, kind: ErrorKind = ErrorKind.THROTTLED):
+        super().__init__(message)
+        self.kind = kind
+
+
+@dataclass
+class Identity:
+    """Cookies and optional proxy a yt-dlp run presents to YouTube"""
+    name: str
+    cookie_file: Optional[str] = None
+    proxy: Optional[str] = None
+    active: int = 0
+    last_used: float = 0.0
+
+
+def load_identities(pool_dir: str = COOKIE_POOL_DIR, cookie_file: str = COOKIES_FILE) -> List[Identity]:
+    """
+    Identities of the cookie pool, each *.txt file in pool_dir is one
+
+    A file of the same name ending in .proxy holds a proxy URL for the
+    identity. Without a pool, or with an empty one, the single
+    COOKIE_FILE_PATH identity is used.
+    """
+    identities = []
+    if pool_dir:
+        try:
+            names = sorted(name for name in os.listdir(pool_dir) if name.endswith(".txt"))
+        except OSError as e:
+            logger.warning(f"Cannot read cookie pool {pool_dir}: {str(e)}")
+            names = []
+        for name in names:
+            stem = name[:-len(".txt")]
+            proxy = None
+            try:
+                with open(os.path.join(pool_dir, stem + PROXY_SUFFIX)) as f:
+                    proxy = f.read().strip() or None
+            except OSError:
+                pass
+            identities.append(Identity(name=stem, cookie_file=os.path.join(pool_dir, name), proxy=proxy))
+        if not identities:
+            logger.warning(f"No cookie files in {pool_dir}, using {cookie_file}")
+    return identities or [Identity(name="default", cookie_file=cookie_file)]
+
+
+class UpstreamState:
+    """Cooldown state per identity: (consecutive refusals, wall-clock time the cooldown ends)"""
+
+    def get_all(self, names: List[str]) -> Dict[str, Tuple[int, float]]:
+        raise NotImplementedError
+
+    def set(self, name: str, failures: int, until: float) -> None:
+        raise NotImplementedError
+
+
+class InMemoryUpstreamState(UpstreamState):
+    def __init__(self):
+        self._states: Dict[str, Tuple[int, float]] = {}
+
+    def get_all(self, names: List[str]) -> Dict[str, Tuple[int, float]]:
+        return {name: self._states.get(name, (0, 0.0)) for name in names}
+
+    def set(self, name: str, failures: int, until: float) -> None:
+        if failures:
+            self._states[name] = (failures, until)
+        else:
+            self._states.pop(name, None)
+
+
+class RedisUpstreamState(UpstreamState):
+    """
+    Cooldowns shared by every process using the same Redis
+
+    Throttling usually applies to an address, so processes on one host
+    (or behind one NAT) should see each other's cooldowns. Entries expire
+    once their cooldown and the longest backoff after it have passed.
+    """
+
+    KEY_PREFIX = "ytdl:upstream:"
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1)
+
+    def get_all(self, names: List[str]) -> Dict[str, Tuple[int, float]]:
+        try:
+            pipe = self.client.pipeline()
+            for name in names:
+                pipe.hgetall(f"{self.KEY_PREFIX}{name}")
+            values = pipe.execute()
+        except Exception as e:
+            # A Redis outage must never stop downloads, treat every identity as healthy
+            logger.warning(f"Redis upstream state read failed: {str(e)}")
+            return {name: (0, 0.0) for name in names}
+        return {
+            name: (int(value.get("failures", 0)), float(value.get("until", 0.0)))
+            for name, value in zip(names, values)
+        }
+
+    def set(self, name: str, failures: int, until: float) -> None:
+        key = f"{self.KEY_PREFIX}{name}"
+        try:
+            if not failures:
+                self.client.delete(key)
+                return
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping={"failures": failures, "until": until})
+            pipe.expire(key, int(max(0.0, until - time.time()) + UPSTREAM_BACKOFF_MAX_SECONDS) + 1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis upstream state write failed: {str(e)}")
+
+
+def create_upstream_state(backend: str = UPSTREAM_STATE_BACKEND) -> UpstreamState:
+    """Create the configured upstream state backend"""
+    if backend == "redis":
+        logger.info("Sharing upstream cooldowns through Redis")
+        return RedisUpstreamState()
+    if backend != "memory":
+        logger.warning(f"Unknown UPSTREAM_STATE_BACKEND '{backend}', falling back to memory")
+    return InMemoryUpstreamState()
+
+
+class UpstreamHealth:
+    """
+    Circuit breaker in front of YouTube, over a pool of identities
+
+    Every yt-dlp run leases an identity (cookie file and proxy) and
+    reports how it went. When YouTube throttles or bot-checks an identity,
+    it cools down for a backoff that doubles with each consecutive refusal
+    up to UPSTREAM_BACKOFF_MAX_SECONDS, and new runs rotate to the other
+    identities. An identity whose cooldown has passed is half-open: it
+    takes a single run, and a success clears its backoff.
+
+    While every identity is cooling down the circuit is open: leases wait
+    for one to come back rather than failing, and the job queues stop
+    taking jobs (see wait_until_closed), so jobs stay queued instead of
+    each burning a worker slot on a doomed download.
+    """
+
+    def __init__(
+        self,
+        pool_dir: str = COOKIE_POOL_DIR,
+        max_concurrency: int = IDENTITY_MAX_CONCURRENCY,
+        state: Optional[UpstreamState] = None,
+        backoff_seconds: float = UPSTREAM_BACKOFF_SECONDS,
+        max_backoff_seconds: float = UPSTREAM_BACKOFF_MAX_SECONDS,
+    ):
+        self.pool_dir = pool_dir
+        self.max_concurrency = max_concurrency
+        self.state = state or create_upstream_state()
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.identities: List[Identity] = load_identities(pool_dir)
+        self._lock = threading.Lock()
+        self._pool_mtime = self._mtime()
+        self._rescanned_at = time.monotonic()
+        self._was_open = False
+        if len(self.identities) > 1:
+            logger.info(f"Rotating downloads over {len(self.identities)} identities")
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.pool_dir).st_mtime if self.pool_dir else None
+        except OSError:
+            return None
+
+    def _rescan(self) -> None:
+        """Pick up cookie files added to or removed from the pool, caller holds the lock"""
+        now = time.monotonic()
+        if not self.pool_dir or now - self._rescanned_at < POOL_RESCAN_SECONDS:
+            return
+        self._rescanned_at = now
+        mtime = self._mtime()
+        if mtime == self._pool_mtime:
+            return
+        self._pool_mtime = mtime
+        current = {identity.name: identity for identity in self.identities}
+        identities = []
+        for identity in load_identities(self.pool_dir):
+            previous = current.get(identity.name)
+            if previous is not None:
+                # Runs in flight still count against it
+                identity.active, identity.last_used = previous.active, previous.last_used
+            identities.append(identity)
+        self.identities = identities
+        logger.info(f"Cookie pool reloaded, {len(identities)} identities")
+
+    def _usable(self, identity: Identity, failures: int, until: float, now: float) -> bool:
+        if until > now:
+            return False
+        if failures:
+            # Half-open, one probe at a time
+            return identity.active == 0
+        return not self.max_concurrency or identity.active < self.max_concurrency
+
+    def _update_circuit(self, states: Dict[str, Tuple[int, float]], now: float) -> None:
+        available = sum(1 for _, until in states.values() if until <= now)
+        UPSTREAM_IDENTITIES_AVAILABLE.set(available)
+        is_open = available == 0
+        if is_open and not self._was_open:
+            logger.warning(f"Every identity is cooling down, pausing downloads for {self._retry_after(states, now):.0f}s")
+        elif self._was_open and not is_open:
+            logger.info("An identity is available again, resuming downloads")
+        self._was_open = is_open
+
+    def _retry_after(self, states: Dict[str, Tuple[int, float]], now: float) -> float:
+        return max(0.0, min(until for _, until in states.values()) - now) if states else 0.0
+
+    def _names(self) -> List[str]:
+        with self._lock:
+            self._rescan()
+            return [identity.name for identity in self.identities]
+
+    def try_acquire(self) -> Optional[Identity]:
+        """Lease the least busy usable identity, None if none can take a run now"""
+        # The state may live in Redis, read it without holding up the other threads
+        states = self.state.get_all(self._names())
+        now = time.time()
+        with self._lock:
+            self._update_circuit(states, now)
+            usable = [
+                identity for identity in self.identities
+                # The pool may have been rescanned in the meantime
+                if identity.name in states and self._usable(identity, *states[identity.name], now)
+            ]
+            if not usable:
+                return None
+            identity = min(usable, key=lambda identity: (identity.active, identity.last_used))
+            identity.active += 1
+            identity.last_used = time.monotonic()
+            return identity
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the first identity's cooldown ends, 0 if one is available"""
+        return self._retry_after(self.state.get_all(self._names()), time.time())
+
+    @property
+    def is_open(self) -> bool:
+        """Whether every identity is cooling down"""
+        return self.retry_after > 0
+
+    async def acquire(self) -> Identity:
+        """Lease an identity, waiting while the circuit is open or every identity is busy"""
+        while True:
+            identity = await asyncio.to_thread(self.try_acquire)
+            if identity is not None:
+                return identity
+            await asyncio.sleep(UPSTREAM_POLL_SECONDS)
+
+    def acquire_blocking(self) -> Identity:
+        """acquire() for stage threads"""
+        while True:
+            identity = self.try_acquire()
+            if identity is not None:
+                return identity
+            time.sleep(UPSTREAM_POLL_SECONDS)
+
+    async def wait_until_closed(self) -> None:
+        """Wait while every identity is cooling down, see JobQueue.start"""
+        while True:
+            retry_after = await asyncio.to_thread(lambda: self.retry_after)
+            if retry_after <= 0:
+                return
+            await asyncio.sleep(min(retry_after, UPSTREAM_POLL_SECONDS * 5))
+
+    def release(self, identity: Identity, error: Optional[BaseException] = None, record: bool = True) -> Optional[ErrorKind]:
+        """
+        Return a leased identity, with the error its run failed with if any
+
+        Runs that were cancelled are released with record=False and leave
+        the identity's state as it was.
+
+        Returns:
+            The kind of error, None for a success
+        """
+        kind = None
+        if error is not None:
+            kind = error.kind if isinstance(error, UpstreamThrottled) else classify_error(str(error))
+            UPSTREAM_ERRORS.labels(kind=kind.value).inc()
+        with self._lock:
+            identity.active = max(0, identity.active - 1)
+        if not record or (kind is not None and kind not in UPSTREAM_KINDS):
+            return kind
+        # Outside the lock, like the other processes sharing the state
+        failures, _ = self.state.get_all([identity.name])[identity.name]
+        if kind is None:
+            if failures:
+                logger.info(f"Identity {identity.name} recovered after {failures} refusal(s)")
+                self.state.set(identity.name, 0, 0.0)
+            return None
+        failures += 1
+        # Jitter keeps identities and processes from coming back in lockstep
+        cooldown = min(self.backoff_seconds * 2 ** (failures - 1), self.max_backoff_seconds)
+        cooldown *= random.uniform(0.8, 1.2)
+        self.state.set(identity.name, failures, time.time() + cooldown)
+        UPSTREAM_COOLDOWNS.inc()
+        logger.warning(
+            f"Identity {identity.name} was {kind.value} by the upstream "
+            f"({failures} in a row), cooling down for {cooldown:.0f}s"
+        )
+        return kind
+
+    def _finish(self, identity: Identity, error: BaseException) -> None:
+        """Release after a failed run, turning upstream refusals into UpstreamThrottled"""
+        if not isinstance(error, VideoProcessingError):
+            self.release(identity, record=False)
+            return
+        kind = self.release(identity, error)
+        if kind in UPSTREAM_KINDS and not isinstance(error, UpstreamThrottled):
+            raise UpstreamThrottled(str(error), kind) from error
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        Hold an identity for one yt-dlp run:
+
+            async with upstream_health.lease() as identity:
+                ...
+
+        A VideoProcessingError caused by throttling or a bot check leaves
+        the block as UpstreamThrottled.
+        """
+        identity = await self.acquire()
+        try:
+            yield identity
+        except BaseException as e:
+            await asyncio.to_thread(self._finish, identity, e)
+            raise
+        await asyncio.to_thread(self.release, identity)
+
+    @contextmanager
+    def lease_blocking(self):
+        """lease() for stage threads"""
+        identity = self.acquire_blocking()
+        try:
+            yield identity
+        except BaseException as e:
+            self._finish(identity, e)
+            raise
+        self.release(identity)
+
+    def stats(self) -> dict:
+        with self._lock:
+            identities = list(self.identities)
+        states = self.state.get_all([identity.name for identity in identities])
+        now = time.time()
+        return {
+            "circuit": "open" if self._retry_after(states, now) > 0 else "closed",
+            "identities": [
+                {
+                    "name": identity.name,
+                    "active": identity.active,
+                    "proxy": identity.proxy is not None,
+                    "consecutive_refusals": states[identity.name][0],
+                    "cooldown_seconds": round(max(0.0, states[identity.name][1] - now), 1),
+                }
+                for identity in identities
+            ],
+        }
+
+
+# Global upstream health instance
+upstream_health = UpstreamHealth()
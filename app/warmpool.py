@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+from app.ytdlp_worker import READY_PREFIX, EXIT_PREFIX, STDERR_PREFIX
+from app.metrics import YTDLP_WORKERS, YTDLP_WORKER_RECYCLES
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+YTDLP_WARM_WORKERS = int(os.getenv("YTDLP_WARM_WORKERS", "0"))  # 0 starts the yt-dlp binary for every download
+YTDLP_WORKER_MAX_JOBS = int(os.getenv("YTDLP_WORKER_MAX_JOBS", "50"))  # Jobs before a worker is replaced
+YTDLP_WORKER_MAX_RSS_MB = int(os.getenv("YTDLP_WORKER_MAX_RSS_MB", "512"))  # 0 disables the memory check
+WORKER_START_TIMEOUT_SECONDS = 60
+WORKER_STOP_TIMEOUT_SECONDS = 5
+LINE_LIMIT_BYTES = 1024 * 1024
+# The worker is started as `python -m app.ytdlp_worker`, whatever the service's working directory
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class WorkerError(Exception):
+    """Raised when a warm worker dies or cannot be started"""
+    pass
+
+
+class WarmWorker:
+    """One long-lived `python -m app.ytdlp_worker` process, running one job at a time"""
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.jobs = 0
+        self.exit_code: Optional[int] = None
+        self.rss_bytes = 0
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    @classmethod
+    async def spawn(cls, timeout: float = WORKER_START_TIMEOUT_SECONDS) -> "WarmWorker":
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get("PYTHONPATH")]))
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app.ytdlp_worker",
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            # Crashes of the worker itself end up in the service log
+            stderr=None,
+            # Its own process group, so it and its ffmpeg children can be paused and killed together
+            start_new_session=True,
+            limit=LINE_LIMIT_BYTES,
+        )
+        worker = cls(process)
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            worker.kill()
+            raise WorkerError(f"yt-dlp worker did not start within {timeout:.0f}s")
+        if not line.decode(errors="replace").startswith(READY_PREFIX):
+            worker.kill()
+            raise WorkerError("yt-dlp worker exited during startup")
+        return worker
+
+    async def start_job(self, argv: List[str]) -> None:
+        self.jobs += 1
+        self.exit_code = None
+        self.process.stdin.write(json.dumps({"argv": argv}).encode() + b"\n")
+        await self.process.stdin.drain()
+
+    async def read_line(self) -> Tuple[Optional[str], bool]:
+        """
+        Next output line of the current job and whether yt-dlp wrote it to stderr
+
+        Returns:
+            (None, False) once the job has ended, see exit_code
+        """
+        raw = await self.process.stdout.readline()
+        if not raw:
+            raise WorkerError("yt-dlp worker exited unexpectedly")
+        line = raw.decode(errors="replace").rstrip("\n")
+        if line.startswith(EXIT_PREFIX):
+            fields = line[len(EXIT_PREFIX):].split()
+            self.exit_code = int(fields[0])
+            self.rss_bytes = int(fields[1]) if len(fields) > 1 else 0
+            return None, False
+        if line.startswith(STDERR_PREFIX):
+            return line[len(STDERR_PREFIX):], True
+        return line, False
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, 9)
+        except ProcessLookupError:
+            pass
+
+    async def stop(self, timeout: float = WORKER_STOP_TIMEOUT_SECONDS) -> None:
+        """Let the worker exit after closing its input, kill it if it takes too long"""
+        if self.alive:
+            try:
+                self.process.stdin.close()
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                self.kill()
+        await self.process.wait()
+
+
+class WarmWorkerPool:
+    """
+    Long-lived yt-dlp worker processes, handed out one download at a time
+
+    Starting the yt-dlp binary costs an interpreter start and the import of
+    every extractor before the first request, and YouTube's player code is
+    fetched and parsed again by each process. Warm workers pay that once
+    and keep their extractors between jobs. A worker is replaced after
+    max_jobs downloads, once its resident memory passes max_rss_bytes,
+    and whenever a download on it fails to finish cleanly (killed, timed
+    out or cancelled).
+    """
+
+    def __init__(
+        self,
+        size: int = YTDLP_WARM_WORKERS,
+        max_jobs: int = YTDLP_WORKER_MAX_JOBS,
+        max_rss_bytes: int = YTDLP_WORKER_MAX_RSS_MB * 1024 * 1024,
+    ):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = max_rss_bytes
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: List[WarmWorker] = []
+        self._workers: Set[WarmWorker] = set()
+        self._stopping: Set[asyncio.Task] = set()
+        self._starting = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        return self._slots
+
+    async def start(self) -> None:
+        """Start every worker up front, so the first downloads find them warm"""
+        # Downloads that arrived first may have started some already
+        missing = self.size - len(self._workers) - self._starting
+        results = await asyncio.gather(*(self._spawn() for _ in range(missing)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, WarmWorker):
+                self._idle.append(result)
+            else:
+                logger.error(f"Failed to start yt-dlp worker: {str(result)}")
+        logger.info(f"Started {len(self._workers)} warm yt-dlp worker(s)")
+
+    async def _spawn(self) -> WarmWorker:
+        self._starting += 1
+        try:
+            worker = await WarmWorker.spawn()
+        finally:
+            self._starting -= 1
+        self._workers.add(worker)
+        YTDLP_WORKERS.set(len(self._workers))
+        return worker
+
+    async def acquire(self) -> WarmWorker:
+        """Wait for an idle worker, starting one if fewer than size are running"""
+        await self.slots.acquire()
+        try:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive:
+                    return worker
+                self._forget(worker)
+            return await self._spawn()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, worker: WarmWorker, clean: bool) -> None:
+        """Return a worker after a job, clean if the job ran to its exit line"""
+        reason = None
+        if not clean or not worker.alive:
+            reason = "failed"
+        elif worker.jobs >= self.max_jobs:
+            reason = "jobs"
+        elif self.max_rss_bytes and worker.rss_bytes > self.max_rss_bytes:
+            reason = "memory"
+
+        if reason is None:
+            self._idle.append(worker)
+        else:
+            logger.info(f"Recycling yt-dlp worker {worker.pid} after {worker.jobs} job(s) ({reason})")
+            YTDLP_WORKER_RECYCLES.labels(reason=reason).inc()
+            self._retire(worker)
+        self.slots.release()
+
+    def _forget(self, worker: WarmWorker) -> None:
+        self._workers.discard(worker)
+        YTDLP_WORKERS.set(len(self._workers))
+
+    def _retire(self, worker: WarmWorker) -> None:
+        self._forget(worker)
+        if not worker.alive:
+            return
+        task = asyncio.create_task(worker.stop())
+        self._stopping.add(task)
+        task.add_done_callback(self._stopping.discard)
+
+    async def shutdown(self) -> None:
+        """Kill every worker, busy or not"""
+        for worker in list(self._workers):
+            worker.kill()
+        await asyncio.gather(*(worker.process.wait() for worker in self._workers), *self._stopping, return_exceptions=True)
+        self._workers.clear()
+        self._idle.clear()
+        YTDLP_WORKERS.set(0)
@@ -0,0 +1,467 @@
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import ipaddress
+import threading
+from dataclasses import dataclass, asdict, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.jobs import (
+    Job,
+    JobStore,
+    FINISHED_STATUSES,
+    JOB_STORE_BACKEND,
+    JOB_DB_PATH,
+    JOB_RETENTION_SECONDS,
+    REDIS_URL,
+    job_store,
+)
+from app.metrics import WEBHOOK_DELIVERIES
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # HMAC-SHA256 key for X-Ytdl-Signature
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "8"))  # Deliveries in flight per process
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", "2"))  # Doubles after every failed attempt
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "300"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+# Callbacks to loopback, private and link-local addresses are refused unless enabled
+WEBHOOK_ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "false").lower() in ("1", "true", "yes")
+WEBHOOK_DRAIN_SECONDS = 5.0
+USER_AGENT = "ytdl-microservice/1.0"
+
+
+class WebhookError(Exception):
+    """Raised when a delivery attempt fails, retry tells whether trying again can help"""
+
+    def __init__(self, message: str, retry: bool = True):
+        super().__init__(message)
+        self.retry = retry
+
+
+@dataclass
+class Delivery:
+    """One callback and its delivery attempts"""
+    url: str
+    payload: dict
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    failed_at: Optional[float] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Delivery":
+        return cls(**data)
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """
+    Signature of a callback body
+
+    Receivers recompute HMAC-SHA256(secret, "<timestamp>.<body>") and
+    compare it to the X-Ytdl-Signature header in constant time.
+    """
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def job_payload(job: Job) -> dict:
+    """Callback body for a finished job"""
+    def duration(start: Optional[float], end: Optional[float]) -> Optional[float]:
+        return round(end - start, 3) if start and end else None
+
+    download_end = job.upload_started_at or job.finished_at
+    return {
+        "event": f"job.{job.status.value}",
+        "task_id": job.id,
+        "status": job.status.value,
+        "url": job.url,
+        "profile": job.profile,
+        "s3_key": job.s3_key,
+        "size_bytes": job.size_bytes,
+        "error": job.error,
+        "batch_id": job.batch_id,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "durations": {
+            "queued": duration(job.created_at, job.started_at or job.finished_at),
+            # Streamed uploads overlap the download, their time is all counted here
+            "download": duration(job.started_at, download_end),
+            "upload": duration(job.upload_started_at, job.finished_at),
+            "total": duration(job.created_at, job.finished_at),
+        },
+    }
+
+
+class DeadLetterStore:
+    """Interface for callbacks that could not be delivered"""
+
+    def add(self, delivery: Delivery) -> None:
+        raise NotImplementedError
+
+    def list(self, limit: int = 50) -> List[Delivery]:
+        """Newest first"""
+        raise NotImplementedError
+
+    def pop(self, delivery_id: str) -> Optional[Delivery]:
+        """Remove and return a delivery, e.g. to retry it"""
+        raise NotImplementedError
+
+
+class SQLiteDeadLetterStore(DeadLetterStore):
+    """Dead letters in a table of the job database"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+                    id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    failed_at REAL,
+                    error TEXT
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_dead_letters_failed ON webhook_dead_letters (failed_at)"
+            )
+
+    def _row_to_delivery(self, row: sqlite3.Row) -> Delivery:
+        data = dict(row)
+        data["payload"] = json.loads(data["payload"])
+        return Delivery.from_dict(data)
+
+    def add(self, delivery: Delivery) -> None:
+        data = delivery.to_dict()
+        data["payload"] = json.dumps(delivery.payload)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO webhook_dead_letters (id, url, payload, attempts, created_at, failed_at, error)
+                VALUES (:id, :url, :payload, :attempts, :created_at, :failed_at, :error)
+                """,
+                data,
+            )
+            self._conn.execute(
+                "DELETE FROM webhook_dead_letters WHERE failed_at < ?",
+                (time.time() - JOB_RETENTION_SECONDS,)
+            )
+
+    def list(self, limit: int = 50) -> List[Delivery]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM webhook_dead_letters ORDER BY failed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_delivery(row) for row in rows]
+
+    def pop(self, delivery_id: str) -> Optional[Delivery]:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT * FROM webhook_dead_letters WHERE id = ?", (delivery_id,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM webhook_dead_letters WHERE id = ?", (delivery_id,))
+        return self._row_to_delivery(row)
+
+
+class RedisDeadLetterStore(DeadLetterStore):
+    """Dead letters shared by every process through Redis"""
+
+    KEY_PREFIX = "ytdl:webhook:dead:"
+    INDEX_KEY = "ytdl:webhooks:dead"
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def add(self, delivery: Delivery) -> None:
+        pipe = self.client.pipeline()
+        pipe.set(f"{self.KEY_PREFIX}{delivery.id}", json.dumps(delivery.to_dict()), ex=JOB_RETENTION_SECONDS)
+        pipe.zadd(self.INDEX_KEY, {delivery.id: delivery.failed_at or time.time()})
+        pipe.zremrangebyscore(self.INDEX_KEY, 0, time.time() - JOB_RETENTION_SECONDS)
+        pipe.execute()
+
+    def list(self, limit: int = 50) -> List[Delivery]:
+        deliveries = []
+        for delivery_id in self.client.zrevrange(self.INDEX_KEY, 0, limit - 1):
+            data = self.client.get(f"{self.KEY_PREFIX}{delivery_id}")
+            if data:
+                deliveries.append(Delivery.from_dict(json.loads(data)))
+        return deliveries
+
+    def pop(self, delivery_id: str) -> Optional[Delivery]:
+        key = f"{self.KEY_PREFIX}{delivery_id}"
+        pipe = self.client.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        pipe.zrem(self.INDEX_KEY, delivery_id)
+        data, _, _ = pipe.execute()
+        return Delivery.from_dict(json.loads(data)) if data else None
+
+
+def create_dead_letter_store(backend: str = JOB_STORE_BACKEND) -> DeadLetterStore:
+    """Dead letters are kept next to the jobs they belong to"""
+    if backend == "redis":
+        return RedisDeadLetterStore()
+    return SQLiteDeadLetterStore()
+
+
+def check_destination(url: str) -> str:
+    """
+    Resolve a callback's host, refusing ones that would reach into the service's own network
+
+    Returns:
+        The address the callback is sent to. The request connects to it
+        instead of resolving the name again, so a DNS answer that changes
+        after the check cannot point it somewhere else.
+
+    Raises:
+        WebhookError: If the URL is not http(s) or resolves to a non-public address
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise WebhookError(f"Unsupported callback URL: {url}", retry=False)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise WebhookError(f"Cannot resolve {parsed.hostname}: {str(e)}")
+    if not WEBHOOK_ALLOW_PRIVATE:
+        for address in addresses:
+            if not ipaddress.ip_address(address[4][0]).is_global:
+                raise WebhookError(f"{parsed.hostname} resolves to a non-public address", retry=False)
+    return addresses[0][4][0]
+
+
+def pin_address(url: str, address: str) -> Tuple[str, str]:
+    """Rewrite a URL to connect to address, returns it with the Host header of the original"""
+    parsed = urlparse(url)
+    userinfo, _, host = parsed.netloc.rpartition("@")
+    netloc = f"[{address}]" if ":" in address else address
+    if parsed.port:
+        netloc = f"{netloc}:{parsed.port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    return parsed._replace(netloc=netloc).geturl(), host
+
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """
+    HTTP adapter for requests sent to an IP address with the hostname in their Host header
+
+    TLS connections send that hostname for SNI and check the certificate
+    against it, as if the URL had named the host.
+    """
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        host = request.headers.get("Host")
+        if host and host_params["scheme"] == "https":
+            hostname = urlparse(f"//{host}").hostname
+            pool_kwargs["server_hostname"] = hostname
+            pool_kwargs["assert_hostname"] = hostname
+        return host_params, pool_kwargs
+
+
+class WebhookDispatcher:
+    """
+    Delivers callbacks from a bounded queue with a fixed number of workers
+
+    Each delivery is a signed JSON POST over a pooled HTTP session. Network
+    errors, timeouts, 408, 429 and 5xx answers are retried with jittered
+    exponential backoff up to max_attempts; other answers, and callbacks
+    still undelivered on shutdown, go to the dead-letter store from which
+    they can be listed and retried.
+    """
+
+    def __init__(
+        self,
+        dead_letters: DeadLetterStore,
+        secret: str = WEBHOOK_SECRET,
+        concurrency: int = WEBHOOK_CONCURRENCY,
+        max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        timeout: float = WEBHOOK_TIMEOUT_SECONDS,
+    ):
+        self.dead_letters = dead_letters
+        self.secret = secret
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._retries: Dict[str, asyncio.TimerHandle] = {}
+        self._pending: Dict[str, Delivery] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._session: Optional[requests.Session] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if not self.secret:
+            logger.warning("WEBHOOK_SECRET is not set, callbacks will not be signed")
+        self._session = requests.Session()
+        adapter = PinnedAddressAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="webhook")
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"webhook-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self, drain_timeout: float = WEBHOOK_DRAIN_SECONDS) -> None:
+        """Give queued callbacks a moment to go out, dead-letter the rest"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+        for delivery in list(self._pending.values()):
+            self._dead_letter(delivery, delivery.error or "Undelivered at shutdown")
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def enqueue(self, delivery: Delivery) -> None:
+        """Queue a delivery, it is dead-lettered right away if the queue is full"""
+        if self._queue is None:
+            self._dead_letter(delivery, "Webhook dispatcher is not running")
+            return
+        try:
+            self._queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            self._dead_letter(delivery, f"Webhook queue is full ({self.queue_size} deliveries waiting)")
+            return
+        self._pending[delivery.id] = delivery
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            delivery = await self._queue.get()
+            try:
+                delivery.attempts += 1
+                await loop.run_in_executor(self._executor, self._post, delivery)
+            except WebhookError as e:
+                self._failed(delivery, e)
+            except Exception as e:
+                logger.error(f"Webhook delivery {delivery.id} failed unexpectedly: {str(e)}")
+                self._failed(delivery, WebhookError(str(e)))
+            else:
+                self._pending.pop(delivery.id, None)
+                WEBHOOK_DELIVERIES.labels(result="delivered").inc()
+                logger.info(f"Delivered webhook {delivery.id} to {delivery.url} (attempt {delivery.attempts})")
+            finally:
+                self._queue.task_done()
+
+    def _failed(self, delivery: Delivery, error: WebhookError) -> None:
+        delivery.error = str(error)
+        if not error.retry or delivery.attempts >= self.max_attempts:
+            self._pending.pop(delivery.id, None)
+            self._dead_letter(delivery, delivery.error)
+            return
+
+        backoff = min(WEBHOOK_BACKOFF_SECONDS * 2 ** (delivery.attempts - 1), WEBHOOK_BACKOFF_MAX_SECONDS)
+        delay = random.uniform(backoff / 2, backoff)
+        WEBHOOK_DELIVERIES.labels(result="retried").inc()
+        logger.warning(f"Webhook {delivery.id} attempt {delivery.attempts} failed, retrying in {delay:.1f}s: {delivery.error}")
+        self._retries[delivery.id] = asyncio.get_running_loop().call_later(delay, self._retry, delivery)
+
+    def _retry(self, delivery: Delivery) -> None:
+        self._retries.pop(delivery.id, None)
+        try:
+            self._queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            self._pending.pop(delivery.id, None)
+            self._dead_letter(delivery, "Webhook queue is full")
+
+    def _dead_letter(self, delivery: Delivery, error: str) -> None:
+        delivery.error = error
+        delivery.failed_at = time.time()
+        WEBHOOK_DELIVERIES.labels(result="dead_lettered").inc()
+        logger.error(f"Webhook {delivery.id} to {delivery.url} dead-lettered after {delivery.attempts} attempt(s): {error}")
+        try:
+            self.dead_letters.add(delivery)
+        except Exception as e:
+            logger.error(f"Failed to store dead-lettered webhook {delivery.id}: {str(e)}")
+
+    def _post(self, delivery: Delivery) -> None:
+        url, host = pin_address(delivery.url, check_destination(delivery.url))
+        body = json.dumps(delivery.payload, separators=(",", ":")).encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            "Host": host,
+            "Content-Type": "application/json",
+            "User-Agent": USER_AGENT,
+            "X-Ytdl-Event": delivery.payload.get("event", ""),
+            # Stable across retries, receivers use it to drop duplicates
+            "X-Ytdl-Delivery": delivery.id,
+            "X-Ytdl-Timestamp": timestamp,
+        }
+        if self.secret:
+            headers["X-Ytdl-Signature"] = sign(self.secret, timestamp, body)
+
+        try:
+            response = self._session.post(
+                url, data=body, headers=headers, timeout=self.timeout, allow_redirects=False
+            )
+        except requests.exceptions.RequestException as e:
+            raise WebhookError(f"Request failed: {str(e)}")
+        if 200 <= response.status_code < 300:
+            return
+        retry = response.status_code >= 500 or response.status_code in (408, 429)
+        raise WebhookError(f"Callback answered HTTP {response.status_code}", retry=retry)
+
+
+async def notify_job_finished(job_id: str, store: JobStore = job_store) -> None:
+    """Queue the callback of a finished job, if it asked for one"""
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None or not job.callback_url or job.status not in FINISHED_STATUSES:
+        return
+    webhook_dispatcher.enqueue(Delivery(url=job.callback_url, payload=job_payload(job)))
+
+
+# Global webhook dispatcher instance
+webhook_dispatcher = WebhookDispatcher(create_dead_letter_store())
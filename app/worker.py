@@ -0,0 +1,264 @@
+"""
+Job execution: the download pipeline behind the API
+
+API processes run jobs through these helpers directly with the default
+JOB_EXECUTION=inline. With JOB_EXECUTION=worker the API only queues jobs
+and separate worker processes run them:
+
+    python -m app.worker
+"""
+
+import os
+import signal
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import start_http_server
+
+from app.downloader import VideoProcessingError, client_pool, streams_to_s3
+from app.profiles import OutputProfile, DEFAULT_PROFILE, get_profile
+from app.scheduler import scheduler
+from app.supervisor import ProgressCallback
+from app.uploader import UPLOAD_GLOBAL_CONCURRENCY, UPLOAD_JOB_CONCURRENCY
+from app.cache import result_cache, make_cache_key
+from app.singleflight import SingleFlight
+from app.jobs import Job, JobStatus, JOB_EXECUTION, job_store, job_queue
+from app.ratelimit import bytes_limiter, job_limiter
+from app.events import progress_reporter, publish_status
+from app.webhooks import notify_job_finished, webhook_dispatcher
+from app.checkpoints import checkpoint_store
+from app.upstream import upstream_health
+from app.auth import DEFAULT_PRIORITY
+from app.keys import key_registry
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Enough job workers to keep both stages busy, the scheduler orders them by priority
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY") or scheduler.total_workers)
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))  # 0 disables
+
+# Concurrent requests for the same video share one download
+inflight_downloads = SingleFlight()
+# Progress callbacks of every caller sharing an in-flight download
+progress_listeners: Dict[str, List[ProgressCallback]] = {}
+# Job status writes, off the event loop and on a single thread so each job's updates land in order
+job_store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+
+def result_cache_key(url: str, profile: OutputProfile) -> Optional[str]:
+    """Key of a video's result for one output profile"""
+    return make_cache_key(url, profile.cache_variant(streams_to_s3(profile)))
+
+
+def get_cached_s3_key(url: str, profile: OutputProfile = DEFAULT_PROFILE) -> Optional[str]:
+    """Return the S3 key of a previously processed video, if cached"""
+    cache_key = result_cache_key(url, profile)
+    if not cache_key:
+        return None
+    s3_key = result_cache.get(cache_key)
+    if s3_key:
+        logger.info(f"Cache hit for {url}: {s3_key}")
+    metrics.CACHE_REQUESTS.labels(result="hit" if s3_key else "miss").inc()
+    return s3_key
+
+
+def store_cached_s3_key(url: str, s3_key: str, profile: OutputProfile = DEFAULT_PROFILE) -> None:
+    """Remember the S3 key of a processed video for repeat requests"""
+    cache_key = result_cache_key(url, profile)
+    if cache_key:
+        result_cache.set(cache_key, s3_key)
+
+
+def release_job_slot(job: Job) -> None:
+    """Give back the per-key job slot taken when the job was admitted"""
+    if job.api_key_id:
+        job_limiter.release(job.api_key_id)
+
+
+async def finish_job(job: Job) -> None:
+    """Called once a job has left the queue: release its slot and send its callback"""
+    await asyncio.to_thread(release_job_slot, job)
+    await notify_job_finished(job.id)
+
+
+def reclaim_job_slot(job: Job) -> None:
+    """Hold the job slot of a job taken over from a stopped process"""
+    if job.api_key_id:
+        job_limiter.reclaim(job.api_key_id)
+
+
+def charge_download(key_id: Optional[str]) -> Optional[Callable[[int], None]]:
+    """Callback recording downloaded bytes against a key's quota"""
+    if key_id is None or not bytes_limiter.enabled_for(key_id):
+        return None
+    return lambda num_bytes: bytes_limiter.consume(key_id, num_bytes)
+
+
+async def run_download(
+    url: str,
+    on_stage: Optional[Callable[[str], None]] = None,
+    priority: int = DEFAULT_PRIORITY,
+    on_downloaded: Optional[Callable[[int], None]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    profile: OutputProfile = DEFAULT_PROFILE
+) -> str:
+    """
+    Download and upload a video through the scheduler
+
+    Concurrent calls for the same video and profile are coalesced into a
+    single scheduled job and all receive the same S3 key and progress
+    events. Only the caller that started the shared job has the download
+    charged to its quota.
+    """
+    flight_key = result_cache_key(url, profile)
+
+    def broadcast(event: dict) -> None:
+        for listener in list(progress_listeners.get(flight_key, ())):
+            listener(event)
+
+    async def process():
+        s3_key = await scheduler.run_job(
+            url,
+            on_stage=on_stage,
+            priority=priority,
+            on_progress=broadcast if flight_key else on_progress,
+            on_downloaded=on_downloaded,
+            profile=profile
+        )
+        store_cached_s3_key(url, s3_key, profile)
+        return s3_key
+
+    if not (flight_key and on_progress):
+        return await inflight_downloads.do(flight_key, process)
+
+    listeners = progress_listeners.setdefault(flight_key, [])
+    listeners.append(on_progress)
+    try:
+        return await inflight_downloads.do(flight_key, process)
+    finally:
+        listeners.remove(on_progress)
+        if not listeners and progress_listeners.get(flight_key) is listeners:
+            del progress_listeners[flight_key]
+
+
+def _log_write_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Job store write failed: {str(future.exception())}")
+
+
+async def handle_job(job: Job) -> None:
+    """Run a queued job and record its outcome in the job store"""
+    loop = asyncio.get_running_loop()
+
+    def write(func: Callable, *args, **fields) -> asyncio.Future:
+        future = loop.run_in_executor(job_store_writer, partial(func, *args, **fields))
+        future.add_done_callback(_log_write_failure)
+        return future
+
+    def set_status(status: JobStatus, **fields) -> asyncio.Future:
+        future = write(job_store.set_status, job.id, status, **fields)
+        # Subscribers read the status back from the store once the write is through
+        future.add_done_callback(lambda _: publish_status(job.id, status))
+        return future
+
+    def on_stage(stage: str) -> None:
+        set_status(JobStatus(stage))
+
+    charge = charge_download(job.api_key_id)
+
+    def on_downloaded(num_bytes: int) -> None:
+        write(job_store.update, job.id, size_bytes=num_bytes)
+        if charge:
+            charge(num_bytes)
+
+    await set_status(JobStatus.DOWNLOADING)
+    try:
+        s3_key = await run_download(
+            job.url,
+            on_stage=on_stage,
+            priority=job.priority,
+            on_downloaded=on_downloaded,
+            on_progress=progress_reporter(job.id),
+            profile=get_profile(job.profile)
+        )
+    except VideoProcessingError as e:
+        logger.error(f"Job {job.id} failed: {str(e)}")
+        await set_status(JobStatus.FAILED, error=str(e))
+        return
+
+    await set_status(JobStatus.DONE, s3_key=s3_key)
+    logger.info(f"Job {job.id} completed: {s3_key}")
+
+
+def start_execution(concurrency: int = WORKER_CONCURRENCY) -> None:
+    """Open shared clients, start the scheduler and begin taking jobs"""
+    # Enough connections for every part in flight plus one control call per worker
+    upload_workers = scheduler.upload_pool.workers
+    client_pool.open(
+        max_connections=min(UPLOAD_GLOBAL_CONCURRENCY, upload_workers * UPLOAD_JOB_CONCURRENCY) + scheduler.total_workers
+    )
+    checkpoint_store.sweep()
+    scheduler.start()
+    webhook_dispatcher.start()
+    # Jobs wait in the queue while every upstream identity is cooling down
+    job_queue.start(
+        handle_job,
+        concurrency=concurrency,
+        on_finished=finish_job,
+        gate=upstream_health.wait_until_closed,
+        on_recovered=reclaim_job_slot,
+    )
+
+
+async def stop_execution() -> None:
+    """
+    Stop taking jobs and let running ones finish for up to JOB_DRAIN_SECONDS,
+    then shut the scheduler, callbacks and shared clients down
+
+    Jobs still running are interrupted with their checkpoints kept and
+    resumed by the next process to start.
+    """
+    await job_queue.drain()
+    await job_queue.stop()
+    await scheduler.stop()
+    await webhook_dispatcher.stop()
+    client_pool.close()
+
+
+async def serve() -> None:
+    """Run jobs from the shared queue until SIGTERM or SIGINT"""
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT)
+        logger.info(f"Serving worker metrics on port {WORKER_METRICS_PORT}")
+
+    key_registry.start()
+    start_execution()
+    await stopped.wait()
+    logger.info("Shutting down worker")
+    await stop_execution()
+    await key_registry.stop()
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if JOB_EXECUTION != "worker":
+        logger.error("Worker processes need JOB_EXECUTION=worker on both the API and the workers")
+        raise SystemExit(1)
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
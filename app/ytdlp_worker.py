@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Long-lived yt-dlp worker, started by app.warmpool
+
+Imports yt_dlp and its extractors once, then runs one download per line
+read from stdin, a JSON object {"argv": [...]} holding the arguments the
+yt-dlp binary would get. Extractor instances, and with them YouTube's
+player and signature caches, are kept from one job to the next.
+
+Everything yt-dlp prints goes to stdout: its stdout lines as they are,
+its stderr lines behind STDERR_PREFIX. Every job ends with a line
+"<EXIT_PREFIX> <exit code> <rss in bytes>".
+"""
+
+import io
+import os
+import sys
+import json
+import resource
+import traceback
+
+READY_PREFIX = "[ytdl-worker-ready]"
+EXIT_PREFIX = "[ytdl-worker-exit]"
+STDERR_PREFIX = "[ytdl-worker-stderr] "
+
+
+class LineWriter(io.TextIOBase):
+    """Text stream writing whole lines to the protocol channel, behind a prefix"""
+
+    def __init__(self, out, prefix: str = ""):
+        self.out = out
+        self.prefix = prefix
+        self._pending = ""
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"
+
+    def isatty(self) -> bool:
+        return False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._pending += text.replace("\r", "\n")
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            if line:
+                self.out.write(f"{self.prefix}{line}\n")
+        self.out.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        # Called after every write, a partial line waits for the rest of it
+        self.out.flush()
+
+    def end_job(self) -> None:
+        """Emit a partial last line, nothing may follow the job's exit line"""
+        if self._pending:
+            self.out.write(f"{self.prefix}{self._pending}\n")
+            self._pending = ""
+        self.out.flush()
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_job(yt_dlp, argv: list, warm_extractors: dict) -> int:
+    """Run one yt-dlp command line in-process, returning its exit code"""
+    try:
+        parsed = yt_dlp.parse_options(argv)
+    except SystemExit as e:
+        # The parser has printed why
+        return e.code if isinstance(e.code, int) else 2
+    except Exception as e:
+        # Invalid options, reported like the yt-dlp binary does
+        print(str(e), file=sys.stderr)
+        return 2
+
+    try:
+        with yt_dlp.YoutubeDL(parsed.ydl_opts) as ydl:
+            for extractor in warm_extractors.values():
+                # Re-run per-instance setup against the new YoutubeDL, the caches survive it
+                extractor._ready = False
+                ydl.add_info_extractor(extractor)
+            try:
+                if parsed.options.load_info_filename is not None:
+                    return ydl.download_with_info_file(os.path.expanduser(parsed.options.load_info_filename))
+                return ydl.download(parsed.urls)
+            finally:
+                warm_extractors.update(getattr(ydl, "_ies_instances", {}))
+    except yt_dlp.utils.DownloadError:
+        # Already reported by yt-dlp
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+def main() -> None:
+    protocol = sys.stdout
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # Resolve the lazily loaded extractor classes now rather than on the first job
+    gen_extractor_classes()
+    warm_extractors: dict = {}
+    stdout, stderr = LineWriter(protocol), LineWriter(protocol, STDERR_PREFIX)
+
+    protocol.write(f"{READY_PREFIX} {os.getpid()}\n")
+    protocol.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        argv = json.loads(line)["argv"]
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            code = run_job(yt_dlp, argv, warm_extractors)
+        finally:
+            stdout.end_job()
+            stderr.end_job()
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        protocol.write(f"{EXIT_PREFIX} {code or 0} {current_rss()}\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main()
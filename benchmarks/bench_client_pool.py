@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-job client setup overhead: fresh clients per job vs the shared pool
+
+Each simulated job performs what a scheduled job does before the first
+byte is uploaded: obtain an S3 client and an HTTP session, then make one S3
+request and one HTTPS request. Point it at a local S3 stand-in to avoid
+touching real AWS:
+
+    AWS_ENDPOINT_URL=http://localhost:9000 AWS_BUCKET_NAME=bench \\
+    AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin \\
+    python benchmarks/bench_client_pool.py --jobs 50
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.downloader import BUCKET_NAME, create_s3_client, create_robust_session  # noqa: E402
+from app.clients import ClientPool  # noqa: E402
+
+
+def run_job(s3_client, session, http_url: str) -> None:
+    s3_client.list_objects_v2(Bucket=BUCKET_NAME, MaxKeys=1)
+    if http_url:
+        session.head(http_url, timeout=(10, 30))
+
+
+def measure(label: str, jobs: int, get_clients, http_url: str) -> list:
+    timings = []
+    for _ in range(jobs):
+        started = time.perf_counter()
+        s3_client, session = get_clients()
+        run_job(s3_client, session, http_url)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+    print(
+        f"{label:<12} mean {statistics.mean(timings):8.2f}ms  "
+        f"p50 {statistics.median(timings):8.2f}ms  p95 {p95:8.2f}ms  "
+        f"first {timings[0]:8.2f}ms"
+    )
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shared client pool vs per-job clients")
+    parser.add_argument("--jobs", type=int, default=50, help="Number of simulated jobs (default: 50)")
+    parser.add_argument(
+        "--http-url",
+        default=os.getenv("AWS_ENDPOINT_URL", ""),
+        help="URL hit with the HTTP session each job (default: AWS_ENDPOINT_URL)"
+    )
+    args = parser.parse_args()
+
+    if not BUCKET_NAME:
+        print("AWS_BUCKET_NAME must be set", file=sys.stderr)
+        sys.exit(1)
+
+    def fresh_clients():
+        return create_s3_client(), create_robust_session()
+
+    pool = ClientPool(create_s3_client, create_robust_session)
+    pool.open()
+
+    def pooled_clients():
+        return pool.s3, pool.http_session
+
+    print(f"Per-job setup overhead over {args.jobs} jobs")
+    print("=" * 80)
+    before = measure("per-job", args.jobs, fresh_clients, args.http_url)
+    after = measure("pooled", args.jobs, pooled_clients, args.http_url)
+    print("=" * 80)
+    print(f"Saved {statistics.mean(before) - statistics.mean(after):.2f}ms per job on average")
+
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
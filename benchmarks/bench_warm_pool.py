@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-job yt-dlp overhead: a yt-dlp process per job vs warm workers
+
+Each simulated job downloads a small file from a local HTTP server through
+a saved extraction (--load-info-json), so the timings are dominated by
+what the warm pool removes: interpreter start, extractor imports and
+YoutubeDL setup. No network access or ffmpeg is needed:
+
+    python benchmarks/bench_warm_pool.py --jobs 30
+    python benchmarks/bench_warm_pool.py --ytdlp "python -m yt_dlp"
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.downloader import YTDLP_BINARY  # noqa: E402
+from app.supervisor import PROGRESS_ARGS, SubprocessSupervisor  # noqa: E402
+from app.warmpool import WarmWorkerPool  # noqa: E402
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory: str) -> HTTPServer:
+    server = HTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_info_json(directory: str, media_url: str) -> str:
+    """A saved extraction with a single format, as the admission check leaves behind"""
+    info = {
+        "id": "bench",
+        "title": "bench",
+        "ext": "mp4",
+        "extractor": "generic",
+        "extractor_key": "Generic",
+        "webpage_url": media_url,
+        "formats": [{"format_id": "0", "url": media_url, "ext": "mp4", "vcodec": "h264", "acodec": "aac"}],
+    }
+    path = os.path.join(directory, "bench.info.json")
+    with open(path, "w") as f:
+        json.dump(info, f)
+    return path
+
+
+async def measure(label: str, jobs: int, run_job, workdir: str) -> list:
+    timings = []
+    for i in range(jobs):
+        output_path = os.path.join(workdir, f"{label}-{i}.mp4")
+        started = time.perf_counter()
+        await run_job(output_path)
+        timings.append((time.perf_counter() - started) * 1000)
+        os.remove(output_path)
+
+    first = timings[0]
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+    print(
+        f"{label:<12} mean {statistics.mean(timings):8.2f}ms  "
+        f"p50 {statistics.median(timings):8.2f}ms  p95 {p95:8.2f}ms  "
+        f"first {first:8.2f}ms"
+    )
+    return timings
+
+
+async def run(args) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "video.mp4"), "wb") as f:
+            f.write(os.urandom(args.size_kb * 1024))
+        server = serve(workdir)
+        info_json = write_info_json(workdir, f"http://127.0.0.1:{server.server_port}/video.mp4")
+
+        def argv(output_path: str) -> list:
+            return [
+                "--no-warnings", "--quiet", "--progress", "-f", "b",
+                "-o", output_path, "--load-info-json", info_json,
+            ] + PROGRESS_ARGS
+
+        pool = WarmWorkerPool(size=1, max_jobs=args.jobs + 1)
+        supervisor = SubprocessSupervisor(warm_pool=pool)
+        binary = shlex.split(args.ytdlp)
+
+        print(f"Per-job yt-dlp overhead over {args.jobs} jobs ({args.size_kb}KB each)")
+        print("=" * 80)
+        before = await measure("per-job", args.jobs, lambda path: supervisor.run(binary + argv(path)), workdir)
+        started = time.perf_counter()
+        await supervisor.start()
+        print(f"{'warm start':<12} {(time.perf_counter() - started) * 1000:8.2f}ms, paid once per worker")
+        after = await measure("warm", args.jobs, lambda path: supervisor.run_warm(argv(path)), workdir)
+        print("=" * 80)
+        print(f"Saved {statistics.mean(before) - statistics.mean(after):.2f}ms per job on average")
+
+        await supervisor.shutdown()
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark warm yt-dlp workers vs a process per job")
+    parser.add_argument("--jobs", type=int, default=30, help="Number of simulated jobs (default: 30)")
+    parser.add_argument("--size-kb", type=int, default=256, help="Size of the downloaded file (default: 256)")
+    parser.add_argument(
+        "--ytdlp",
+        default=YTDLP_BINARY,
+        help="Command used for per-job processes (default: YTDLP_BINARY)"
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the yt-dlp binary used by the benchmarks
+
+Accepts the command lines built by app.downloader, ignores the URL and
+writes a file of configurable size at a configurable rate, printing the
+same progress lines the supervisor parses. The -o template is expanded
+like yt-dlp's, %(ext)s becoming the requested container. Point the service at it with
+YTDLP_BINARY=benchmarks/fake_ytdlp.py.
+
+Environment:
+    FAKE_YTDLP_SIZE_MB     Size of the produced file (default: 20)
+    FAKE_YTDLP_RATE_MBPS   Download rate, 0 for unlimited (default: 50)
+    FAKE_YTDLP_STARTUP_S   Simulated extraction time before the first byte (default: 0.5)
+    FAKE_YTDLP_MERGE_S     Simulated ffmpeg merge time (default: 0.5)
+    FAKE_YTDLP_FAIL_RATE   Fraction of runs that exit with an error (default: 0)
+"""
+
+import os
+import re
+import sys
+import time
+import random
+
+CHUNK_SIZE = 1024 * 1024
+TEMPLATE_FIELD = re.compile(r"%\((\w+)\)s")
+
+
+def option(args: list, name: str):
+    if name in args:
+        index = args.index(name)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return None
+
+
+def output_extension(args: list) -> str:
+    """Extension of the final file, the container the command asks for"""
+    for name in ("--audio-format", "--remux-video", "--merge-output-format"):
+        container = option(args, name)
+        if container:
+            return container
+    return "mp4"
+
+
+def expand_template(template: str, fields: dict) -> str:
+    """Fill in an output template's %(field)s placeholders, unknown fields become NA as in yt-dlp"""
+    return TEMPLATE_FIELD.sub(lambda match: str(fields.get(match.group(1), "NA")), template)
+
+
+def main():
+    args = sys.argv[1:]
+    size = int(float(os.getenv("FAKE_YTDLP_SIZE_MB", "20")) * 1024 * 1024)
+    rate = float(os.getenv("FAKE_YTDLP_RATE_MBPS", "50")) * 1024 * 1024
+    startup = float(os.getenv("FAKE_YTDLP_STARTUP_S", "0.5"))
+    merge = float(os.getenv("FAKE_YTDLP_MERGE_S", "0.5"))
+    fail_rate = float(os.getenv("FAKE_YTDLP_FAIL_RATE", "0"))
+
+    output_path = option(args, "-o") or "-"
+    to_stdout = output_path == "-"
+    if not to_stdout:
+        output_path = expand_template(output_path, {"ext": output_extension(args), "id": "fake", "title": "fake"})
+    merging = "--merge-output-format" in args
+    # Messages go to stderr when the video itself is written to stdout, as with yt-dlp
+    messages = sys.stderr if to_stdout else sys.stdout
+
+    time.sleep(startup)
+    if random.random() < fail_rate:
+        print("ERROR: [youtube] fake: Simulated extraction failure", file=sys.stderr)
+        sys.exit(1)
+
+    output = sys.stdout.buffer if to_stdout else open(output_path, "wb")
+    chunk = os.urandom(CHUNK_SIZE)
+    started = time.monotonic()
+    written = 0
+    try:
+        while written < size:
+            length = min(CHUNK_SIZE, size - written)
+            output.write(chunk[:length])
+            written += length
+
+            elapsed = time.monotonic() - started
+            if rate:
+                ahead = written / rate - elapsed
+                if ahead > 0:
+                    time.sleep(ahead)
+                    elapsed += ahead
+            speed = written / elapsed if elapsed else 0
+            eta = (size - written) / speed if speed else 0
+            print(f"[ytdl-progress] downloading {written} {size} NA {speed:.0f} {eta:.0f} 18", file=messages, flush=True)
+    finally:
+        if not to_stdout:
+            output.close()
+        else:
+            output.flush()
+
+    if merging:
+        print("[ytdl-postprocess] Merger started", file=messages, flush=True)
+        time.sleep(merge)
+        print("[ytdl-postprocess] Merger finished", file=messages, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Load test the service end to end against local stand-ins
+
+Starts a moto S3 server (unless --s3-endpoint is given) and the FastAPI app
+with YTDLP_BINARY pointed at benchmarks/fake_ytdlp.py, drives /download or
+/download-async at the requested concurrency and reports latency
+percentiles, jobs/minute, peak RSS of the service process tree and peak
+temp-disk usage.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/loadtest.py --mode sync --jobs 40 --concurrency 8 --size-mb 20
+
+Any extra service configuration can be passed through the environment,
+e.g. DOWNLOAD_WORKERS=4 STREAM_UPLOADS=true python benchmarks/loadtest.py.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FAKE_YTDLP = os.path.join(REPO_ROOT, "benchmarks", "fake_ytdlp.py")
+API_KEY = "benchmark-key"
+BUCKET = "ytdl-benchmark"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_moto():
+    from moto.server import ThreadedMotoServer
+
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def create_bucket(endpoint: str) -> None:
+    import boto3
+
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=endpoint,
+        region_name="us-east-1",
+        aws_access_key_id="benchmark",
+        aws_secret_access_key="benchmark",
+    )
+    try:
+        s3.create_bucket(Bucket=BUCKET)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+
+def start_app(port: int, endpoint: str, temp_dir: str, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "API_KEY": API_KEY,
+        "AWS_BUCKET_NAME": BUCKET,
+        "AWS_ENDPOINT_URL": endpoint,
+        "AWS_ACCESS_KEY_ID": env.get("AWS_ACCESS_KEY_ID", "benchmark"),
+        "AWS_SECRET_ACCESS_KEY": env.get("AWS_SECRET_ACCESS_KEY", "benchmark"),
+        "AWS_REGION": "us-east-1",
+        "YTDLP_BINARY": FAKE_YTDLP,
+        # Admission control extracts metadata through the yt_dlp library, which the fake cannot stand in for
+        "ADMISSION_CONTROL": "false",
+        "RATE_LIMIT_REQUESTS": str(10 ** 9),
+        "JOB_DB_PATH": os.path.join(temp_dir, "jobs.db"),
+        "UPLOAD_STATE_DIR": os.path.join(temp_dir, "uploads"),
+        "MEDIA_CACHE_DIR": os.path.join(temp_dir, "media"),
+        "JOB_WORK_DIR": os.path.join(temp_dir, "work"),
+        "TMPDIR": temp_dir,
+        "FAKE_YTDLP_SIZE_MB": str(args.size_mb),
+        "FAKE_YTDLP_RATE_MBPS": str(args.rate_mbps),
+        "FAKE_YTDLP_STARTUP_S": str(args.startup_s),
+        "FAKE_YTDLP_MERGE_S": str(args.merge_s),
+        "FAKE_YTDLP_FAIL_RATE": str(args.fail_rate),
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT,
+        env=env,
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Service did not become healthy within 30s")
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory of a process and all of its descendants, in bytes (Linux)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResourceSampler(threading.Thread):
+    """Tracks peak RSS and temp-disk usage while the load runs"""
+
+    def __init__(self, pid: int, temp_dir: str, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak_rss = max(self.peak_rss, process_tree_rss(self.pid))
+            # The job database lives in the same directory and is not temp media
+            self.peak_disk = max(self.peak_disk, directory_size(self.temp_dir) - self._db_size())
+            self._stop_event.wait(self.interval)
+
+    def _db_size(self) -> int:
+        return sum(
+            os.path.getsize(os.path.join(self.temp_dir, name))
+            for name in os.listdir(self.temp_dir)
+            if name.startswith("jobs.db")
+        )
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_job(base_url: str, mode: str, video_url: str, timeout: float) -> tuple:
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    started = time.perf_counter()
+    try:
+        if mode == "sync":
+            response = requests.post(
+                f"{base_url}/download", json={"youtube_url": video_url}, headers=headers, timeout=timeout
+            )
+            return time.perf_counter() - started, response.ok
+
+        response = requests.post(
+            f"{base_url}/download-async", json={"youtube_url": video_url}, headers=headers, timeout=30
+        )
+        if not response.ok:
+            return time.perf_counter() - started, False
+        task_id = response.json()["task_id"]
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            task = requests.get(f"{base_url}/tasks/{task_id}", headers=headers, timeout=30).json()
+            if task["status"] in ("done", "failed", "cancelled"):
+                return time.perf_counter() - started, task["status"] == "done"
+            time.sleep(0.2)
+        return time.perf_counter() - started, False
+    except requests.RequestException:
+        return time.perf_counter() - started, False
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test with fake yt-dlp and local S3")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="Endpoint to drive")
+    parser.add_argument("--jobs", type=int, default=40, help="Total requests (default: 40)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients (default: 8)")
+    parser.add_argument("--distinct-videos", type=int, default=0,
+                        help="Cycle over this many video IDs, 0 for all distinct (default: 0)")
+    parser.add_argument("--size-mb", type=float, default=20, help="Fake video size (default: 20)")
+    parser.add_argument("--rate-mbps", type=float, default=50, help="Fake download rate, 0 unlimited (default: 50)")
+    parser.add_argument("--startup-s", type=float, default=0.5, help="Fake extraction time (default: 0.5)")
+    parser.add_argument("--merge-s", type=float, default=0.5, help="Fake merge time (default: 0.5)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of fake downloads that fail")
+    parser.add_argument("--timeout", type=float, default=900, help="Per-job timeout in seconds")
+    parser.add_argument("--s3-endpoint", help="Use an existing S3 stand-in (e.g. MinIO) instead of moto")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    moto_server = None
+    if args.s3_endpoint:
+        endpoint = args.s3_endpoint
+    else:
+        moto_server, endpoint = start_moto()
+    create_bucket(endpoint)
+
+    temp_dir = tempfile.mkdtemp(prefix="ytdl-bench-")
+    port = free_port()
+    app_process = start_app(port, endpoint, temp_dir, args)
+    base_url = f"http://127.0.0.1:{port}"
+
+    distinct = args.distinct_videos or args.jobs
+    video_urls = [f"https://www.youtube.com/watch?v={i % distinct:011d}" for i in range(args.jobs)]
+
+    sampler = ResourceSampler(app_process.pid, temp_dir)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda url: run_job(base_url, args.mode, url, args.timeout), video_urls))
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+        app_process.terminate()
+        app_process.wait(timeout=30)
+        if moto_server:
+            moto_server.stop()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    failures = sum(1 for _, ok in results if not ok)
+    report = {
+        "mode": args.mode,
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "size_mb": args.size_mb,
+        "succeeded": len(latencies),
+        "failed": failures,
+        "elapsed_seconds": round(elapsed, 2),
+        "jobs_per_minute": round(len(latencies) / elapsed * 60, 2) if elapsed else 0.0,
+        "latency_p50_seconds": round(percentile(latencies, 50), 3),
+        "latency_p95_seconds": round(percentile(latencies, 95), 3),
+        "latency_p99_seconds": round(percentile(latencies, 99), 3),
+        "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+        "peak_temp_disk_mb": round(sampler.peak_disk / 1024 / 1024, 1),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("=" * 50)
+    for name, value in report.items():
+        print(f"{name:<24} {value}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""
+App modules read their configuration and open their stores on import,
+point them at a scratch directory and a fake bucket before any is imported
+"""
+
+import os
+import tempfile
+
+_state_dir = tempfile.mkdtemp(prefix="ytdl-tests-")
+
+os.environ.update(
+    JOB_DB_PATH=os.path.join(_state_dir, "jobs.db"),
+    API_KEY_DB_PATH=os.path.join(_state_dir, "api_keys.db"),
+    JOB_WORK_DIR=os.path.join(_state_dir, "work"),
+    MEDIA_CACHE_DIR=os.path.join(_state_dir, "media"),
+    UPLOAD_STATE_DIR=os.path.join(_state_dir, "uploads"),
+    COOKIE_POOL_DIR="",
+    AWS_BUCKET_NAME="ytdl-test-bucket",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+    AWS_REGION="us-east-1",
+    AWS_DEFAULT_REGION="us-east-1",
+)
@@ -0,0 +1,55 @@
+import pytest
+
+from app.admission import _downgrade
+from app.profiles import get_profile
+
+MB = 1024 * 1024
+
+INFO = {
+    "duration": 100,
+    "formats": [
+        {"format_id": "18", "ext": "mp4", "height": 360, "vcodec": "avc1", "acodec": "mp4a", "filesize": 10 * MB},
+        {"format_id": "22", "ext": "mp4", "height": 720, "vcodec": "avc1", "acodec": "mp4a", "filesize": 40 * MB},
+        # No size, estimated from 1000 kbit/s over the duration: 12.5MB
+        {"format_id": "135", "ext": "mp4", "height": 480, "vcodec": "avc1", "acodec": "none", "tbr": 1000},
+        {"format_id": "136", "ext": "mp4", "height": 720, "vcodec": "avc1", "acodec": "none", "filesize": 30 * MB},
+        {"format_id": "137", "ext": "mp4", "height": 1080, "vcodec": "avc1", "acodec": "none", "filesize": 100 * MB},
+        {"format_id": "248", "ext": "webm", "height": 1080, "vcodec": "vp9", "acodec": "none", "filesize": 80 * MB},
+        {"format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a", "abr": 128, "filesize": 5 * MB},
+        {"format_id": "251", "ext": "webm", "vcodec": "none", "acodec": "opus", "abr": 160, "filesize": 4 * MB},
+        {"format_id": "sb0", "ext": "mhtml", "vcodec": "none", "acodec": "none"},
+    ],
+}
+
+
+@pytest.mark.parametrize("max_mb, expected", [
+    (200, "137+251"),
+    (50, "22"),
+    (20, "135+251"),
+    (12, "18"),
+    (1, None),
+])
+def test_downgrade_merged(max_mb, expected):
+    assert _downgrade(INFO, max_mb * MB, streaming=False, profile=get_profile("mp4-1080")) == expected
+
+
+def test_downgrade_respects_profile_height():
+    assert _downgrade(INFO, 200 * MB, streaming=False, profile=get_profile("mp4-480")) == "135+251"
+
+
+def test_downgrade_streaming_needs_a_single_format():
+    profile = get_profile("mp4-1080")
+    assert _downgrade(INFO, 200 * MB, streaming=True, profile=profile) == "22"
+    assert _downgrade(INFO, 20 * MB, streaming=True, profile=profile) == "18"
+
+
+def test_downgrade_webm_keeps_to_webm_formats():
+    assert _downgrade(INFO, 200 * MB, streaming=False, profile=get_profile("webm-1080")) == "248+251"
+    assert _downgrade(INFO, 50 * MB, streaming=False, profile=get_profile("webm-1080")) is None
+
+
+def test_downgrade_audio():
+    profile = get_profile("audio-m4a")
+    assert _downgrade(INFO, 200 * MB, streaming=False, profile=profile) == "251"
+    assert _downgrade(INFO, 200 * MB, streaming=True, profile=profile) == "140"
+    assert _downgrade(INFO, 1 * MB, streaming=False, profile=profile) is None
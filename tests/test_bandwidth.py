@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import bandwidth
+from app.auth import DEFAULT_PRIORITY
+from app.bandwidth import BANDWIDTH_BURST_SECONDS, BandwidthShaper, priority_weight
+
+BUDGET = 1000.0  # Bytes per second
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic clock of the shaper, advanced by hand"""
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(bandwidth, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_disabled():
+    shaper = BandwidthShaper(0)
+    download_id = shaper.register()
+    assert download_id is None
+    assert shaper.consume(download_id, 10 ** 9) == 0.0
+
+
+def test_burst_is_not_paused(clock):
+    shaper = BandwidthShaper(BUDGET)
+    download_id = shaper.register()
+    assert shaper.consume(download_id, int(BUDGET * BANDWIDTH_BURST_SECONDS)) == 0.0
+
+
+def test_overdraft_pauses_for_its_debt(clock):
+    shaper = BandwidthShaper(BUDGET)
+    download_id = shaper.register()
+    burst = int(BUDGET * BANDWIDTH_BURST_SECONDS)
+
+    assert shaper.consume(download_id, burst + 500) == pytest.approx(0.5)
+    assert shaper.throttled_seconds == pytest.approx(0.5)
+    # Paid back by sitting out the pause
+    clock.now += 0.5
+    assert shaper.consume(download_id, burst + 500) == 0.0
+
+
+def test_credit_refills_at_the_share(clock):
+    shaper = BandwidthShaper(BUDGET)
+    download_id = shaper.register()
+    burst = int(BUDGET * BANDWIDTH_BURST_SECONDS)
+    shaper.consume(download_id, burst)
+
+    clock.now += 1.0
+    assert shaper.consume(download_id, burst + 1000) == 0.0
+    assert shaper.consume(download_id, burst + 1300) == pytest.approx(0.3)
+
+
+def test_credit_saved_up_is_capped_at_the_burst(clock):
+    shaper = BandwidthShaper(BUDGET)
+    download_id = shaper.register()
+
+    clock.now += 3600
+    burst = int(BUDGET * BANDWIDTH_BURST_SECONDS)
+    assert shaper.consume(download_id, burst + 200) == pytest.approx(0.2)
+
+
+def test_small_overdraft_is_carried_over(clock):
+    shaper = BandwidthShaper(BUDGET)
+    download_id = shaper.register()
+    burst = int(BUDGET * BANDWIDTH_BURST_SECONDS)
+
+    # 50ms of debt is under MIN_PAUSE_SECONDS
+    assert shaper.consume(download_id, burst + 50) == 0.0
+    assert shaper.consume(download_id, burst + 150) == pytest.approx(0.15)
+
+
+def test_received_bytes_only_count_once(clock):
+    shaper = BandwidthShaper(BUDGET)
+    download_id = shaper.register()
+    burst = int(BUDGET * BANDWIDTH_BURST_SECONDS)
+
+    shaper.consume(download_id, burst)
+    assert shaper.consume(download_id, burst) == 0.0
+    # Totals going backwards never add credit
+    assert shaper.consume(download_id, 0) == 0.0
+    assert shaper.consume(download_id, burst + 200) == pytest.approx(0.2)
+
+
+def test_priority_weight():
+    assert priority_weight(0) == pytest.approx(2 * priority_weight(DEFAULT_PRIORITY))
+    assert priority_weight(0) == pytest.approx(3 * priority_weight(2 * DEFAULT_PRIORITY))
+    assert priority_weight(-5) == priority_weight(0)
+
+
+def test_shares_follow_priority(clock):
+    shaper = BandwidthShaper(1200)
+    urgent = shaper.register(priority=0)
+    bulk = shaper.register(priority=DEFAULT_PRIORITY)
+
+    assert shaper.share(urgent) == pytest.approx(800)
+    assert shaper.share(bulk) == pytest.approx(400)
+
+    # Both save up a full burst of their share, the same overdraft costs the smaller share a longer pause
+    clock.now += 3600
+    assert shaper.consume(urgent, int(800 * BANDWIDTH_BURST_SECONDS) + 200) == pytest.approx(0.25)
+    assert shaper.consume(bulk, int(400 * BANDWIDTH_BURST_SECONDS) + 200) == pytest.approx(0.5)
+
+
+def test_share_grows_when_others_finish(clock):
+    shaper = BandwidthShaper(BUDGET)
+    first = shaper.register()
+    second = shaper.register()
+    assert shaper.share(first) == pytest.approx(BUDGET / 2)
+
+    shaper.unregister(second)
+    assert shaper.share(first) == pytest.approx(BUDGET)
+    assert shaper.consume(second, 10 ** 6) == 0.0
@@ -0,0 +1,215 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app import delivery
+from app.delivery import (
+    RangeNotSatisfiable,
+    SendfileResponse,
+    content_headers,
+    parse_range,
+    video_response,
+)
+
+VIDEO = bytes(range(256)) * 40  # 10240 bytes
+
+
+def new_key() -> str:
+    # Fresh per test, video metadata is cached by key
+    return f"{uuid.uuid4()}/original.mp4"
+
+
+async def _send(response, extensions=None) -> list:
+    messages = []
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "extensions": extensions or {}}
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await response(scope, receive, send)
+    return messages
+
+
+def serve(key, range_header=None, head=False):
+    """Status, headers and body of video_response as sent to a client"""
+    response = asyncio.run(video_response(key, range_header, head=head))
+    if response is None:
+        return None
+    messages = asyncio.run(_send(response))
+    start = messages[0]
+    headers = {name.decode().lower(): value.decode() for name, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], headers, body
+
+
+@pytest.fixture
+def cached(tmp_path, monkeypatch):
+    """Store a video in the media cache, returns a function taking the bytes and giving its key"""
+    entries = {}
+    monkeypatch.setattr(delivery.media_cache, "lookup_s3_key", entries.get)
+
+    def add(data: bytes = VIDEO) -> str:
+        key = new_key()
+        path = tmp_path / key.replace("/", "_")
+        path.write_bytes(data)
+        entries[key] = {"path": str(path), "size": len(data), "content_type": "video/mp4"}
+        return key
+
+    return add
+
+
+@pytest.fixture
+def uploaded(monkeypatch):
+    """Upload a video to a mocked bucket, returns a function taking the bytes and giving its key"""
+    monkeypatch.setattr(delivery.media_cache, "lookup_s3_key", lambda key: None)
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=delivery.BUCKET_NAME)
+        monkeypatch.setattr(delivery, "client_pool", SimpleNamespace(s3=s3))
+
+        def add(data: bytes = VIDEO) -> str:
+            key = new_key()
+            s3.put_object(Bucket=delivery.BUCKET_NAME, Key=key, Body=data, ContentType="video/mp4")
+            return key
+
+        yield add
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-100", (100, 100)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("BYTES = 10-19", (10, 19)),
+    ("bytes=10-5", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=abc-", None),
+    ("bytes=5", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=1000-1100", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=0-", 0),
+    ("bytes=-10", 0),
+])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+def test_content_headers_full():
+    headers = content_headers(1000, "video/mp4", None)
+    assert headers["Content-Length"] == "1000"
+    assert headers["Content-Type"] == "video/mp4"
+    assert headers["Accept-Ranges"] == "bytes"
+    assert "Content-Range" not in headers
+
+
+def test_content_headers_partial():
+    headers = content_headers(1000, None, (100, 199))
+    assert headers["Content-Length"] == "100"
+    assert headers["Content-Range"] == "bytes 100-199/1000"
+    assert headers["Content-Type"] == "application/octet-stream"
+
+
+@pytest.fixture(params=["cache", "s3"])
+def source(request):
+    return request.getfixturevalue("cached" if request.param == "cache" else "uploaded")
+
+
+def test_full_response(source):
+    status, headers, body = serve(source())
+    assert status == 200
+    assert headers["content-length"] == str(len(VIDEO))
+    assert "content-range" not in headers
+    assert body == VIDEO
+
+
+def test_partial_response(source):
+    status, headers, body = serve(source(), "bytes=100-1099")
+    assert status == 206
+    assert headers["content-range"] == f"bytes 100-1099/{len(VIDEO)}"
+    assert headers["content-length"] == "1000"
+    assert body == VIDEO[100:1100]
+
+
+def test_suffix_range_response(source):
+    status, headers, body = serve(source(), "bytes=-300")
+    assert status == 206
+    assert body == VIDEO[-300:]
+
+
+def test_multiple_ranges_serve_whole_file(source):
+    status, _, body = serve(source(), "bytes=0-9,20-29")
+    assert status == 200
+    assert body == VIDEO
+
+
+def test_range_past_end_not_satisfiable(source):
+    status, headers, body = serve(source(), f"bytes={len(VIDEO)}-")
+    assert status == 416
+    assert headers["content-range"] == f"bytes */{len(VIDEO)}"
+    assert body == b""
+
+
+def test_empty_file(source):
+    key = source(b"")
+    status, headers, body = serve(key)
+    assert status == 200
+    assert headers["content-length"] == "0"
+    assert body == b""
+    assert serve(key, "bytes=0-")[0] == 416
+
+
+def test_head_has_no_body(source):
+    status, headers, body = serve(source(), "bytes=0-9", head=True)
+    assert status == 206
+    assert headers["content-length"] == "10"
+    assert body == b""
+
+
+def test_missing_video(uploaded):
+    assert asyncio.run(video_response(new_key(), None)) is None
+
+
+def test_cached_file_truncated_while_sending(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(VIDEO)
+    file = open(path, "rb")
+    response = SendfileResponse(file, 0, len(VIDEO), 200, content_headers(len(VIDEO), "video/mp4", None))
+    # Evicted and rewritten after the response was built
+    path.write_bytes(VIDEO[:1000])
+
+    messages = asyncio.run(_send(response))
+    assert b"".join(message.get("body", b"") for message in messages[1:]) == VIDEO[:1000]
+    assert messages[-1]["more_body"] is False
+    assert file.closed
+
+
+def test_zero_copy_send(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(VIDEO)
+    file = open(path, "rb")
+    response = SendfileResponse(file, 100, 200, 206, content_headers(len(VIDEO), "video/mp4", (100, 299)))
+
+    messages = asyncio.run(_send(response, extensions={"http.response.zerocopysend": {}}))
+    assert messages[1]["type"] == "http.response.zerocopysend"
+    assert (messages[1]["offset"], messages[1]["count"]) == (100, 200)
+    assert file.closed
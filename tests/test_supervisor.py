@@ -0,0 +1,90 @@
+import pytest
+
+from app.supervisor import POSTPROCESS_PREFIX, PROGRESS_PREFIX, _DownloadMonitor, parse_progress_line
+
+
+def progress(status: str, downloaded: int) -> dict:
+    return {"stage": "download", "status": status, "downloaded_bytes": downloaded}
+
+
+def test_parse_download_progress():
+    event = parse_progress_line(f"{PROGRESS_PREFIX} downloading 1024 4096 NA 512.5 6 137")
+    assert event == {
+        "stage": "download",
+        "status": "downloading",
+        "downloaded_bytes": 1024,
+        "total_bytes": 4096,
+        "percent": 25.0,
+        "speed": 512.5,
+        "eta": 6.0,
+        "format_id": "137",
+    }
+
+
+def test_parse_download_progress_with_estimated_total():
+    event = parse_progress_line(f"{PROGRESS_PREFIX} downloading 500 NA 2000.0 NA NA")
+    assert event["total_bytes"] == 2000
+    assert event["percent"] == 25.0
+    assert event["speed"] is None
+    assert event["format_id"] is None
+
+
+def test_parse_download_progress_without_sizes():
+    event = parse_progress_line(f"{PROGRESS_PREFIX} downloading NA NA NA NA NA 18")
+    assert event["downloaded_bytes"] is None
+    assert event["total_bytes"] is None
+    assert event["percent"] is None
+
+
+def test_parse_download_progress_caps_percent():
+    # Estimates can come in under the real size
+    event = parse_progress_line(f"{PROGRESS_PREFIX} downloading 3000 NA 2000 NA NA")
+    assert event["percent"] == 100.0
+
+
+@pytest.mark.parametrize("line", [
+    f"{PROGRESS_PREFIX} downloading 1024",
+    f"{POSTPROCESS_PREFIX} Merger",
+    "[download] Destination: video.f137.mp4",
+    "WARNING: unable to extract uploader id",
+    "",
+])
+def test_parse_other_output(line):
+    assert parse_progress_line(line) is None
+
+
+def test_parse_postprocess():
+    assert parse_progress_line(f"{POSTPROCESS_PREFIX} Merger started") == {
+        "stage": "merge", "postprocessor": "Merger", "status": "started",
+    }
+    assert parse_progress_line(f"{POSTPROCESS_PREFIX} FFmpegExtractAudio finished") == {
+        "stage": "postprocess", "postprocessor": "FFmpegExtractAudio", "status": "finished",
+    }
+
+
+@pytest.fixture
+def monitor():
+    return _DownloadMonitor(supervisor=None, process=None, on_progress=None, max_bytes=None)
+
+
+def test_count_single_stream(monitor):
+    assert monitor.count(progress("downloading", 100)) == 100
+    assert monitor.count(progress("downloading", 100)) == 100
+    assert monitor.count(progress("downloading", 250)) == 250
+    assert monitor.count(progress("finished", 300)) == 300
+
+
+def test_count_video_then_audio(monitor):
+    monitor.count(progress("downloading", 500))
+    assert monitor.count(progress("finished", 1000)) == 1000
+    # The audio stream reports from zero again
+    assert monitor.count(progress("downloading", 50)) == 1050
+    assert monitor.count(progress("downloading", 200)) == 1200
+    assert monitor.count(progress("finished", 300)) == 1300
+
+
+def test_count_stream_change_without_finished_event(monitor):
+    monitor.count(progress("downloading", 800))
+    # Lines can be lost, a total going backwards starts a new stream
+    assert monitor.count(progress("downloading", 100)) == 900
+    assert monitor.count(progress("downloading", 150)) == 950
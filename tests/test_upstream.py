@@ -0,0 +1,33 @@
+import pytest
+
+from app.downloader import VideoProcessingError
+from app.upstream import ErrorKind, UpstreamThrottled, classify_error, is_upstream_error
+
+
+@pytest.mark.parametrize("message, kind", [
+    ("ERROR: [youtube] dQw4w9WgXcQ: HTTP Error 429: Too Many Requests", ErrorKind.THROTTLED),
+    ("ERROR: [youtube] dQw4w9WgXcQ: This content isn't available, try again later.", ErrorKind.THROTTLED),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm you're not a bot", ErrorKind.BLOCKED),
+    ("WARNING: The provided YouTube account cookies are no longer valid", ErrorKind.BLOCKED),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Video unavailable", ErrorKind.UNAVAILABLE),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Private video. Sign in if you've been granted access", ErrorKind.UNAVAILABLE),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm your age", ErrorKind.UNAVAILABLE),
+    ("ERROR: Requested format is not available", ErrorKind.UNAVAILABLE),
+    ("ERROR: Unable to download webpage: <urlopen error timed out>", ErrorKind.TRANSIENT),
+    ("ERROR: unable to download video data: HTTP Error 503: Service Unavailable", ErrorKind.TRANSIENT),
+    ("ERROR: Postprocessing: Conversion failed!", ErrorKind.UNKNOWN),
+    ("", ErrorKind.UNKNOWN),
+])
+def test_classify_error(message, kind):
+    assert classify_error(message) == kind
+
+
+def test_throttling_wins_over_other_matches():
+    assert classify_error("Unable to download webpage: HTTP Error 429: Too Many Requests") == ErrorKind.THROTTLED
+
+
+def test_is_upstream_error():
+    assert is_upstream_error(VideoProcessingError("Failed to download video: HTTP Error 429"))
+    assert is_upstream_error(UpstreamThrottled("Sign in required", ErrorKind.BLOCKED))
+    assert not is_upstream_error(VideoProcessingError("Failed to download video: Video unavailable"))
+    assert not is_upstream_error(VideoProcessingError("Failed to download video: timed out"))